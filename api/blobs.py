@@ -0,0 +1,30 @@
+"""
+模型文件API模块 - 按内容哈希向局域网内的其他实例提供模型文件
+"""
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+from model_manager import get_model_manager
+from utils.sources import normalize_digest
+
+router = APIRouter(prefix="/blobs", tags=["模型文件"])
+
+# 全局模型管理器实例
+model_manager = get_model_manager()
+
+
+@router.api_route("/{digest}", methods=["GET", "HEAD"])
+def get_blob(digest: str):
+    """
+    下载模型文件内容（支持 Range 断点续传），供其他实例作为模型来源拉取
+    
+    - **digest**: sha256-<hex>、sha256:<hex> 或 <hex>
+    """
+    try:
+        digest = normalize_digest(digest)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    blob = model_manager.downloader.blobs.path(digest)
+    if not blob.exists():
+        raise HTTPException(status_code=404, detail="内容不存在")
+    return FileResponse(blob, media_type="application/octet-stream")
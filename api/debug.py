@@ -0,0 +1,149 @@
+"""
+调试API模块
+"""
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+import config
+from utils.tracing import trace_store
+from utils.profiling import sampling_profiler, endpoint_profiler
+from utils.pressure import memory_controller
+from utils.preload import preloader
+from model_manager import get_model_manager
+
+# 支持 cProfile 开关的接口
+PROFILED_ENDPOINTS = ("generate", "chat", "score")
+# cProfile 报告支持的排序字段（pstats 的排序键）
+PROFILE_SORT_KEYS = ("cumulative", "tottime", "calls", "ncalls", "pcalls", "name", "filename", "line")
+
+router = APIRouter(prefix="/debug", tags=["调试"])
+
+
+@router.get("/traces")
+async def list_traces(
+    since: Optional[float] = 3600,
+    slowest: Optional[int] = None,
+    name: Optional[str] = None,
+    status: Optional[str] = None
+):
+    """
+    查询请求追踪
+
+    - **since**: 只返回最近多少秒内的请求（默认3600，0表示全部）
+    - **slowest**: 返回最慢的N个请求（可选）
+    - **name**: 按请求过滤，如 "POST /generate"（可选）
+    - **status**: 按状态过滤，ok 或 error（可选）
+    """
+    traces = trace_store.query(since_seconds=since or None, slowest=slowest, name=name, status=status)
+    return {
+        "success": True,
+        "data": {
+            "traces": traces,
+            "total": len(traces)
+        }
+    }
+
+
+@router.get("/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    """获取指定追踪的阶段明细"""
+    trace = trace_store.get(trace_id)
+    if not trace:
+        raise HTTPException(status_code=404, detail="追踪不存在")
+    return {
+        "success": True,
+        "data": trace
+    }
+
+
+@router.post("/profile", response_class=PlainTextResponse)
+def sample_profile(seconds: float = 10, interval_ms: Optional[float] = None, include_idle: bool = False):
+    """
+    对当前工作进程做采样剖析，返回火焰图折叠栈文本
+
+    - **seconds**: 采样时长（秒，默认10，不超过 PROFILE_MAX_SECONDS）
+    - **interval_ms**: 采样间隔（毫秒，默认 PROFILE_INTERVAL_MS）
+    - **include_idle**: 是否包含空闲等待中的线程（默认False）
+
+    结果可直接用 flamegraph.pl 或 speedscope 打开
+    """
+    if seconds <= 0 or seconds > config.PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds 需在 0 到 {config.PROFILE_MAX_SECONDS} 之间")
+    interval = (interval_ms or config.PROFILE_INTERVAL_MS) / 1000
+    if interval < 0.001:
+        raise HTTPException(status_code=400, detail="interval_ms 不能小于1")
+
+    collapsed = sampling_profiler.sample(seconds, interval, include_idle)
+    if collapsed is None:
+        raise HTTPException(status_code=409, detail="已有采样剖析在进行中")
+    return PlainTextResponse(
+        collapsed,
+        headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'}
+    )
+
+
+@router.get("/single-flight")
+async def single_flight_stats():
+    """查看请求合并统计（进行中的生成数、被合并的请求数）"""
+    return {"success": True, "data": get_model_manager().flights.stats()}
+
+
+@router.get("/cprofile")
+async def cprofile_status():
+    """查看各接口的 cProfile 开关状态"""
+    return {
+        "success": True,
+        "data": {
+            "endpoints": list(PROFILED_ENDPOINTS),
+            "enabled": endpoint_profiler.status()
+        }
+    }
+
+
+@router.post("/cprofile/{endpoint}")
+async def toggle_cprofile(endpoint: str, enabled: bool = True, reset: bool = False):
+    """
+    开启/关闭某个接口的 cProfile（用于基准测试）
+
+    - **endpoint**: generate、chat 或 score
+    - **enabled**: 是否开启（默认True）
+    - **reset**: 是否清空已累积的统计（默认False）
+    """
+    if endpoint not in PROFILED_ENDPOINTS:
+        raise HTTPException(status_code=404, detail=f"不支持的接口: {endpoint}")
+    endpoint_profiler.set_enabled(endpoint, enabled, reset)
+    return {
+        "success": True,
+        "message": f"{endpoint} 剖析已{'开启' if enabled else '关闭'}"
+    }
+
+
+@router.get("/cprofile/{endpoint}", response_class=PlainTextResponse)
+async def cprofile_report(endpoint: str, sort: str = "cumulative", limit: int = 50):
+    """
+    获取某个接口累积的 cProfile 报告
+
+    - **sort**: 排序字段（cumulative/tottime/calls 等，默认cumulative）
+    - **limit**: 输出的函数数量（默认50）
+    """
+    if sort not in PROFILE_SORT_KEYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的排序字段: {sort}（可选 {', '.join(PROFILE_SORT_KEYS)}）"
+        )
+    report = endpoint_profiler.report(endpoint, sort, limit)
+    if report is None:
+        raise HTTPException(status_code=404, detail="该接口未开启过剖析")
+    return PlainTextResponse(report)
+
+
+@router.get("/memory")
+async def memory_pressure_status():
+    """查看内存压力控制状态（当前级别、最近一次采样、降载记录）"""
+    return {"success": True, "data": memory_controller.status()}
+
+
+@router.get("/preload")
+async def preload_status():
+    """查看预测性预取状态（各模型的预计请求数、预取和预加载记录）"""
+    return {"success": True, "data": preloader.status()}
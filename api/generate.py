@@ -2,14 +2,18 @@
 文本生成API模块
 """
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import Dict, Any, Optional
-from model_manager import ModelManager
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Dict, Any, Optional, List
+from model_manager import get_model_manager
+from api.responses import FastJSONResponse
+from utils.serialization import dumps_line
+import config
 
 router = APIRouter(prefix="/generate", tags=["文本生成"])
 
 # 全局模型管理器实例
-model_manager = ModelManager()
+model_manager = get_model_manager()
 
 
 class GenerateRequest(BaseModel):
@@ -21,21 +25,62 @@ class GenerateRequest(BaseModel):
     top_p: float = 0.9
     top_k: int = 40
     repeat_penalty: float = 1.1
-    num_return_sequences: int = 1
+    num_return_sequences: int = Field(1, ge=1, le=config.MAX_RETURN_SEQUENCES)
+    stop: Optional[List[str]] = None
+    grammar: Optional[str] = None
+    json_schema: Optional[Dict[str, Any]] = None
+    adapter: Optional[str] = None
+    adapter_scale: float = 1.0
+    logprobs: bool = False
+    top_logprobs: int = 0
+    compact: bool = False
+
+
+class ChatMessage(BaseModel):
+    """聊天消息"""
+    role: str
+    content: str
+
+
+class ChatRequest(BaseModel):
+    """聊天补全请求"""
+    model_name: str
+    messages: List[ChatMessage]
+    max_tokens: int = 32768
+    temperature: float = 0.7
+    stream: bool = False
+    stop: Optional[List[str]] = None
+    grammar: Optional[str] = None
+    json_schema: Optional[Dict[str, Any]] = None
+    adapter: Optional[str] = None
+    adapter_scale: float = 1.0
+    logprobs: bool = False
+    top_logprobs: int = 0
+    compact: bool = False
+
+
+class TokenCountRequest(BaseModel):
+    """token计数请求"""
+    model_name: str
+    texts: List[str]
+    add_bos: bool = True
 
 
 class GenerateResponse(BaseModel):
     """文本生成响应"""
     success: bool
     generated_text: Optional[str] = None
+    choices: Optional[List[Dict[str, Any]]] = None
     prompt: Optional[str] = None
     model_name: Optional[str] = None
     parameters: Optional[Dict[str, Any]] = None
+    usage: Optional[Dict[str, Any]] = None
+    logprobs: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
 
 
 @router.post("", response_model=GenerateResponse)
-async def generate_text(request: GenerateRequest):
+def generate_text(request: GenerateRequest):
     """
     生成文本
     
@@ -46,7 +91,15 @@ async def generate_text(request: GenerateRequest):
     - **top_p**: top-p采样参数（默认0.9）
     - **top_k**: top-k采样参数（默认40）
     - **repeat_penalty**: 重复惩罚（默认1.1）
-    - **num_return_sequences**: 返回序列数量（默认1）
+    - **num_return_sequences**: 返回序列数量（默认1，最多 MAX_RETURN_SEQUENCES，提示词只评估一次）
+    - **stop**: 停止词列表，在模型自身的回合结束标记之外追加（可选）
+    - **grammar**: GBNF 语法，采样时约束输出（可选）
+    - **json_schema**: JSON Schema，约束输出为符合该结构的JSON（可选，与grammar二选一）
+    - **adapter**: 应用在基础模型上的LoRA适配器名称（可选，model_name 也可直接使用适配器名称）
+    - **adapter_scale**: LoRA适配器强度（默认1.0）
+    - **logprobs**: 返回每个输出token的对数概率（默认False）
+    - **top_logprobs**: 每个位置额外返回的概率最高的候选数（0~20，默认0）
+    - **compact**: 精简响应，不回显 prompt/parameters，单个候选时省略 choices（默认False）
     """
     try:
         result = model_manager.generate_text(
@@ -57,22 +110,35 @@ async def generate_text(request: GenerateRequest):
             top_p=request.top_p,
             top_k=request.top_k,
             repeat_penalty=request.repeat_penalty,
-            num_return_sequences=request.num_return_sequences
+            n=request.num_return_sequences,
+            stop=request.stop,
+            grammar=request.grammar,
+            json_schema=request.json_schema,
+            adapter=request.adapter,
+            adapter_scale=request.adapter_scale,
+            logprobs=request.logprobs,
+            top_logprobs=request.top_logprobs
         )
         
+        # 直接返回响应对象，跳过 response_model 的二次校验与编码
         if "error" in result:
-            return GenerateResponse(
-                success=False,
-                error=result["error"]
-            )
+            return FastJSONResponse({"success": False, "error": result["error"]})
         
-        return GenerateResponse(
-            success=True,
-            generated_text=result["generated_text"],
-            prompt=result["prompt"],
-            model_name=result["model_name"],
-            parameters=result["parameters"]
-        )
+        content = {
+            "success": True,
+            "generated_text": result["generated_text"],
+            "model_name": result["model_name"],
+            "usage": result["usage"]
+        }
+        if not request.compact:
+            content["choices"] = result["choices"]
+            content["prompt"] = result["prompt"]
+            content["parameters"] = result["parameters"]
+        elif len(result["choices"]) > 1:
+            content["choices"] = result["choices"]
+        if "logprobs" in result:
+            content["logprobs"] = result["logprobs"]
+        return FastJSONResponse(content)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -123,6 +189,88 @@ async def generate_text_stream(request: GenerateRequest):
         yield {"error": str(e)}
 
 
+@router.post("/chat")
+def chat_completion(request: ChatRequest):
+    """
+    聊天补全
+    
+    - **model_name**: 模型名称
+    - **messages**: 消息列表，格式: [{"role": "user", "content": "..."}]
+    - **max_tokens**: 最大生成token数
+    - **temperature**: 温度参数（默认0.7）
+    - **stream**: 是否流式返回（NDJSON，每行一个片段）
+    - **stop**: 停止词列表，在模型自身的回合结束标记之外追加（可选）
+    - **grammar**: GBNF 语法，采样时约束输出（可选）
+    - **json_schema**: JSON Schema，约束输出为符合该结构的JSON（可选，与grammar二选一）
+    - **adapter**: 应用在基础模型上的LoRA适配器名称（可选，model_name 也可直接使用适配器名称）
+    - **adapter_scale**: LoRA适配器强度（默认1.0）
+    - **logprobs**: 返回每个输出token的对数概率，流式时每个片段携带该片段对应的token（默认False）
+    - **top_logprobs**: 每个位置额外返回的概率最高的候选数（0~20，默认0）
+    - **compact**: 精简响应，不返回 model_path（默认False）
+
+    流式片段只携带增量 content，完整文本仅在最后一个片段（done=true）中返回
+    """
+    messages = [{"role": m.role, "content": m.content} for m in request.messages]
+    
+    if request.stream:
+        def chunk_stream():
+            for chunk in model_manager.chat_completion_stream(
+                model_name=request.model_name,
+                messages=messages,
+                max_tokens=request.max_tokens,
+                temperature=request.temperature,
+                stop=request.stop,
+                grammar=request.grammar,
+                json_schema=request.json_schema,
+                adapter=request.adapter,
+                adapter_scale=request.adapter_scale,
+                logprobs=request.logprobs,
+                top_logprobs=request.top_logprobs
+            ):
+                yield dumps_line(chunk)
+        
+        return StreamingResponse(chunk_stream(), media_type="application/x-ndjson")
+    
+    try:
+        result = model_manager.chat_completion(
+            model_name=request.model_name,
+            messages=messages,
+            max_tokens=request.max_tokens,
+            temperature=request.temperature,
+            stop=request.stop,
+            grammar=request.grammar,
+            json_schema=request.json_schema,
+            adapter=request.adapter,
+            adapter_scale=request.adapter_scale,
+            logprobs=request.logprobs,
+            top_logprobs=request.top_logprobs
+        )
+        if "error" in result:
+            return FastJSONResponse({"success": False, "error": result["error"]})
+        if request.compact:
+            result.pop("model_path", None)
+        return FastJSONResponse(result)
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/tokens")
+def count_tokens(request: TokenCountRequest):
+    """
+    批量计算token数（只加载模型词表，不加载权重、不等待推理）
+    
+    - **model_name**: 模型名称
+    - **texts**: 文本列表
+    - **add_bos**: 是否计入BOS等特殊token（默认True，与生成时的提示词计数一致）
+    """
+    result = model_manager.count_tokens(request.model_name, request.texts, request.add_bos)
+    if "error" in result:
+        status_code = 404 if result["error"] == "模型不存在" else 500
+        raise HTTPException(status_code=status_code, detail=result["error"])
+    return FastJSONResponse({"success": True, "counts": result["counts"], "total": result["total"]})
+
+
 @router.get("/models")
 async def get_available_models():
     """获取可用于生成的模型列表"""
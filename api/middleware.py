@@ -0,0 +1,93 @@
+"""
+HTTP中间件模块
+"""
+from api.responses import FastJSONResponse
+from utils.pressure import memory_controller
+from utils.tracing import start_trace, finish_trace, record_error
+
+TRACE_HEADER = "x-request-id"
+
+
+class TracingMiddleware:
+    """
+    为每个HTTP请求创建追踪（纯ASGI实现，流式响应在最后一个片段发送后才结束追踪）
+
+    请求头带 X-Request-ID 时沿用该ID，响应头中返回追踪ID。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace_id = None
+        for key, value in scope.get("headers", []):
+            if key == TRACE_HEADER.encode():
+                trace_id = value.decode("latin-1")[:64]
+                break
+
+        trace = start_trace(f"{scope['method']} {scope['path']}", trace_id)
+        finished = False
+
+        async def send_with_trace(message):
+            nonlocal finished
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                trace.attrs["status_code"] = status
+                if status >= 500 and trace.error is None:
+                    trace.set_error(f"HTTP {status}")
+                headers = list(message.get("headers", []))
+                headers.append((TRACE_HEADER.encode(), trace.trace_id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finished = True
+                finish_trace(trace)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except Exception as e:
+            record_error(str(e))
+            raise
+        finally:
+            if not finished:
+                finish_trace(trace)
+
+
+# 内存压力下暂停接收的请求：会占用新内存的推理、评分、拉取、量化、调优和加载
+_ADMISSION_PREFIXES = ("/generate", "/score", "/models/pull", "/models/quantize", "/models/tune")
+_ADMISSION_EXEMPT = ("/generate/tokens",)
+
+
+def needs_admission(method: str, path: str) -> bool:
+    """请求是否受内存压力准入控制（查询、卸载、删除等释放内存的请求始终放行）"""
+    if method != "POST" or path in _ADMISSION_EXEMPT:
+        return False
+    return path.startswith(_ADMISSION_PREFIXES) or (path.startswith("/models/") and path.endswith("/load"))
+
+
+class AdmissionMiddleware:
+    """
+    内存压力临界时拒绝新的推理请求（纯ASGI实现）
+
+    返回 503 和 Retry-After，客户端稍后重试；进行中的请求和流式响应不受影响。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and needs_admission(scope["method"], scope["path"]):
+            retry_after = memory_controller.retry_after()
+            if retry_after is not None:
+                response = FastJSONResponse(
+                    status_code=503,
+                    content={"detail": "内存压力过高，暂停接收新请求", "retry_after": retry_after},
+                    headers={"Retry-After": str(retry_after)}
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
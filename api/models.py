@@ -3,19 +3,41 @@
 """
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import Dict, Any, Optional
-from model_manager import ModelManager
+from typing import Dict, Any, Optional, List
+from model_manager import get_model_manager
 
 router = APIRouter(prefix="/models", tags=["模型管理"])
 
 # 全局模型管理器实例
-model_manager = ModelManager()
+model_manager = get_model_manager()
 
 
 class PullModelRequest(BaseModel):
     """拉取模型请求"""
     model_name: str
     model_type: str = "auto"
+    force: bool = False
+    base_model: Optional[str] = None
+
+
+class TuneModelRequest(BaseModel):
+    """调优模型请求"""
+    model_name: str
+    threads: Optional[List[int]] = None
+    batches: Optional[List[List[int]]] = None
+    prompt_tokens: int = 512
+    decode_tokens: int = 64
+    repeats: int = 2
+
+
+class QuantizeModelRequest(BaseModel):
+    """量化模型请求"""
+    model_name: str
+    quant: str = "Q4_K_M"
+    target_name: Optional[str] = None
+    allow_requantize: bool = False
+    force: bool = False
+    bench: bool = True
 
 
 class ModelResponse(BaseModel):
@@ -26,15 +48,22 @@ class ModelResponse(BaseModel):
 
 
 @router.post("/pull", response_model=ModelResponse)
-async def pull_model(request: PullModelRequest):
+def pull_model(request: PullModelRequest):
     """
     拉取模型
     
     - **model_name**: 模型名称（Hugging Face Hub格式）
-    - **model_type**: 模型类型（可选，默认为auto）
+    - **model_type**: 模型类型（可选，默认为auto；lora 表示LoRA适配器）
+    - **force**: 模型已存在时拉取新版本，预热后无缝切换（可选，默认False）
+    - **base_model**: LoRA适配器对应的基础模型名称（model_type 为 lora 时必填）
     """
     try:
-        result = model_manager.pull_model(request.model_name, request.model_type)
+        result = model_manager.pull_model(
+            request.model_name,
+            request.model_type,
+            request.force,
+            request.base_model
+        )
         
         if "error" in result:
             raise HTTPException(status_code=400, detail=result["error"])
@@ -45,6 +74,8 @@ async def pull_model(request: PullModelRequest):
             data=result.get("model_info")
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -62,7 +93,44 @@ async def list_models():
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/{model_name}")
+@router.get("/loaded/list")
+async def list_loaded_models():
+    """列出已加载的模型"""
+    try:
+        loaded_models = model_manager.get_loaded_models()
+        return {
+            "success": True,
+            "data": {
+                "models": loaded_models,
+                "total": len(loaded_models)
+            }
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/quantize/jobs")
+async def list_quantize_jobs():
+    """列出量化任务"""
+    return {
+        "success": True,
+        "data": model_manager.list_quantize_jobs()
+    }
+
+
+@router.get("/quantize/jobs/{job_id}")
+async def get_quantize_job(job_id: str):
+    """查询量化任务的状态、进度和结果"""
+    job = model_manager.get_quantize_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="量化任务不存在")
+    return {
+        "success": True,
+        "data": job
+    }
+
+
+@router.get("/{model_name:path}")
 async def get_model_info(model_name: str):
     """获取指定模型的信息"""
     try:
@@ -80,8 +148,8 @@ async def get_model_info(model_name: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/{model_name}/load")
-async def load_model(model_name: str):
+@router.post("/{model_name:path}/load")
+def load_model(model_name: str):
     """加载模型到内存"""
     try:
         result = model_manager.load_model(model_name)
@@ -100,8 +168,8 @@ async def load_model(model_name: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/{model_name}/unload")
-async def unload_model(model_name: str):
+@router.post("/{model_name:path}/unload")
+def unload_model(model_name: str):
     """卸载模型"""
     try:
         result = model_manager.unload_model(model_name)
@@ -113,8 +181,8 @@ async def unload_model(model_name: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.delete("/{model_name}")
-async def delete_model(model_name: str):
+@router.delete("/{model_name:path}")
+def delete_model(model_name: str):
     """删除模型"""
     try:
         result = model_manager.delete_model(model_name)
@@ -132,30 +200,95 @@ async def delete_model(model_name: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/loaded/list")
-async def list_loaded_models():
-    """列出已加载的模型"""
+@router.post("/clear")
+async def clear_all_models():
+    """清除所有已加载的模型"""
     try:
-        loaded_models = model_manager.get_loaded_models()
+        result = model_manager.clear_all_models()
         return {
             "success": True,
-            "data": {
-                "models": loaded_models,
-                "total": len(loaded_models)
-            }
+            "message": result.get("message", "所有模型已清除")
         }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e)) 
+
+@router.post("/tune")
+def tune_model(request: TuneModelRequest):
+    """
+    在本机上测量并选择模型的线程数和批大小，结果保存后加载模型时自动使用
+    
+    - **threads**: 候选线程数（可选，默认按CPU核心数生成）
+    - **batches**: 候选 [n_batch, n_ubatch]（可选）
+    - **prompt_tokens** / **decode_tokens**: 测量用的提示词长度和生成token数
+    - **repeats**: 每组参数的测量次数
+    """
+    try:
+        result = model_manager.tune_model(
+            request.model_name,
+            threads=request.threads,
+            batches=[tuple(b) for b in request.batches] if request.batches else None,
+            prompt_tokens=request.prompt_tokens,
+            decode_tokens=request.decode_tokens,
+            repeats=request.repeats
+        )
+        
+        if "error" in result:
+            raise HTTPException(status_code=400, detail=result["error"])
+        
+        return {
+            "success": True,
+            "data": result
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/clear")
-async def clear_all_models():
-    """清除所有已加载的模型"""
+@router.post("/gc")
+def collect_garbage():
+    """整理模型存储：合并重复内容、回收未引用的文件，并按磁盘配额淘汰最久未使用的模型"""
     try:
-        result = model_manager.clear_all_models()
+        result = model_manager.collect_garbage()
         return {
             "success": True,
-            "message": result.get("message", "所有模型已清除")
+            "data": result
         }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/quantize")
+def quantize_model(request: QuantizeModelRequest):
+    """
+    在本地把已下载的模型（通常是 F16/F32）量化为更小的版本，登记为新模型
+    
+    - **quant**: 目标量化方式（默认 Q4_K_M）
+    - **target_name**: 量化版本的模型名称（默认 "<model_name>:<quant>"）
+    - **allow_requantize**: 允许从已量化的模型再量化（会叠加误差）
+    - **force**: 目标名称已存在时生成新版本并切换
+    - **bench**: 完成后对比源模型与量化版本的速度（默认True）
+    
+    量化在后台进行，返回任务信息；通过 GET /models/quantize/jobs/{id} 查询进度和大小、速度对比。
+    """
+    try:
+        result = model_manager.quantize_model(
+            request.model_name,
+            request.quant,
+            target_name=request.target_name,
+            allow_requantize=request.allow_requantize,
+            force=request.force,
+            bench=request.bench
+        )
+        
+        if "error" in result:
+            raise HTTPException(status_code=400, detail=result["error"])
+        
+        return {
+            "success": True,
+            "data": result["job"]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,15 @@
+"""
+API响应类模块
+"""
+from typing import Any
+from fastapi.responses import JSONResponse
+from utils.serialization import dumps
+from utils.tracing import span
+
+
+class FastJSONResponse(JSONResponse):
+    """使用 orjson（未安装时为紧凑的标准库 json）序列化的JSON响应"""
+
+    def render(self, content: Any) -> bytes:
+        with span("serialize"):
+            return dumps(content)
@@ -0,0 +1,49 @@
+"""
+评分API模块 - 计算续写的对数似然与困惑度（不生成）
+"""
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+from typing import List
+from model_manager import get_model_manager
+from api.responses import FastJSONResponse
+
+router = APIRouter(prefix="/score", tags=["评分"])
+
+# 全局模型管理器实例
+model_manager = get_model_manager()
+
+
+class ScoreItem(BaseModel):
+    """一个待评分的 (提示词, 续写)"""
+    prompt: str = ""
+    continuation: str
+
+
+class ScoreRequest(BaseModel):
+    """评分请求"""
+    model_name: str
+    items: List[ScoreItem]
+    token_logprobs: bool = False
+
+
+@router.post("")
+def score(request: ScoreRequest):
+    """
+    批量计算续写在提示词下的对数似然（只做提示词评估，速度与提示词评估相同）
+    
+    - **model_name**: 模型名称
+    - **items**: [{"prompt", "continuation"}]，prompt 为空时计算 continuation 整段的困惑度
+    - **token_logprobs**: 是否返回逐token的对数概率和token文本（默认False）
+    
+    相同的提示词只评估一次，同一提示词下的多个续写（如选择题的各个选项）打包批量评估。
+    每项返回 logprob（总和）、n_tokens、perplexity 和 is_greedy（每个token都是概率最大的token）。
+    """
+    result = model_manager.score(
+        request.model_name,
+        [(item.prompt, item.continuation) for item in request.items],
+        request.token_logprobs
+    )
+    if "error" in result:
+        status_code = 404 if result["error"] == "模型不存在" else 500
+        raise HTTPException(status_code=status_code, detail=result["error"])
+    return FastJSONResponse({"success": True, **result})
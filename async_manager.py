@@ -0,0 +1,424 @@
+"""
+异步库接口 - 在同一进程中直接调用模型管理器，不经过 HTTP
+
+与服务端共用同一个 ModelManager（get_model_manager），模型常驻、版本切换、请求合并、
+分词缓存等行为与通过 API 调用完全一致，但没有 JSON 编解码、请求校验和回环网络的开销。
+阻塞的推理在专用线程池中执行，事件循环不会被阻塞。
+
+    from async_manager import AsyncModelManager
+
+    async with AsyncModelManager() as llm:
+        result = await llm.generate("Qwen/Qwen2-1.5B-Instruct-GGUF", "你好", max_tokens=64)
+        print(result.text, result.usage.completion_tokens)
+
+        async for chunk in llm.stream("Qwen/Qwen2-1.5B-Instruct-GGUF", [{"role": "user", "content": "你好"}]):
+            print(chunk.content, end="", flush=True)
+
+出错时抛出 LLMError（服务端接口中的 {"error": ...}）。
+"""
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from model_manager import ModelManager, get_model_manager
+
+# 流式生成领先消费者的最大片段数，超过后生成线程等待（与HTTP流式响应按需拉取一致）
+_STREAM_BUFFER = 64
+
+
+class LLMError(RuntimeError):
+    """模型管理器返回的错误"""
+
+
+class _Result:
+    """结果对象基类：固定字段，按字段名访问"""
+
+    __slots__ = ()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: _plain(getattr(self, name)) for name in self.__slots__}
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+def _plain(value):
+    if isinstance(value, _Result):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    return value
+
+
+class Usage(_Result):
+    """token用量"""
+
+    __slots__ = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+    def __init__(self, prompt_tokens: int = 0, completion_tokens: int = 0, total_tokens: int = 0):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = total_tokens
+
+    @classmethod
+    def from_dict(cls, usage: Optional[Dict[str, Any]]) -> "Usage":
+        usage = usage or {}
+        return cls(
+            usage.get("prompt_tokens", 0),
+            usage.get("completion_tokens", 0),
+            usage.get("total_tokens", 0)
+        )
+
+
+class Choice(_Result):
+    """一个生成候选"""
+
+    __slots__ = ("index", "text", "finish_reason", "completion_tokens", "logprobs")
+
+    def __init__(
+        self,
+        index: int,
+        text: str,
+        finish_reason: Optional[str],
+        completion_tokens: int,
+        logprobs: Optional[List[Dict[str, Any]]] = None
+    ):
+        self.index = index
+        self.text = text
+        self.finish_reason = finish_reason
+        self.completion_tokens = completion_tokens
+        self.logprobs = logprobs
+
+
+class GenerationResult(_Result):
+    """文本生成结果（text 为第一个候选的文本）"""
+
+    __slots__ = ("text", "choices", "finish_reason", "usage", "model")
+
+    def __init__(self, text: str, choices: List[Choice], finish_reason: Optional[str], usage: Usage, model: str):
+        self.text = text
+        self.choices = choices
+        self.finish_reason = finish_reason
+        self.usage = usage
+        self.model = model
+
+    @classmethod
+    def from_dict(cls, result: Dict[str, Any]) -> "GenerationResult":
+        choices = [
+            Choice(
+                c["index"],
+                c["text"],
+                c.get("finish_reason"),
+                c.get("usage", {}).get("completion_tokens", 0),
+                c["logprobs"]["content"] if "logprobs" in c else None
+            )
+            for c in result.get("choices", ())
+        ]
+        return cls(
+            result["generated_text"],
+            choices,
+            result.get("finish_reason"),
+            Usage.from_dict(result.get("usage")),
+            result.get("model_name")
+        )
+
+
+class ChatResult(_Result):
+    """聊天补全结果"""
+
+    __slots__ = ("content", "finish_reason", "usage", "model", "logprobs")
+
+    def __init__(
+        self,
+        content: str,
+        finish_reason: Optional[str],
+        usage: Usage,
+        model: str,
+        logprobs: Optional[List[Dict[str, Any]]] = None
+    ):
+        self.content = content
+        self.finish_reason = finish_reason
+        self.usage = usage
+        self.model = model
+        self.logprobs = logprobs
+
+    @classmethod
+    def from_dict(cls, result: Dict[str, Any]) -> "ChatResult":
+        return cls(
+            result["response"],
+            result.get("finish_reason"),
+            Usage.from_dict(result.get("usage")),
+            result.get("model"),
+            result["logprobs"]["content"] if "logprobs" in result else None
+        )
+
+
+class StreamChunk(_Result):
+    """
+    流式片段
+
+    中间片段只携带增量 content；最后一个片段 done=True，full_response 为完整文本。
+    请求了 logprobs 时 logprobs 为该片段输出的token列表。
+    """
+
+    __slots__ = ("content", "finish_reason", "done", "full_response", "logprobs")
+
+    def __init__(
+        self,
+        content: str,
+        finish_reason: Optional[str] = None,
+        done: bool = False,
+        full_response: Optional[str] = None,
+        logprobs: Optional[List[Dict[str, Any]]] = None
+    ):
+        self.content = content
+        self.finish_reason = finish_reason
+        self.done = done
+        self.full_response = full_response
+        self.logprobs = logprobs
+
+
+_END = object()
+
+
+class _StreamBridge:
+    """
+    把生成线程中的同步生成器桥接为异步迭代
+
+    生成线程把片段放入队列，只在消费者等待时才唤醒事件循环；消费者提前退出时
+    通知生成线程关闭生成器，模型锁随之释放。
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, limit: int = _STREAM_BUFFER):
+        self._loop = loop
+        self._limit = limit
+        self._items: deque = deque()
+        self._cond = threading.Condition()
+        self._waiter: Optional[asyncio.Future] = None
+        self.cancelled = False
+
+    def _put(self, item) -> bool:
+        with self._cond:
+            while len(self._items) >= self._limit and not self.cancelled:
+                self._cond.wait()
+            if self.cancelled:
+                return False
+            self._items.append(item)
+            waiter, self._waiter = self._waiter, None
+        if waiter is not None:
+            self._loop.call_soon_threadsafe(_wake, waiter)
+        return True
+
+    def pump(self, frames, convert: Callable[[Dict[str, Any]], Any]):
+        """在生成线程中运行：逐帧转换后放入队列"""
+        try:
+            for frame in frames:
+                if not self._put(convert(frame)):
+                    break
+        except BaseException as e:
+            self._put(e)
+        finally:
+            close = getattr(frames, "close", None)
+            if close is not None:
+                close()
+            self._put(_END)
+
+    async def get(self):
+        while True:
+            with self._cond:
+                if self._items:
+                    item = self._items.popleft()
+                    self._cond.notify()
+                    return item
+                self._waiter = waiter = self._loop.create_future()
+            await waiter
+
+    def cancel(self):
+        with self._cond:
+            self.cancelled = True
+            self._items.clear()
+            self._cond.notify_all()
+
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def _check(result: Dict[str, Any]) -> Dict[str, Any]:
+    if "error" in result:
+        raise LLMError(result["error"])
+    return result
+
+
+def _stream_chunk(frame: Dict[str, Any]):
+    if "error" in frame:
+        return LLMError(frame["error"])
+    if frame.get("done"):
+        return StreamChunk("", frame.get("finish_reason"), True, frame.get("full_response"))
+    return StreamChunk(frame.get("content", ""), frame.get("finish_reason"), logprobs=frame.get("logprobs"))
+
+
+class ChunkStream:
+    """
+    流式结果的异步迭代器
+
+    与异步生成器不同，break 退出 async for 后迭代器一旦不再被引用就立即停止生成，
+    不需要等待垃圾回收或显式 aclose()；也可用 async with 确保退出时已释放模型。
+    """
+
+    __slots__ = ("_bridge", "_producer", "_finished")
+
+    def __init__(self, bridge: _StreamBridge, producer: asyncio.Future):
+        self._bridge = bridge
+        self._producer = producer
+        self._finished = False
+
+    def __aiter__(self) -> "ChunkStream":
+        return self
+
+    async def __anext__(self) -> StreamChunk:
+        if self._finished:
+            raise StopAsyncIteration
+        item = await self._bridge.get()
+        if item is _END:
+            await self.aclose()
+            raise StopAsyncIteration
+        if isinstance(item, BaseException):
+            await self.aclose()
+            raise item
+        return item
+
+    async def aclose(self):
+        """停止生成，并等生成线程关闭生成器（释放模型锁和引用）"""
+        self._finished = True
+        self._bridge.cancel()
+        await asyncio.shield(self._producer)
+
+    async def __aenter__(self) -> "ChunkStream":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    def __del__(self):
+        self._bridge.cancel()
+
+
+class AsyncModelManager:
+    """
+    模型管理器的异步接口
+
+    Args:
+        manager: 使用的模型管理器，默认与服务端共用 get_model_manager()
+        max_workers: 执行推理的线程数（同一模型的请求仍按模型串行）
+    """
+
+    def __init__(self, manager: Optional[ModelManager] = None, max_workers: Optional[int] = None):
+        self.manager = manager or get_model_manager()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-async")
+
+    async def _run(self, fn: Callable, *args, **kwargs):
+        """在线程池中执行，并沿用调用方的上下文（请求追踪等）"""
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, lambda: context.run(fn, *args, **kwargs))
+
+    async def generate(
+        self,
+        model_name: str,
+        prompt: str,
+        max_tokens: int = 32768,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        top_k: int = 40,
+        repeat_penalty: float = 1.1,
+        n: int = 1,
+        **kwargs
+    ) -> GenerationResult:
+        """
+        生成文本
+
+        其余参数（stop、grammar、json_schema、adapter、adapter_scale、logprobs、top_logprobs）与 ModelManager.generate_text 相同。
+        """
+        result = await self._run(
+            self.manager.generate_text, model_name, prompt, max_tokens, temperature,
+            top_p, top_k, repeat_penalty, n, **kwargs
+        )
+        return GenerationResult.from_dict(_check(result))
+
+    async def chat(
+        self,
+        model_name: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 32768,
+        temperature: float = 0.7,
+        **kwargs
+    ) -> ChatResult:
+        """聊天补全"""
+        result = await self._run(self.manager.chat_completion, model_name, messages, max_tokens, temperature, **kwargs)
+        return ChatResult.from_dict(_check(result))
+
+    def stream(
+        self,
+        model_name: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 32768,
+        temperature: float = 0.7,
+        **kwargs
+    ) -> "ChunkStream":
+        """
+        流式聊天补全：async for 逐个得到 StreamChunk，最后一个片段 done=True
+
+        需在事件循环中调用。提前退出 async for（break、异常或取消任务）会停止生成并释放模型。
+        """
+        loop = asyncio.get_running_loop()
+        bridge = _StreamBridge(loop)
+        context = contextvars.copy_context()
+
+        def produce():
+            frames = self.manager.chat_completion_stream(model_name, messages, max_tokens, temperature, **kwargs)
+            bridge.pump(frames, _stream_chunk)
+
+        producer = loop.run_in_executor(self._executor, lambda: context.run(produce))
+        return ChunkStream(bridge, producer)
+
+    async def count_tokens(self, model_name: str, texts: List[str], add_bos: bool = True) -> List[int]:
+        """计算文本的token数（只加载词表）"""
+        result = await self._run(self.manager.count_tokens, model_name, texts, add_bos)
+        return _check(result)["counts"]
+
+    async def score(self, model_name: str, pairs: List[Tuple[str, str]], token_logprobs: bool = False) -> Dict[str, Any]:
+        """计算续写在提示词下的对数似然（结果格式与 ModelManager.score 相同）"""
+        return _check(await self._run(self.manager.score, model_name, pairs, token_logprobs))
+
+    async def pull_model(self, model_name: str, model_type: str = "auto", force: bool = False, base_model: Optional[str] = None) -> Dict[str, Any]:
+        """拉取模型，返回模型信息"""
+        result = await self._run(self.manager.pull_model, model_name, model_type, force, base_model)
+        return _check(result).get("model_info")
+
+    async def load_model(self, model_name: str) -> Dict[str, Any]:
+        """加载模型到内存"""
+        return _check(await self._run(self.manager.load_model, model_name))
+
+    async def unload_model(self, model_name: str) -> Dict[str, Any]:
+        """卸载模型（等待进行中的请求结束）"""
+        return _check(await self._run(self.manager.unload_model, model_name))
+
+    async def list_models(self) -> Dict[str, Any]:
+        """列出所有模型"""
+        return await self._run(self.manager.list_models)
+
+    def close(self):
+        """关闭线程池（不影响共用的模型管理器和已加载的模型）"""
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self) -> "AsyncModelManager":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
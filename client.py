@@ -0,0 +1,388 @@
+"""
+本地服务客户端模块
+检测到本地 API 服务时，命令行通过复用的 HTTP 连接转发命令，
+避免每次调用都在新进程中重新加载一份模型权重
+"""
+import http.client
+import json
+import socket
+import logging
+from typing import Dict, Any, Optional, List, Tuple
+from urllib.parse import quote
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """基于 Unix socket 的 HTTP 连接"""
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class RemoteModelManager:
+    """通过本地服务访问模型的管理器，接口与 ModelManager 保持一致"""
+
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        socket_path: Optional[str] = None,
+        timeout: Optional[float] = None
+    ):
+        """
+        初始化客户端
+
+        Args:
+            host: 服务地址，默认 config.CLIENT_HOST
+            port: 服务端口，默认 config.PORT
+            socket_path: Unix socket 路径，设置后优先于 host/port
+            timeout: 读超时（秒），None 表示不限制
+        """
+        self.host = host or config.CLIENT_HOST
+        self.port = port or config.PORT
+        self.socket_path = socket_path if socket_path is not None else config.SOCKET_PATH
+        self.timeout = timeout if timeout is not None else config.CLIENT_TIMEOUT
+        self._conn: Optional[http.client.HTTPConnection] = None
+
+    def _connection(self, timeout: Optional[float] = None) -> http.client.HTTPConnection:
+        """获取复用的连接（keep-alive），不存在时新建"""
+        if self._conn is None:
+            timeout = timeout if timeout is not None else self.timeout
+            if self.socket_path:
+                self._conn = UnixHTTPConnection(self.socket_path, timeout=timeout)
+            else:
+                self._conn = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+        return self._conn
+
+    def close(self):
+        """关闭连接"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        body: Optional[Dict[str, Any]] = None
+    ) -> http.client.HTTPResponse:
+        """发送请求，空闲连接已被服务端关闭时重连一次"""
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                return conn.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self.close()
+                if attempt:
+                    raise
+
+    def _call(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """发送请求并解析JSON响应，HTTP错误统一转换为 {"error": ...}"""
+        response = self._request(method, path, body)
+        raw = response.read()
+        try:
+            data = json.loads(raw) if raw else {}
+        except ValueError:
+            data = {"detail": raw.decode("utf-8", errors="replace")}
+
+        if response.status >= 400:
+            return {"error": data.get("detail") or data.get("error") or f"HTTP {response.status}"}
+        return data
+
+    @staticmethod
+    def _model_path(model_name: str, suffix: str = "") -> str:
+        return f"/models/{quote(model_name, safe='/')}{suffix}"
+
+    def is_available(self) -> bool:
+        """检测本地服务是否在运行"""
+        self.close()
+        try:
+            conn = self._connection(timeout=config.CLIENT_CONNECT_TIMEOUT)
+            conn.request("GET", "/health")
+            response = conn.getresponse()
+            data = json.loads(response.read() or b"{}")
+        except (OSError, ValueError, http.client.HTTPException):
+            self.close()
+            return False
+
+        if response.status != 200 or "status" not in data:
+            self.close()
+            return False
+
+        # 探测成功后恢复正常的读超时
+        conn.timeout = self.timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(self.timeout)
+        return True
+
+    def pull_model(
+        self,
+        model_name: str,
+        model_type: str = "auto",
+        force: bool = False,
+        base_model: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """拉取模型（由服务端下载）"""
+        result = self._call("POST", "/models/pull", {
+            "model_name": model_name,
+            "model_type": model_type,
+            "force": force,
+            "base_model": base_model
+        })
+        if "error" in result:
+            return {"error": result["error"], "success": False}
+        return {
+            "success": True,
+            "model_info": result.get("data"),
+            "message": result.get("message")
+        }
+
+    def list_models(self) -> Dict[str, Any]:
+        """列出所有模型"""
+        result = self._call("GET", "/models/list")
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        return result["data"]
+
+    def get_model_info(self, model_name: str) -> Optional[Dict[str, Any]]:
+        """获取模型信息"""
+        result = self._call("GET", self._model_path(model_name))
+        if "error" in result:
+            return None
+        return result.get("data")
+
+    def load_model(self, model_name: str) -> Dict[str, Any]:
+        """加载模型到服务端内存"""
+        result = self._call("POST", self._model_path(model_name, "/load"))
+        if "error" in result:
+            return result
+        return {
+            "success": True,
+            "message": result.get("message"),
+            "model_info": result.get("data")
+        }
+
+    def unload_model(self, model_name: str) -> Dict[str, Any]:
+        """卸载模型"""
+        result = self._call("POST", self._model_path(model_name, "/unload"))
+        if "error" in result:
+            return result
+        return {"message": result.get("message")}
+
+    def delete_model(self, model_name: str) -> Dict[str, Any]:
+        """删除模型"""
+        result = self._call("DELETE", self._model_path(model_name))
+        if "error" in result:
+            return result
+        return {"message": result.get("message")}
+
+    def count_tokens(self, model_name: str, texts: List[str], add_bos: bool = True) -> Dict[str, Any]:
+        """计算文本的token数"""
+        result = self._call("POST", "/generate/tokens", {
+            "model_name": model_name,
+            "texts": texts,
+            "add_bos": add_bos
+        })
+        if "error" in result:
+            return result
+        return {"counts": result["counts"], "total": result["total"]}
+
+    def score(self, model_name: str, pairs: List[Tuple[str, str]], token_logprobs: bool = False) -> Dict[str, Any]:
+        """计算续写在提示词下的对数似然"""
+        result = self._call("POST", "/score", {
+            "model_name": model_name,
+            "items": [{"prompt": prompt, "continuation": continuation} for prompt, continuation in pairs],
+            "token_logprobs": token_logprobs
+        })
+        if "error" in result:
+            return result
+        result.pop("success", None)
+        return result
+
+    def tune_model(
+        self,
+        model_name: str,
+        threads: Optional[List[int]] = None,
+        batches: Optional[List[Tuple[int, int]]] = None,
+        prompt_tokens: int = 512,
+        decode_tokens: int = 64,
+        repeats: int = 2,
+        progress=None
+    ) -> Dict[str, Any]:
+        """在服务端所在主机上调优模型（服务端不回报逐组进度，progress 被忽略）"""
+        result = self._call("POST", "/models/tune", {
+            "model_name": model_name,
+            "threads": threads,
+            "batches": [list(b) for b in batches] if batches else None,
+            "prompt_tokens": prompt_tokens,
+            "decode_tokens": decode_tokens,
+            "repeats": repeats
+        })
+        if "error" in result:
+            return result
+        return result["data"]
+    
+    def quantize_model(
+        self,
+        model_name: str,
+        quant: str,
+        target_name: Optional[str] = None,
+        allow_requantize: bool = False,
+        force: bool = False,
+        bench: bool = True
+    ) -> Dict[str, Any]:
+        """在服务端启动量化任务"""
+        result = self._call("POST", "/models/quantize", {
+            "model_name": model_name,
+            "quant": quant,
+            "target_name": target_name,
+            "allow_requantize": allow_requantize,
+            "force": force,
+            "bench": bench
+        })
+        if "error" in result:
+            return result
+        return {"success": True, "job": result["data"]}
+    
+    def get_quantize_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """查询服务端的量化任务"""
+        result = self._call("GET", f"/models/quantize/jobs/{quote(job_id, safe='')}")
+        if "error" in result:
+            return None
+        return result["data"]
+    
+    def list_quantize_jobs(self) -> List[Dict[str, Any]]:
+        """列出服务端的量化任务"""
+        result = self._call("GET", "/models/quantize/jobs")
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        return result["data"]
+    
+    def collect_garbage(self) -> Dict[str, Any]:
+        """整理服务端的模型存储"""
+        result = self._call("POST", "/models/gc")
+        if "error" in result:
+            return result
+        return result["data"]
+    
+    def generate_text(
+        self,
+        model_name: str,
+        prompt: str,
+        max_tokens: int = 32768,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        top_k: int = 40,
+        repeat_penalty: float = 1.1,
+        n: int = 1,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """生成文本"""
+        result = self._call("POST", "/generate", {
+            "model_name": model_name,
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "top_k": top_k,
+            "repeat_penalty": repeat_penalty,
+            "num_return_sequences": n,
+            **kwargs
+        })
+        # GenerateResponse 总是带有 error 字段（成功时为null），以 success 判断
+        if not result.get("success"):
+            return {"error": result.get("error") or "生成失败"}
+        result.pop("success", None)
+        result.pop("error", None)
+        return result
+
+    def chat_completion(
+        self,
+        model_name: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 32768,
+        temperature: float = 0.7,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """聊天补全"""
+        result = self._call("POST", "/generate/chat", {
+            "model_name": model_name,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            **kwargs
+        })
+        if "error" in result:
+            result["success"] = False
+        return result
+
+    def chat_completion_stream(
+        self,
+        model_name: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 32768,
+        temperature: float = 0.7,
+        **kwargs
+    ):
+        """
+        流式聊天补全
+
+        Yields:
+            服务端逐行返回的流式片段（NDJSON）
+        """
+        response = self._request("POST", "/generate/chat", {
+            "model_name": model_name,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": True,
+            **kwargs
+        })
+
+        if response.status >= 400:
+            raw = response.read()
+            try:
+                detail = json.loads(raw).get("detail")
+            except ValueError:
+                detail = raw.decode("utf-8", errors="replace")
+            yield {"error": detail or f"HTTP {response.status}", "success": False}
+            return
+
+        try:
+            for line in response:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        finally:
+            # 调用方提前结束（break、Ctrl-C）时不等服务端生成完：关闭连接，下次请求重新连接
+            if not response.isclosed():
+                response.close()
+                self.close()
+
+
+def connect_local_server() -> Optional[RemoteModelManager]:
+    """
+    检测本地服务
+
+    Returns:
+        服务在运行时返回已连接的客户端，否则返回None
+    """
+    client = RemoteModelManager()
+    if client.is_available():
+        logger.debug(f"已连接本地服务: {client.socket_path or f'{client.host}:{client.port}'}")
+        return client
+    return None
@@ -12,6 +12,15 @@ MODELS_DIR = BASE_DIR / "models"
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", 8000))
 DEBUG = os.getenv("DEBUG", "False").lower() == "true"
+# 挂载 /debug 调试接口（追踪、采样剖析、cProfile、内存压力、预取状态）；这些接口没有鉴权，默认随 DEBUG 开启
+DEBUG_ENDPOINTS = os.getenv("DEBUG_ENDPOINTS", str(DEBUG)).lower() == "true"
+SOCKET_PATH = os.getenv("LLM_SOCKET", "")
+WORKERS = int(os.getenv("WORKERS", 1))  # 工作进程数，>1 时各进程共享模型权重的页缓存
+
+# 命令行客户端配置（检测到本地服务时通过HTTP转发命令）
+CLIENT_HOST = os.getenv("LLM_CLIENT_HOST", "127.0.0.1")
+CLIENT_CONNECT_TIMEOUT = float(os.getenv("LLM_CLIENT_CONNECT_TIMEOUT", "0.3"))
+CLIENT_TIMEOUT = float(os.getenv("LLM_CLIENT_TIMEOUT", "0")) or None  # 0 表示不限制（拉取大模型可能很慢）
 
 # 模型配置
 DEFAULT_MODEL_TYPE = "auto"
@@ -19,19 +28,81 @@ DEFAULT_MAX_LENGTH = 32768
 DEFAULT_TEMPERATURE = 0.7
 DEFAULT_TOP_P = 0.9
 DEFAULT_DO_SAMPLE = True
+MODEL_DRAIN_TIMEOUT = float(os.getenv("MODEL_DRAIN_TIMEOUT", 300))  # 卸载/切换版本前等待进行中请求的最长时间（秒）
+LORA_CACHE_SIZE = int(os.getenv("LORA_CACHE_SIZE", 16))  # 每个基础模型上常驻的LoRA适配器数量
+GRAMMAR_CACHE_SIZE = int(os.getenv("GRAMMAR_CACHE_SIZE", 64))  # 编译后语法的缓存条数
+TOKENIZER_CACHE_SIZE = int(os.getenv("TOKENIZER_CACHE_SIZE", 50000))  # 每个词表分词器缓存的最近字符串条数
+TOKENIZER_CACHE_MAX_CHARS = int(os.getenv("TOKENIZER_CACHE_MAX_CHARS", 4096))  # 超过该长度的字符串不缓存
+MAX_RETURN_SEQUENCES = int(os.getenv("MAX_RETURN_SEQUENCES", 8))  # 单个请求最多返回的候选数（候选依次生成，期间占用模型）
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "True").lower() == "true"  # 合并相同的进行中确定性请求（temperature<=0）
+
+# 上下文与KV缓存配置
+N_CTX = int(os.getenv("N_CTX", 2048))  # 默认上下文长度（没有足够的历史请求统计时使用）
+N_CTX_ADAPTIVE = os.getenv("N_CTX_ADAPTIVE", "True").lower() == "true"  # 加载时按历史请求长度选择上下文长度
+N_CTX_MIN = int(os.getenv("N_CTX_MIN", N_CTX))  # 自适应的下限，默认不低于 N_CTX（只会增大）；调低后更长的提示词需等重新加载才能放下
+N_CTX_MAX = int(os.getenv("N_CTX_MAX", 32768))
+N_CTX_PERCENTILE = float(os.getenv("N_CTX_PERCENTILE", 0.99))  # 上下文需覆盖的请求长度分位数
+N_CTX_MIN_SAMPLES = int(os.getenv("N_CTX_MIN_SAMPLES", 20))  # 至少有这么多条统计才自适应
+KV_CACHE_TYPE = os.getenv("KV_CACHE_TYPE", "f16")  # KV缓存类型：f16 / q8_0 / q4_0（量化需要 flash attention）
+AUTOTUNE = os.getenv("AUTOTUNE", "False").lower() == "true"  # 首次加载本机没有调优结果的模型前，先测量选择线程数和批大小
+SCORE_N_CTX = int(os.getenv("SCORE_N_CTX", 4096))  # 评分上下文的KV缓存容量，单个提示词加续写不能超过该长度
+SCORE_PARALLEL = int(os.getenv("SCORE_PARALLEL", 8))  # 评分时打包进同一批的续写数
 
 # GPU配置
 USE_GPU = os.getenv("USE_GPU", "True").lower() == "true"
 GPU_MEMORY_FRACTION = float(os.getenv("GPU_MEMORY_FRACTION", "0.8"))
 
+# 模型权重内存配置
+USE_MMAP = os.getenv("USE_MMAP", "True").lower() == "true"  # 以mmap方式加载权重，多进程共享只读页
+USE_MLOCK = os.getenv("USE_MLOCK", "False").lower() == "true"  # 锁定权重页（会使每个进程各自占用内存）
+MMAP_PREFETCH = os.getenv("MMAP_PREFETCH", "True").lower() == "true"  # 加载时提示内核预读权重文件
+MMAP_HUGEPAGES = os.getenv("MMAP_HUGEPAGES", "False").lower() == "true"  # 提示使用透明大页
+
 # 下载配置
 DOWNLOAD_TIMEOUT = int(os.getenv("DOWNLOAD_TIMEOUT", 300))
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", 3))
 
+# 模型存储配置
+# 模型来源，逗号分隔，按顺序回退：hf（Hugging Face Hub）、本地目录/NFS 路径、其他实例的 http 地址
+MODEL_SOURCES = os.getenv("MODEL_SOURCES", "hf")
+MODELS_DISK_QUOTA_GB = float(os.getenv("MODELS_DISK_QUOTA_GB", 0))  # 模型文件占用上限，超出时淘汰最久未使用的模型；0 表示不限制
+
+# 本地量化配置（llm quantize）
+QUANTIZE_THREADS = int(os.getenv("QUANTIZE_THREADS", 0))  # 量化线程数，0 表示使用全部核心
+QUANTIZE_BENCH_PROMPT_TOKENS = int(os.getenv("QUANTIZE_BENCH_PROMPT_TOKENS", 256))  # 量化后对比速度时的提示词长度
+QUANTIZE_BENCH_DECODE_TOKENS = int(os.getenv("QUANTIZE_BENCH_DECODE_TOKENS", 32))  # 量化后对比速度时的生成token数
+
+# 预测性预取（按各模型的请求时间统计预测即将到来的请求，提前把模型文件读入页缓存）
+PREDICTIVE_PREFETCH = os.getenv("PREDICTIVE_PREFETCH", "False").lower() == "true"
+PREDICTIVE_PRELOAD = os.getenv("PREDICTIVE_PRELOAD", "False").lower() == "true"  # 内存充足时直接加载预测到的模型
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", 300))  # 预测间隔（秒）
+PREFETCH_LOOKAHEAD_MINUTES = float(os.getenv("PREFETCH_LOOKAHEAD_MINUTES", 30))  # 预测未来多长时间内的请求
+PREFETCH_MIN_REQUESTS = float(os.getenv("PREFETCH_MIN_REQUESTS", 1.0))  # 预计请求数达到该值时预取
+USAGE_HALF_LIFE_DAYS = float(os.getenv("USAGE_HALF_LIFE_DAYS", 7))  # 按时段统计的请求数的半衰期（天）
+
+# 内存压力控制（读取 cgroup memory.max/memory.current 和 PSI，OOM 之前主动降载）
+MEMORY_PRESSURE_CONTROL = os.getenv("MEMORY_PRESSURE_CONTROL", "True").lower() == "true"
+MEMORY_PRESSURE_INTERVAL = float(os.getenv("MEMORY_PRESSURE_INTERVAL", 1.0))  # 采样间隔（秒）
+MEMORY_HIGH_WATERMARK = float(os.getenv("MEMORY_HIGH_WATERMARK", 0.85))  # 工作集/限制超过该比例时收缩缓存
+MEMORY_CRITICAL_WATERMARK = float(os.getenv("MEMORY_CRITICAL_WATERMARK", 0.95))  # 超过该比例时卸载空闲模型并暂停接收新请求
+MEMORY_PSI_SOME_ELEVATED = float(os.getenv("MEMORY_PSI_SOME_ELEVATED", 10))  # PSI some avg10（%）超过该值视为有压力
+MEMORY_PSI_FULL_CRITICAL = float(os.getenv("MEMORY_PSI_FULL_CRITICAL", 10))  # PSI full avg10（%）超过该值视为临界
+MEMORY_RELIEF_INTERVAL = float(os.getenv("MEMORY_RELIEF_INTERVAL", 5))  # 两次降载之间的最短间隔（秒）
+MEMORY_RECOVERY_SECONDS = float(os.getenv("MEMORY_RECOVERY_SECONDS", 15))  # 压力持续低于当前级别多久后降一级
+MEMORY_RETRY_AFTER = int(os.getenv("MEMORY_RETRY_AFTER", 5))  # 暂停接收请求时返回的 Retry-After（秒）
+
 # 日志配置
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 
+# 追踪配置
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", 2000))  # 内存中保留的请求追踪条数
+TRACE_LOG_FILE = os.getenv("TRACE_LOG_FILE", "")  # 设置后追踪记录同时追加写入该JSONL文件
+
+# 性能剖析配置
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", 60))  # 单次采样剖析的最长时间
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 10))  # 默认采样间隔（毫秒）
+
 # 安全配置
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
 
@@ -2,51 +2,172 @@
 基于 llama.cpp 的推理引擎模块
 """
 import os
+import json
+import math
+import time
+import hashlib
 import logging
-from typing import Dict, Any, Optional, List
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Tuple, Union
 from pathlib import Path
 
-try:
-    from llama_cpp import Llama
-except ImportError:
-    raise ImportError("请安装 llama-cpp-python: pip install llama-cpp-python")
+import config
+from utils.memory import map_model_file, file_mapping_memory, KV_CACHE_TYPES, kv_cache_bytes_per_token
+from utils.tracing import span, current_trace
+from utils.stops import get_automaton
+from utils.hostinfo import cpu_info, host_id
+from utils.logprobs import MAX_TOP_LOGPROBS
+
+# 聊天模板中常见的回合结束标记
+_END_OF_TURN_MARKERS = ("<|im_end|>", "<|eot_id|>", "<|end|>", "<end_of_turn>", "<|end_of_text|>", "<|endoftext|>", "</s>")
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def _import_llama():
+    """延迟导入 llama_cpp（加载原生库较慢，只在真正推理时才导入）"""
+    try:
+        from llama_cpp import Llama
+    except ImportError:
+        raise ImportError("请安装 llama-cpp-python: pip install llama-cpp-python")
+    return Llama
+
+
+def _import_llama_grammar():
+    """延迟导入 LlamaGrammar"""
+    try:
+        from llama_cpp import LlamaGrammar
+    except ImportError:
+        raise ImportError("请安装 llama-cpp-python: pip install llama-cpp-python")
+    return LlamaGrammar
+
+
+def _import_lora_api():
+    """
+    延迟导入 llama.cpp 的LoRA适配器接口（不同版本函数名不同）
+    
+    Returns:
+        (init, set, remove, free) 四个函数
+    """
+    try:
+        import llama_cpp
+    except ImportError:
+        raise ImportError("请安装 llama-cpp-python: pip install llama-cpp-python")
+    
+    candidates = [
+        ("llama_adapter_lora_init", "llama_set_adapter_lora", "llama_rm_adapter_lora", "llama_adapter_lora_free"),
+        ("llama_lora_adapter_init", "llama_lora_adapter_set", "llama_lora_adapter_remove", "llama_lora_adapter_free"),
+    ]
+    for names in candidates:
+        if all(hasattr(llama_cpp, name) for name in names):
+            return tuple(getattr(llama_cpp, name) for name in names)
+    raise RuntimeError("当前 llama-cpp-python 版本不支持动态加载LoRA适配器，请升级到 0.3.0 以上")
+
+
+def _import_perf_api():
+    """
+    延迟导入 llama.cpp 的性能计数接口
+    
+    Returns:
+        (llama_perf_context, llama_perf_context_reset)，旧版本不支持时返回None
+    """
+    try:
+        import llama_cpp
+    except ImportError:
+        return None
+    if hasattr(llama_cpp, "llama_perf_context") and hasattr(llama_cpp, "llama_perf_context_reset"):
+        return llama_cpp.llama_perf_context, llama_cpp.llama_perf_context_reset
+    return None
+
+
+def _import_logits_api():
+    """延迟导入读取单个位置 logits 的接口（llama_get_logits_ith）"""
+    try:
+        import llama_cpp
+    except ImportError:
+        raise ImportError("请安装 llama-cpp-python: pip install llama-cpp-python")
+    return llama_cpp.llama_get_logits_ith
+
+
+def _import_quantize_api():
+    """
+    延迟导入 llama.cpp 的量化接口
+
+    Returns:
+        (llama_model_quantize_default_params, llama_model_quantize, {文件类型名称: 值})
+    """
+    try:
+        import llama_cpp
+    except ImportError:
+        raise ImportError("请安装 llama-cpp-python: pip install llama-cpp-python")
+    if not hasattr(llama_cpp, "llama_model_quantize"):
+        raise RuntimeError("当前 llama-cpp-python 版本不支持量化模型，请升级")
+    ftypes = {
+        name[len("LLAMA_FTYPE_"):]: getattr(llama_cpp, name)
+        for name in dir(llama_cpp) if name.startswith("LLAMA_FTYPE_")
+    }
+    return llama_cpp.llama_model_quantize_default_params, llama_cpp.llama_model_quantize, ftypes
+
+
 class InferenceEngine:
     """基于 llama.cpp 的推理引擎"""
     
-    def __init__(self, n_ctx: int = 2048, n_threads: Optional[int] = None):
+    def __init__(self, n_ctx: Optional[int] = None, n_threads: Optional[int] = None):
         """
         初始化推理引擎
         
         Args:
-            n_ctx: 上下文长度
+            n_ctx: 默认上下文长度，None表示使用 config.N_CTX
             n_threads: 线程数，None表示自动检测
         """
         self.loaded_models = {}
-        self.n_ctx = n_ctx
+        self.n_ctx = n_ctx or config.N_CTX
         self.n_threads = n_threads or os.cpu_count()
         
+        # 最近请求实际占用的上下文长度（提示词+生成），加载模型时据此选择 n_ctx；
+        # 按模型文件路径统计（不同仓库或版本中的同名文件各自统计）
+        self._ctx_usage: Dict[str, deque] = {}
+        self._ctx_lock = threading.Lock()
+        
+        self.kv_cache_type = config.KV_CACHE_TYPE
+        if self.kv_cache_type not in KV_CACHE_TYPES:
+            logger.warning(f"不支持的KV缓存类型 {self.kv_cache_type}，使用 f16")
+            self.kv_cache_type = "f16"
+        
+        # 编译后的语法缓存（按内容哈希，LRU淘汰）
+        self._grammar_cache: "OrderedDict[str, Any]" = OrderedDict()
+        self._grammar_lock = threading.Lock()
+        
+        # 加载锁避免同一模型被并发重复加载；引用计数用于卸载前等待进行中的请求结束
+        self._load_lock = threading.Lock()
+        self._model_refs: Dict[str, int] = {}
+        self._refs_cond = threading.Condition()
+        
         # 检测设备能力
         self.device_info = self._detect_device_capabilities()
-        logger.info(f"推理引擎初始化完成，线程数: {self.n_threads}, 上下文长度: {n_ctx}")
+        logger.info(f"推理引擎初始化完成，线程数: {self.n_threads}, 上下文长度: {self.n_ctx}")
     
     def _detect_device_capabilities(self) -> Dict[str, Any]:
         """检测设备能力"""
+        cpu = cpu_info()
         info = {
             "cpu_count": os.cpu_count(),
+            "cpu": cpu,
+            "host_id": host_id(),
             "supports_gpu": False,
             "supports_metal": False
         }
         
-        # 检测GPU支持（CUDA/OpenCL）
+        # 检测GPU支持（llama.cpp 编译时启用了 CUDA/Vulkan/SYCL 等后端）
         try:
-            # 这里可以添加GPU检测逻辑
-            pass
-        except:
+            import llama_cpp
+            supports_offload = getattr(llama_cpp, "llama_supports_gpu_offload", None)
+            if supports_offload is not None:
+                info["supports_gpu"] = bool(supports_offload())
+        except Exception:
             pass
         
         # 检测Metal支持（macOS）
@@ -59,6 +180,156 @@ class InferenceEngine:
         
         return info
     
+    def get_grammar(
+        self,
+        grammar: Optional[str] = None,
+        json_schema: Optional[Union[Dict[str, Any], str]] = None
+    ):
+        """
+        获取编译后的约束语法，相同内容只编译一次
+        
+        Args:
+            grammar: GBNF 语法文本
+            json_schema: JSON Schema（dict 或 JSON 字符串）
+            
+        Returns:
+            LlamaGrammar 实例，未指定约束时返回None
+        """
+        if grammar is None and json_schema is None:
+            return None
+        if grammar is not None and json_schema is not None:
+            raise ValueError("grammar 和 json_schema 只能指定其中一个")
+        
+        if json_schema is not None:
+            kind = "json_schema"
+            source = json_schema if isinstance(json_schema, str) else json.dumps(json_schema, ensure_ascii=False)
+        else:
+            kind = "gbnf"
+            source = grammar
+        key = hashlib.sha256(f"{kind}:{source}".encode("utf-8")).hexdigest()
+        
+        with self._grammar_lock:
+            compiled = self._grammar_cache.get(key)
+            if compiled is not None:
+                self._grammar_cache.move_to_end(key)
+                return compiled
+        
+        LlamaGrammar = _import_llama_grammar()
+        if kind == "json_schema":
+            compiled = LlamaGrammar.from_json_schema(source, verbose=False)
+        else:
+            compiled = LlamaGrammar.from_string(source, verbose=False)
+        logger.info(f"语法编译完成 ({kind}, {key[:12]})")
+        
+        with self._grammar_lock:
+            self._grammar_cache[key] = compiled
+            while len(self._grammar_cache) > config.GRAMMAR_CACHE_SIZE:
+                self._grammar_cache.popitem(last=False)
+        return compiled
+    
+    @contextmanager
+    def _locked(self, model_info: Dict[str, Any]):
+        """持有模型锁，等待锁的时间记为 queue_wait 阶段"""
+        with span("queue_wait"):
+            model_info["lock"].acquire()
+        try:
+            yield
+        finally:
+            model_info["lock"].release()
+    
+    @contextmanager
+    def _inference_span(self, llama_model):
+        """
+        记录一次推理调用的耗时
+        
+        llama.cpp 支持性能计数时拆分为 prompt_eval、decode 和其余的 python_overhead
+        （采样、反分词等），否则整体记为 inference。
+        """
+        trace = current_trace()
+        if trace is None:
+            yield
+            return
+        
+        perf = _import_perf_api()
+        if perf is not None:
+            perf[1](llama_model.ctx)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            total_ms = (time.perf_counter() - start) * 1000
+            start_ms = trace.offset_ms(start)
+            if perf is None:
+                trace.add_span("inference", start_ms, total_ms)
+            else:
+                data = perf[0](llama_model.ctx)
+                trace.add_span("prompt_eval", start_ms, data.t_p_eval_ms, n_tokens=data.n_p_eval)
+                trace.add_span("decode", start_ms + data.t_p_eval_ms, data.t_eval_ms, n_tokens=data.n_eval)
+                trace.add_span(
+                    "python_overhead",
+                    start_ms + data.t_p_eval_ms + data.t_eval_ms,
+                    max(total_ms - data.t_p_eval_ms - data.t_eval_ms, 0.0)
+                )
+    
+    def record_context_usage(self, model_path: str, n_tokens: int):
+        """记录一次请求占用的上下文长度（按模型文件路径统计，同名文件不会混在一起）"""
+        if n_tokens <= 0:
+            return
+        with self._ctx_lock:
+            usage = self._ctx_usage.get(model_path)
+            if usage is None:
+                usage = self._ctx_usage[model_path] = deque(maxlen=1000)
+            usage.append(n_tokens)
+    
+    def choose_n_ctx(self, model_path: str) -> int:
+        """
+        选择加载模型时的上下文长度
+        
+        统计足够时从 N_CTX_MIN 起按2倍增大，取覆盖 N_CTX_PERCENTILE 分位请求长度的
+        最小值（不超过 N_CTX_MAX），否则使用默认值。N_CTX_MIN 默认等于 N_CTX，
+        上下文只会增大：缩小后，之后更长的提示词在模型重新加载前都会超出上下文。
+        """
+        if not config.N_CTX_ADAPTIVE:
+            return self.n_ctx
+        with self._ctx_lock:
+            samples = sorted(self._ctx_usage.get(model_path, ()))
+        if len(samples) < config.N_CTX_MIN_SAMPLES:
+            return self.n_ctx
+        
+        needed = samples[min(int(len(samples) * config.N_CTX_PERCENTILE), len(samples) - 1)]
+        n_ctx = config.N_CTX_MIN
+        while n_ctx < needed and n_ctx < config.N_CTX_MAX:
+            n_ctx *= 2
+        return min(n_ctx, config.N_CTX_MAX)
+    
+    def acquire_model(self, model_path: str):
+        """登记一个使用该模型的请求（卸载时会等待其结束）"""
+        with self._refs_cond:
+            self._model_refs[model_path] = self._model_refs.get(model_path, 0) + 1
+    
+    def release_model(self, model_path: str):
+        """请求结束，释放对模型的引用"""
+        with self._refs_cond:
+            count = self._model_refs.get(model_path, 0) - 1
+            if count > 0:
+                self._model_refs[model_path] = count
+            else:
+                self._model_refs.pop(model_path, None)
+                self._refs_cond.notify_all()
+    
+    def wait_until_idle(self, model_path: str, timeout: Optional[float] = None) -> bool:
+        """
+        等待使用该模型的请求全部结束
+        
+        Returns:
+            是否已空闲（超时返回False）
+        """
+        with self._refs_cond:
+            return self._refs_cond.wait_for(
+                lambda: self._model_refs.get(model_path, 0) == 0,
+                timeout=timeout
+            )
+    
     def load_model(self, model_path: str, **kwargs) -> bool:
         """
         加载GGUF格式的模型
@@ -70,6 +341,40 @@ class InferenceEngine:
         Returns:
             是否加载成功
         """
+        with self._load_lock:
+            if model_path in self.loaded_models:
+                return True
+            with span("model_load"):
+                return self._load_model(model_path, **kwargs)
+    
+    def default_load_params(self, model_path: str) -> Dict[str, Any]:
+        """
+        模型的默认加载参数（未调优时使用，也是调优测量的基准）
+        """
+        llama_kwargs = {
+            "model_path": model_path,
+            "n_ctx": self.choose_n_ctx(model_path),
+            "n_threads": self.n_threads,
+            "use_mmap": config.USE_MMAP,
+            "use_mlock": config.USE_MLOCK,
+            "verbose": False,
+        }
+        
+        # 量化KV缓存：同样内存可容纳更长的上下文或更多并发序列，
+        # llama.cpp 量化V缓存需要开启 flash attention
+        if self.kv_cache_type != "f16":
+            ggml_type = KV_CACHE_TYPES[self.kv_cache_type][0]
+            llama_kwargs.update({"type_k": ggml_type, "type_v": ggml_type, "flash_attn": True})
+        
+        # 根据设备能力调整参数
+        if self.device_info.get("supports_metal"):
+            llama_kwargs["n_gpu_layers"] = -1  # 使用Metal加速
+        elif self.device_info.get("supports_gpu") and config.USE_GPU:
+            llama_kwargs["n_gpu_layers"] = -1
+        return llama_kwargs
+    
+    def _load_model(self, model_path: str, **kwargs) -> bool:
+        """加载模型（调用方需持有加载锁）"""
         try:
             # 检查模型文件是否存在
             if not os.path.exists(model_path):
@@ -82,29 +387,40 @@ class InferenceEngine:
             
             logger.info(f"正在加载模型: {model_path}")
             
-            # 设置默认参数
-            llama_kwargs = {
-                "model_path": model_path,
-                "n_ctx": self.n_ctx,
-                "n_threads": self.n_threads,
-                "verbose": False,
-                **kwargs
-            }
+            # 以共享只读方式映射权重文件并提示内核预读，llama.cpp 的 mmap
+            # 与其他工作进程都会复用同一份页缓存
+            shared_mapping = None
+            if config.USE_MMAP and (config.MMAP_PREFETCH or config.MMAP_HUGEPAGES):
+                shared_mapping = map_model_file(
+                    model_path,
+                    prefetch=config.MMAP_PREFETCH,
+                    hugepages=config.MMAP_HUGEPAGES
+                )
             
-            # 根据设备能力调整参数
-            if self.device_info.get("supports_metal"):
-                llama_kwargs["n_gpu_layers"] = -1  # 使用Metal加速
-                logger.info("启用Metal GPU加速")
+            # 默认参数，调用方传入的参数（如本机调优结果）优先
+            llama_kwargs = self.default_load_params(model_path)
+            llama_kwargs.update(kwargs)
+            logger.info(
+                f"上下文长度: {llama_kwargs['n_ctx']}, KV缓存类型: {self.kv_cache_type}, "
+                f"线程数: {llama_kwargs['n_threads']}/{llama_kwargs.get('n_threads_batch', llama_kwargs['n_threads'])}, "
+                f"批大小: {llama_kwargs.get('n_batch', 512)}/{llama_kwargs.get('n_ubatch', 512)}"
+            )
+            if llama_kwargs.get("n_gpu_layers"):
+                logger.info("启用GPU加速" if not self.device_info.get("supports_metal") else "启用Metal GPU加速")
             
             # 创建Llama实例
+            Llama = _import_llama()
             llama_model = Llama(**llama_kwargs)
             
-            self.loaded_models[model_path] = {
-                "model": llama_model,
-                "model_path": model_path,
-                "n_ctx": self.n_ctx,
-                "load_params": llama_kwargs
-            }
+            self.loaded_models[model_path] = self._model_entry(
+                model_path,
+                llama_model,
+                llama_kwargs,
+                # 模型自身的停止词（来自GGUF聊天模板和EOS），每个请求都会生效
+                stop=self._model_stop_sequences(llama_model),
+                kv_cache_type=self.kv_cache_type if "type_k" in llama_kwargs else "f16",
+                shared_mapping=shared_mapping
+            )
             
             logger.info(f"模型 {model_path} 加载成功")
             return True
@@ -113,19 +429,210 @@ class InferenceEngine:
             logger.error(f"加载模型 {model_path} 时出错: {str(e)}")
             return False
     
-    def unload_model(self, model_path: str) -> bool:
-        """卸载模型"""
-        if model_path in self.loaded_models:
-            # llama.cpp会自动清理资源
-            del self.loaded_models[model_path]
+    @staticmethod
+    def _model_entry(
+        model_path: str,
+        llama_model,
+        load_params: Dict[str, Any],
+        stop: List[str],
+        kv_cache_type: str = "f16",
+        shared_mapping=None
+    ) -> Dict[str, Any]:
+        """已加载模型的记录（模拟后端也用它创建，字段与真实加载保持一致）"""
+        return {
+            "model": llama_model,
+            "model_path": model_path,
+            "n_ctx": load_params["n_ctx"],
+            "kv_cache_type": kv_cache_type,
+            "stop": stop,
+            "load_params": load_params,
+            "shared_mapping": shared_mapping,
+            # 同一个 Llama 实例不能并发推理，请求按模型串行；流式生成器在线程池中
+            # 每次取下一帧可能换线程，不能用只允许持有线程释放的 RLock
+            "lock": threading.Lock(),
+            # 已加载的LoRA适配器（LRU）及当前生效的 (路径, 强度)
+            "adapters": OrderedDict(),
+            "active_adapter": None,
+            # token -> (输出文本中的字节数, 显示文本)，返回 logprobs 时使用
+            "token_text": {}
+        }
+    
+    @staticmethod
+    def _model_stop_sequences(llama_model) -> List[str]:
+        """从GGUF元数据中提取模型的回合结束标记"""
+        metadata = getattr(llama_model, "metadata", None)
+        template = metadata.get("tokenizer.chat_template", "") if isinstance(metadata, dict) else ""
+        stops = [marker for marker in _END_OF_TURN_MARKERS if marker in template]
+        
+        try:
+            eos = llama_model.detokenize([llama_model.token_eos()], special=True).decode("utf-8", errors="ignore")
+        except Exception:
+            eos = ""
+        if eos and eos not in stops:
+            stops.append(eos)
+        
+        # 元数据不完整时沿用通用的结束标记
+        return stops or ["</s>", "<|endoftext|>"]
+    
+    @staticmethod
+    def _resolve_stops(model_info: Dict[str, Any], stop: Optional[List[str]]) -> List[str]:
+        """合并模型停止词和请求指定的停止词"""
+        stops = list(model_info["stop"])
+        if stop:
+            stops.extend(s for s in stop if s and s not in stops)
+        return stops
+    
+    def warm_up(self, model_path: str) -> bool:
+        """预热模型：执行一次极短的推理，让权重页和计算缓冲区就绪"""
+        if model_path not in self.loaded_models:
+            return False
+        try:
+            model_info = self.loaded_models[model_path]
+            with self._locked(model_info):
+                model_info["model"]("Hello", max_tokens=1, echo=False)
+            return True
+        except Exception as e:
+            logger.warning(f"预热模型 {model_path} 失败: {str(e)}")
+            return False
+    
+    def unload_model(self, model_path: str, wait: bool = False, timeout: Optional[float] = None) -> bool:
+        """
+        卸载模型
+        
+        Args:
+            model_path: 模型路径
+            wait: 是否先等待进行中的请求结束
+            timeout: 等待超时（秒），None表示一直等待
+        """
+        if wait and not self.wait_until_idle(model_path, timeout):
+            logger.warning(f"等待模型 {model_path} 的请求结束超时，强制卸载")
+        model_info = self.loaded_models.pop(model_path, None)
+        if model_info is not None:
+            # llama.cpp会自动清理资源（评分上下文引用模型权重，需先释放）
+            self._close_scorer(model_info)
+            self._close_mapping(model_info)
             logger.info(f"模型 {model_path} 已卸载")
             return True
         return False
     
+    def _get_adapter(self, model_info: Dict[str, Any], adapter_path: str):
+        """获取基础模型上已加载的LoRA适配器，未加载时加载并按LRU淘汰（调用方需持有模型锁）"""
+        adapters = model_info["adapters"]
+        if adapter_path in adapters:
+            adapters.move_to_end(adapter_path)
+            return adapters[adapter_path]
+        
+        if not os.path.exists(adapter_path):
+            raise FileNotFoundError(f"LoRA适配器文件不存在: {adapter_path}")
+        
+        adapter_init, _, _, adapter_free = _import_lora_api()
+        handle = adapter_init(model_info["model"].model, adapter_path.encode("utf-8"))
+        if not handle:
+            raise RuntimeError(f"加载LoRA适配器失败: {adapter_path}")
+        adapters[adapter_path] = handle
+        logger.info(f"LoRA适配器已加载: {adapter_path}")
+        
+        active = model_info["active_adapter"]
+        for path in list(adapters.keys()):
+            if len(adapters) <= config.LORA_CACHE_SIZE:
+                break
+            if path == adapter_path or (active and path == active[0]):
+                continue
+            adapter_free(adapters.pop(path))
+            logger.info(f"LoRA适配器已淘汰: {path}")
+        return handle
+    
+    def _activate_adapter(self, model_info: Dict[str, Any], adapter_path: Optional[str], adapter_scale: float):
+        """
+        在常驻的基础模型上切换LoRA适配器，无需重新加载基础模型（调用方需持有模型锁）
+        
+        Args:
+            model_info: 已加载的基础模型信息
+            adapter_path: 适配器路径，None表示使用基础模型
+            adapter_scale: 适配器强度
+        """
+        wanted = (adapter_path, adapter_scale) if adapter_path else None
+        active = model_info["active_adapter"]
+        if active == wanted:
+            return
+        
+        _, adapter_set, adapter_remove, _ = _import_lora_api()
+        llama_model = model_info["model"]
+        ctx = llama_model.ctx
+        
+        if active is not None:
+            adapter_remove(ctx, model_info["adapters"][active[0]])
+            model_info["active_adapter"] = None
+        if wanted is not None:
+            handle = self._get_adapter(model_info, adapter_path)
+            adapter_set(ctx, handle, adapter_scale)
+            model_info["active_adapter"] = wanted
+        
+        # KV缓存是在切换前的权重下计算的，不能再被前缀复用
+        llama_model.reset()
+    
+    def drop_adapter(self, adapter_path: str):
+        """从所有基础模型上移除并释放指定的LoRA适配器"""
+        for model_info in list(self.loaded_models.values()):
+            with model_info["lock"]:
+                if adapter_path not in model_info["adapters"]:
+                    continue
+                active = model_info["active_adapter"]
+                if active and active[0] == adapter_path:
+                    self._activate_adapter(model_info, None, 1.0)
+                _, _, _, adapter_free = _import_lora_api()
+                adapter_free(model_info["adapters"].pop(adapter_path))
+    
+    @staticmethod
+    def _close_scorer(model_info: Dict[str, Any]):
+        """释放评分时创建的上下文"""
+        scorer = model_info.pop("scorer", None)
+        if scorer is not None:
+            scorer.close()
+    
+    @staticmethod
+    def _close_mapping(model_info: Dict[str, Any]):
+        """关闭加载时创建的共享映射"""
+        mapping = model_info.get("shared_mapping")
+        if mapping is not None:
+            mapping.close()
+    
     def is_model_loaded(self, model_path: str) -> bool:
         """检查模型是否已加载"""
         return model_path in self.loaded_models
     
+    def is_model_idle(self, model_path: str) -> bool:
+        """模型上没有进行中的请求"""
+        with self._refs_cond:
+            return self._model_refs.get(model_path, 0) == 0
+    
+    def shrink_caches(self) -> Dict[str, int]:
+        """
+        释放可以重建的缓存（内存压力下调用）：编译后的语法、token文本，以及空闲模型的评分上下文
+        
+        评分上下文有独立的KV缓存，是除模型权重外最大的一块；正在使用的模型跳过。
+        
+        Returns:
+            各类缓存释放的条目数
+        """
+        with self._grammar_lock:
+            grammars = len(self._grammar_cache)
+            self._grammar_cache.clear()
+        
+        scorers = token_texts = 0
+        for model_info in list(self.loaded_models.values()):
+            if not model_info["lock"].acquire(blocking=False):
+                continue
+            try:
+                if "scorer" in model_info:
+                    self._close_scorer(model_info)
+                    scorers += 1
+                token_texts += len(model_info["token_text"])
+                model_info["token_text"].clear()
+            finally:
+                model_info["lock"].release()
+        return {"grammars": grammars, "scorers": scorers, "token_texts": token_texts}
+    
     def generate_text(
         self, 
         model_path: str, 
@@ -136,6 +643,13 @@ class InferenceEngine:
         top_k: int = 40,
         repeat_penalty: float = 1.1,
         stop: Optional[List[str]] = None,
+        grammar: Optional[str] = None,
+        json_schema: Optional[Union[Dict[str, Any], str]] = None,
+        n: int = 1,
+        adapter_path: Optional[str] = None,
+        adapter_scale: float = 1.0,
+        logprobs: bool = False,
+        top_logprobs: int = 0,
         **kwargs
     ) -> Dict[str, Any]:
         """
@@ -150,41 +664,87 @@ class InferenceEngine:
             top_k: top-k采样参数
             repeat_penalty: 重复惩罚
             stop: 停止词列表
+            grammar: GBNF 语法，采样时约束输出
+            json_schema: JSON Schema，采样时约束输出为符合该结构的JSON
+            n: 返回的候选数量（1~MAX_RETURN_SEQUENCES），提示词只评估一次
+            adapter_path: 应用在该模型上的LoRA适配器路径（可选）
+            adapter_scale: LoRA适配器强度
+            logprobs: 是否返回每个输出token的对数概率
+            top_logprobs: 每个位置额外返回的概率最高的候选数（0~20，大于0时自动开启 logprobs）
             
         Returns:
-            生成结果
+            生成结果，choices 中包含每个候选的文本、结束原因和token用量（以及 logprobs）
         """
+        if not 1 <= n <= config.MAX_RETURN_SEQUENCES:
+            return {"error": f"n 必须在1到{config.MAX_RETURN_SEQUENCES}之间"}
+        if not 0 <= top_logprobs <= MAX_TOP_LOGPROBS:
+            return {"error": f"top_logprobs 必须在0到{MAX_TOP_LOGPROBS}之间"}
+        
         if not self.is_model_loaded(model_path):
             if not self.load_model(model_path):
                 return {"error": "模型加载失败"}
         
+        prompt_ids = None
         try:
             model_info = self.loaded_models[model_path]
             llama_model = model_info["model"]
             
-            # 设置停止词
-            if stop is None:
-                stop = ["</s>", "<|endoftext|>", "\n\n"]
+            # 停止词：模型自身的回合结束标记加上请求指定的停止词
+            stop = self._resolve_stops(model_info, stop)
+            
+            compiled_grammar = self.get_grammar(grammar, json_schema)
+            if compiled_grammar is not None:
+                kwargs["grammar"] = compiled_grammar
             
             logger.info(f"开始生成文本，提示: {prompt[:50]}...")
             
             # 生成文本
-            output = llama_model(
-                prompt,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                top_p=top_p,
-                top_k=top_k,
-                repeat_penalty=repeat_penalty,
-                stop=stop,
-                echo=False,  # 不回显输入
-                **kwargs
-            )
+            # 第一个候选完成提示词评估；之后的候选由 llama.cpp 按最长公共前缀复用
+            # 提示词的KV缓存（截断到提示词末尾再分叉采样），不会重复评估提示词
+            # 与 llama.cpp 内部相同的方式分词，n 个候选共用一次分词结果
+            with span("tokenize"):
+                prompt_ids = (
+                    llama_model.tokenize(prompt.encode("utf-8"), special=True)
+                    if prompt else [llama_model.token_bos()]
+                )
             
-            generated_text = output["choices"][0]["text"]
+            automaton = get_automaton(tuple(stop))
+            choices = []
+            prompt_tokens = len(prompt_ids)
+            with self._locked(model_info):
+                self._activate_adapter(model_info, adapter_path, adapter_scale)
+                for index in range(n):
+                    recorder = self._logprob_recorder(model_info, logprobs, top_logprobs)
+                    with self._inference_span(llama_model), self._recording(llama_model, recorder):
+                        text, finish_reason, completion_tokens = self._complete(
+                            llama_model,
+                            prompt_ids,
+                            automaton,
+                            max_tokens=max_tokens,
+                            temperature=temperature,
+                            top_p=top_p,
+                            top_k=top_k,
+                            repeat_penalty=repeat_penalty,
+                            **kwargs
+                        )
+                    choice = {
+                        "index": index,
+                        "text": text,
+                        "finish_reason": finish_reason,
+                        "usage": {"completion_tokens": completion_tokens}
+                    }
+                    if recorder is not None:
+                        choice["logprobs"] = {"content": recorder.take(len(text.encode("utf-8")))}
+                    choices.append(choice)
+            
+            completion_tokens = sum(c["usage"]["completion_tokens"] for c in choices)
+            self.record_context_usage(
+                model_path, prompt_tokens + max(c["usage"]["completion_tokens"] for c in choices)
+            )
             
             return {
-                "generated_text": generated_text,
+                "generated_text": choices[0]["text"],
+                "choices": choices,
                 "prompt": prompt,
                 "model_path": model_path,
                 "parameters": {
@@ -192,16 +752,212 @@ class InferenceEngine:
                     "temperature": temperature,
                     "top_p": top_p,
                     "top_k": top_k,
-                    "repeat_penalty": repeat_penalty
+                    "repeat_penalty": repeat_penalty,
+                    "n": n
+                },
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens
                 },
-                "usage": output.get("usage", {}),
-                "finish_reason": output["choices"][0].get("finish_reason")
+                "finish_reason": choices[0]["finish_reason"],
+                **({"logprobs": choices[0]["logprobs"]} if "logprobs" in choices[0] else {})
             }
             
         except Exception as e:
             logger.error(f"生成文本时出错: {str(e)}")
+            if prompt_ids is not None:
+                # 提示词超出上下文时也计入统计，下次加载会选择更大的上下文
+                self.record_context_usage(model_path, len(prompt_ids))
             return {"error": str(e)}
     
+    @staticmethod
+    def _token_text(model_info: Dict[str, Any], token: int) -> Tuple[int, str]:
+        """token 在输出文本中的字节数（特殊token不输出文本）和显示文本（带缓存）"""
+        cached = model_info["token_text"].get(token)
+        if cached is None:
+            llama_model = model_info["model"]
+            cached = (
+                len(llama_model.detokenize([token])),
+                llama_model.detokenize([token], special=True).decode("utf-8", errors="replace")
+            )
+            model_info["token_text"][token] = cached
+        return cached
+    
+    def _logprob_recorder(self, model_info: Dict[str, Any], logprobs: bool, top_logprobs: int):
+        """请求了 logprobs 时创建记录器，否则返回None"""
+        if not logprobs and not top_logprobs:
+            return None
+        from utils.logprobs import LogprobRecorder
+        return LogprobRecorder(
+            model_info["model"].n_vocab(),
+            top_logprobs,
+            lambda token: self._token_text(model_info, token)
+        )
+    
+    @staticmethod
+    @contextmanager
+    def _recording(llama_model, recorder):
+        """
+        在每次采样后记录采样到的token及其 logits（调用方需持有模型锁）
+        
+        生成与聊天都经由 Llama.sample 逐个采样，这里临时替换实例上的 sample：采样后
+        立即从 llama.cpp 读取产生该token的 logits（此时还没有评估下一个token），
+        不需要以 logits_all=True 加载模型。
+        """
+        if recorder is None:
+            yield
+            return
+        
+        get_logits_ith = _import_logits_api()
+        sample = type(llama_model).sample
+        
+        def recording_sample(*args, **kwargs):
+            token = sample(llama_model, *args, **kwargs)
+            idx = kwargs.get("idx")
+            recorder.record(token, get_logits_ith(llama_model.ctx, -1 if idx is None else idx - llama_model.n_tokens))
+            return token
+        
+        llama_model.sample = recording_sample
+        try:
+            yield
+        finally:
+            del llama_model.sample
+    
+    @staticmethod
+    def _complete(llama_model, prompt_ids: List[int], automaton, **kwargs):
+        """
+        逐token生成并增量匹配停止词，命中后立即停止解码
+        
+        llama-cpp-python 自带的停止词检查每个token都在全部已生成文本中查找，
+        生成越长越慢；这里停止词交给自动机处理，每个token的开销固定。
+        
+        Returns:
+            (文本, 结束原因, 生成token数)
+        """
+        stream = llama_model(prompt_ids, stream=True, echo=False, **kwargs)
+        scanner = automaton.scanner()
+        pieces = []
+        finish_reason = None
+        stopped = False
+        try:
+            for chunk in stream:
+                choice = chunk["choices"][0]
+                if choice.get("finish_reason"):
+                    finish_reason = choice["finish_reason"]
+                text, stopped = scanner.feed(choice.get("text") or "")
+                if text:
+                    pieces.append(text)
+                if stopped:
+                    finish_reason = "stop"
+                    break
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+        
+        # 片段与token不是一一对应（多字节字符跨token时合并输出），按上下文中的token数计算：
+        # 每个采样的token在取下一个token时才被评估，最后一个不会被评估。遇到EOS结束时
+        # 最后一个是EOS，不计入生成token数；达到长度上限或命中停止词时需要补上它
+        completion_tokens = llama_model.n_tokens - len(prompt_ids)
+        if stopped or finish_reason == "length":
+            completion_tokens += 1
+        
+        pieces.append(scanner.flush())
+        return "".join(pieces), finish_reason or "length", max(completion_tokens, 0)
+    
+    @staticmethod
+    def _score_tokens(llama_model, prompt: str, continuation: str) -> Tuple[List[int], List[int]]:
+        """
+        分别对提示词和续写分词
+        
+        提示词末尾的空白移到续写开头：多数词表把空格与其后的词合为一个token，
+        "答案: " + "巴黎" 与生成时看到的 "答案:" + " 巴黎" 保持一致。
+        """
+        stripped = prompt.rstrip()
+        continuation = prompt[len(stripped):] + continuation
+        prompt_ids = (
+            llama_model.tokenize(stripped.encode("utf-8"), special=True)
+            if stripped else [llama_model.token_bos()]
+        )
+        continuation_ids = (
+            llama_model.tokenize(continuation.encode("utf-8"), add_bos=False, special=True)
+            if continuation else []
+        )
+        return prompt_ids, continuation_ids
+    
+    def score(
+        self,
+        model_path: str,
+        pairs: List[Tuple[str, str]],
+        token_logprobs: bool = False
+    ) -> Dict[str, Any]:
+        """
+        计算续写在提示词下的对数似然（只做提示词评估，不生成）
+        
+        在与模型共享权重的独立评分上下文中进行，不影响推理上下文中复用的提示词KV缓存。
+        
+        Args:
+            model_path: 模型路径
+            pairs: [(提示词, 续写)]，提示词为空时从BOS开始（即整段文本的困惑度）
+            token_logprobs: 是否返回逐token的对数概率及token文本
+            
+        Returns:
+            results 与 pairs 一一对应（logprob、n_tokens、perplexity、is_greedy，
+            单项失败时为 {"error": ...}），以及全部续写合计的 logprob 和 perplexity
+        """
+        if not self.is_model_loaded(model_path):
+            if not self.load_model(model_path):
+                return {"error": "模型加载失败"}
+        
+        try:
+            model_info = self.loaded_models[model_path]
+            llama_model = model_info["model"]
+            with span("tokenize"):
+                requests = [self._score_tokens(llama_model, prompt, continuation) for prompt, continuation in pairs]
+            
+            with self._locked(model_info):
+                scorer = model_info.get("scorer")
+                if scorer is None:
+                    from scoring import Scorer
+                    scorer = model_info["scorer"] = Scorer(
+                        llama_model, config.SCORE_N_CTX, config.SCORE_PARALLEL + 1, model_info["load_params"]
+                    )
+                with span("score", n_pairs=len(requests)):
+                    results = scorer.score(requests)
+                evaluated = scorer.evaluated
+        except Exception as e:
+            logger.error(f"评分时出错: {str(e)}")
+            return {"error": str(e)}
+        
+        total = 0.0
+        n_tokens = 0
+        for result, (_, continuation_ids) in zip(results, requests):
+            if "error" in result:
+                continue
+            total += result["logprob"]
+            n_tokens += result["n_tokens"]
+            if token_logprobs:
+                result["tokens"] = [
+                    llama_model.detokenize([token], special=True).decode("utf-8", errors="replace")
+                    for token in continuation_ids
+                ]
+            else:
+                del result["token_logprobs"]
+        
+        return {
+            "results": results,
+            "logprob": total,
+            "n_tokens": n_tokens,
+            "perplexity": math.exp(-total / n_tokens) if n_tokens else None,
+            "usage": {
+                "prompt_tokens": sum(len(prompt_ids) for prompt_ids, _ in requests),
+                "scored_tokens": n_tokens,
+                # 实际评估的token数，共享的提示词前缀只计一次
+                "evaluated_tokens": evaluated
+            }
+        }
+    
     def get_model_info(self, model_path: str) -> Optional[Dict[str, Any]]:
         """获取已加载模型的信息"""
         if model_path in self.loaded_models:
@@ -209,17 +965,40 @@ class InferenceEngine:
             return {
                 "path": model_path,
                 "n_ctx": model_info["n_ctx"],
+                "kv_cache": self._kv_cache_info(model_info),
                 "device_info": self.device_info,
-                "load_params": model_info["load_params"]
+                "load_params": model_info["load_params"],
+                "adapters": list(model_info["adapters"].keys()),
+                "active_adapter": model_info["active_adapter"],
+                # 共享(页缓存，多进程共用)与私有内存，单位KB；非Linux为None
+                "memory": file_mapping_memory(model_path)
             }
         return None
     
+    @staticmethod
+    def _kv_cache_info(model_info: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        KV缓存占用：每个模型实例即一个序列槽位，槽位占用 = n_ctx × 每token字节数
+        """
+        cache_type = model_info["kv_cache_type"]
+        info = {"type": cache_type, "n_ctx": model_info["n_ctx"], "bytes_per_token": None, "slot_mb": None}
+        metadata = getattr(model_info["model"], "metadata", None)
+        if isinstance(metadata, dict):
+            per_token = kv_cache_bytes_per_token(metadata, cache_type)
+            if per_token is not None:
+                info["bytes_per_token"] = round(per_token, 1)
+                info["slot_mb"] = round(per_token * model_info["n_ctx"] / 1024 / 1024, 2)
+        return info
+    
     def list_loaded_models(self) -> List[str]:
         """列出已加载的模型"""
         return list(self.loaded_models.keys())
     
     def clear_all_models(self):
         """清除所有已加载的模型"""
+        for model_info in self.loaded_models.values():
+            self._close_scorer(model_info)
+            self._close_mapping(model_info)
         self.loaded_models.clear()
         logger.info("所有模型已清除")
     
@@ -229,6 +1008,13 @@ class InferenceEngine:
         messages: List[Dict[str, str]],
         max_tokens: int = 32768,
         temperature: float = 0.7,
+        stop: Optional[List[str]] = None,
+        grammar: Optional[str] = None,
+        json_schema: Optional[Union[Dict[str, Any], str]] = None,
+        adapter_path: Optional[str] = None,
+        adapter_scale: float = 1.0,
+        logprobs: bool = False,
+        top_logprobs: int = 0,
         **kwargs
     ) -> Dict[str, Any]:
         """
@@ -239,10 +1025,19 @@ class InferenceEngine:
             messages: 消息列表，格式: [{"role": "user", "content": "..."}]
             max_tokens: 最大生成token数
             temperature: 温度参数
+            stop: 停止词列表（在模型自身的回合结束标记之外追加）
+            grammar: GBNF 语法，采样时约束输出
+            json_schema: JSON Schema，采样时约束输出为符合该结构的JSON
+            adapter_path: 应用在该模型上的LoRA适配器路径（可选）
+            adapter_scale: LoRA适配器强度
+            logprobs: 是否返回每个输出token的对数概率
+            top_logprobs: 每个位置额外返回的概率最高的候选数（0~20）
             
         Returns:
             聊天补全结果
         """
+        if not 0 <= top_logprobs <= MAX_TOP_LOGPROBS:
+            return {"error": f"top_logprobs 必须在0到{MAX_TOP_LOGPROBS}之间", "success": False}
         if not self.is_model_loaded(model_path):
             if not self.load_model(model_path):
                 return {"error": "模型加载失败", "success": False}
@@ -251,24 +1046,39 @@ class InferenceEngine:
             model_info = self.loaded_models[model_path]
             llama_model = model_info["model"]
             
+            compiled_grammar = self.get_grammar(grammar, json_schema)
+            if compiled_grammar is not None:
+                kwargs["grammar"] = compiled_grammar
+            
             # 使用llama.cpp的chat completion功能
-            response = llama_model.create_chat_completion(
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                **kwargs
-            )
+            recorder = self._logprob_recorder(model_info, logprobs, top_logprobs)
+            with self._locked(model_info):
+                self._activate_adapter(model_info, adapter_path, adapter_scale)
+                with self._inference_span(llama_model), self._recording(llama_model, recorder):
+                    response = llama_model.create_chat_completion(
+                        messages=messages,
+                        max_tokens=max_tokens,
+                        temperature=temperature,
+                        stop=self._resolve_stops(model_info, stop),
+                        **kwargs
+                    )
+            
+            usage = (response.get("usage") or {}) if response else {}
+            self.record_context_usage(model_path, usage.get("total_tokens", 0))
             
             # 提取生成的文本
             if response and "choices" in response and len(response["choices"]) > 0:
                 generated_text = response["choices"][0]["message"]["content"]
-                return {
+                result = {
                     "success": True,
                     "response": generated_text,
                     "model_path": model_path,
                     "usage": response.get("usage", {}),
                     "finish_reason": response["choices"][0].get("finish_reason")
                 }
+                if recorder is not None:
+                    result["logprobs"] = {"content": recorder.take(len((generated_text or "").encode("utf-8")))}
+                return result
             else:
                 return {"error": "生成响应为空", "success": False}
             
@@ -282,6 +1092,13 @@ class InferenceEngine:
         messages: List[Dict[str, str]],
         max_tokens: int = 100,
         temperature: float = 0.7,
+        stop: Optional[List[str]] = None,
+        grammar: Optional[str] = None,
+        json_schema: Optional[Union[Dict[str, Any], str]] = None,
+        adapter_path: Optional[str] = None,
+        adapter_scale: float = 1.0,
+        logprobs: bool = False,
+        top_logprobs: int = 0,
         **kwargs
     ):
         """
@@ -292,10 +1109,21 @@ class InferenceEngine:
             messages: 消息列表，格式: [{"role": "user", "content": "..."}]
             max_tokens: 最大生成token数
             temperature: 温度参数
+            stop: 停止词列表（在模型自身的回合结束标记之外追加）
+            grammar: GBNF 语法，采样时约束输出
+            json_schema: JSON Schema，采样时约束输出为符合该结构的JSON
+            adapter_path: 应用在该模型上的LoRA适配器路径（可选）
+            adapter_scale: LoRA适配器强度
+            logprobs: 是否在每一帧中返回该帧输出token的对数概率
+            top_logprobs: 每个位置额外返回的概率最高的候选数（0~20）
             
         Yields:
-            流式生成的文本片段
+            流式生成的文本片段：中间帧只含增量 content（每帧一个新的小dict），
+            最后一帧带 done 和 full_response
         """
+        if not 0 <= top_logprobs <= MAX_TOP_LOGPROBS:
+            yield {"error": f"top_logprobs 必须在0到{MAX_TOP_LOGPROBS}之间", "success": False}
+            return
         if not self.is_model_loaded(model_path):
             if not self.load_model(model_path):
                 yield {"error": "模型加载失败", "success": False}
@@ -304,37 +1132,77 @@ class InferenceEngine:
         try:
             model_info = self.loaded_models[model_path]
             llama_model = model_info["model"]
-
             
-            # 使用llama.cpp的流式chat completion功能
-            stream = llama_model.create_chat_completion(
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                stream=True,
-                **kwargs
-            )
+            compiled_grammar = self.get_grammar(grammar, json_schema)
+            if compiled_grammar is not None:
+                kwargs["grammar"] = compiled_grammar
             
-            full_response = ""
-            for chunk in stream:
-                if chunk and "choices" in chunk and len(chunk["choices"]) > 0:
-                    delta = chunk["choices"][0].get("delta", {})
-                    if "content" in delta:
-                        content = delta["content"]
-                        full_response += content
-                        yield {
-                            "success": True,
-                            "content": content,
-                            "full_response": full_response,
-                            "finish_reason": chunk["choices"][0].get("finish_reason")
-                        }
+            # 整个流式过程持有模型锁，适配器和KV缓存在期间不会被其他请求切换
+            recorder = self._logprob_recorder(model_info, logprobs, top_logprobs)
+            with self._locked(model_info), self._inference_span(llama_model), self._recording(llama_model, recorder):
+                self._activate_adapter(model_info, adapter_path, adapter_scale)
+                
+                # 使用llama.cpp的流式chat completion功能
+                stream = llama_model.create_chat_completion(
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    stream=True,
+                    **kwargs
+                )
+                
+                # 片段先存入列表，结束时只拼接一次；中间帧只携带增量
+                # 停止词由自动机增量匹配：可能构成停止词前缀的尾部先扣住，不会输出半个停止词
+                scanner = get_automaton(tuple(self._resolve_stops(model_info, stop))).scanner()
+                pieces = []
+                emitted_bytes = 0
+                finish_reason = None
+                try:
+                    for chunk in stream:
+                        choices = chunk.get("choices") if chunk else None
+                        if not choices:
+                            continue
+                        choice = choices[0]
+                        finish_reason = choice.get("finish_reason") or finish_reason
+                        content, stopped = scanner.feed(choice.get("delta", {}).get("content") or "")
+                        if stopped:
+                            finish_reason = "stop"
+                        if content:
+                            pieces.append(content)
+                            frame = {
+                                "success": True,
+                                "content": content,
+                                "finish_reason": "stop" if stopped else choice.get("finish_reason")
+                            }
+                            if recorder is not None:
+                                emitted_bytes += len(content.encode("utf-8"))
+                                frame["logprobs"] = recorder.take(emitted_bytes)
+                            yield frame
+                        if stopped:
+                            break
+                finally:
+                    close = getattr(stream, "close", None)
+                    if close is not None:
+                        close()
+                
+                tail = scanner.flush()
+                if tail:
+                    pieces.append(tail)
+                    frame = {"success": True, "content": tail, "finish_reason": finish_reason}
+                    if recorder is not None:
+                        emitted_bytes += len(tail.encode("utf-8"))
+                        frame["logprobs"] = recorder.take(emitted_bytes)
+                    yield frame
+                
+                # 流式接口没有用量统计，以上下文中已有的token数（提示词+生成）计
+                self.record_context_usage(model_path, getattr(llama_model, "n_tokens", 0))
             
             # 最后返回完整响应
             yield {
                 "success": True,
                 "content": "",
-                "full_response": full_response,
-                "finish_reason": "stop",
+                "full_response": "".join(pieces),
+                "finish_reason": finish_reason or "stop",
                 "done": True
             }
             
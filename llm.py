@@ -5,20 +5,31 @@
 """
 
 import sys
+import json
 import argparse
-from model_manager import ModelManager
 
 class SimpleLLM:
-    def __init__(self):
-        self.manager = ModelManager()
+    def __init__(self, local=False):
+        # 优先连接已在运行的本地服务，复用其已加载的模型；否则在进程内加载
+        self.manager = None
+        if not local:
+            from client import connect_local_server
+            self.manager = connect_local_server()
+        self.remote = self.manager is not None
+        if self.manager is None:
+            from model_manager import ModelManager
+            self.manager = ModelManager()
     
-    def pull(self, model_name):
+    def pull(self, model_name, force=False, base_model=None):
         """拉取模型"""
         print(f"🚀 正在拉取模型: {model_name}")
         try:
-            result = self.manager.pull_model(model_name)
+            if base_model:
+                result = self.manager.pull_model(model_name, "lora", force=force, base_model=base_model)
+            else:
+                result = self.manager.pull_model(model_name, force=force)
             if result.get('success'):
-                print(f"✅ 模型 {model_name} 拉取成功!")
+                print(f"✅ {result.get('message') or f'模型 {model_name} 拉取成功'}!")
             else:
                 print(f"❌ 模型拉取失败: {result.get('error', '未知错误')}")
         except Exception as e:
@@ -68,9 +79,191 @@ class SimpleLLM:
         except Exception as e:
             print(f"❌ 删除失败: {str(e)}")
     
+    def gc(self):
+        """整理模型存储"""
+        print("🧹 正在整理模型存储...")
+        try:
+            result = self.manager.collect_garbage()
+            if result.get('error'):
+                print(f"❌ 整理失败: {result['error']}")
+                return
+            if result['ingested']:
+                print(f"  纳入内容存储: {result['ingested']} 个模型")
+            print(f"  回收文件: {result['removed_blobs']} 个, 释放 {result['freed_bytes'] / 1024 / 1024:.1f} MB")
+            for model_name in result['evicted']:
+                print(f"  超出磁盘配额，已淘汰: {model_name}")
+            print(f"✅ 当前占用: {result['disk_usage_bytes'] / 1024 / 1024 / 1024:.2f} GB")
+        except Exception as e:
+            print(f"❌ 整理失败: {str(e)}")
+    
+    def tune(self, model_name, threads=None, batches=None, prompt_tokens=512, decode_tokens=64, repeats=2):
+        """在本机上调优模型的线程数和批大小"""
+        print(f"⏱️  正在调优模型: {model_name}（期间请避免其他负载）")
+        
+        def progress(m):
+            params = m["params"]
+            label = f"threads={params['n_threads']}/{params['n_threads_batch']}"
+            if "n_batch" in params:
+                label += f" batch={params['n_batch']}/{params['n_ubatch']}"
+            if "error" in m:
+                print(f"  {label:<36} 失败: {m['error']}")
+            else:
+                print(f"  {label:<36} 提示词 {m['prompt_tps']:>9.1f} tok/s  解码 {m['decode_tps']:>7.1f} tok/s")
+        
+        try:
+            result = self.manager.tune_model(
+                model_name,
+                threads=threads,
+                batches=batches,
+                prompt_tokens=prompt_tokens,
+                decode_tokens=decode_tokens,
+                repeats=repeats,
+                progress=progress
+            )
+            if result.get('error'):
+                print(f"❌ 调优失败: {result['error']}")
+                return
+            profile = result['profile']
+            if self.remote:
+                for m in profile['measurements']:
+                    progress(m)
+            cpu = profile['cpu']
+            print(f"  CPU: {cpu['model']}，{cpu['physical_cores']} 物理核 / {cpu['logical_cores']} 逻辑核")
+            if cpu['flags']:
+                print(f"  指令集: {' '.join(cpu['flags'])}")
+            baseline = profile['baseline']
+            print(f"✅ 最优参数: {profile['params']}")
+            print(f"   提示词评估: {baseline['prompt_tps']:.1f} -> {profile['prompt_tps']:.1f} tok/s")
+            print(f"   解码:       {baseline['decode_tps']:.1f} -> {profile['decode_tps']:.1f} tok/s")
+            print(f"   已保存为 {result['key']}，加载模型时自动使用" + ("（已加载的模型重新加载后生效）" if result.get('loaded') else ""))
+        except Exception as e:
+            print(f"❌ 调优失败: {str(e)}")
+    
+    def quantize(self, model_name, quant, target_name=None, allow_requantize=False, force=False, bench=True):
+        """在本地把模型量化为更小的版本"""
+        import time
+        
+        try:
+            result = self.manager.quantize_model(
+                model_name,
+                quant,
+                target_name=target_name,
+                allow_requantize=allow_requantize,
+                force=force,
+                bench=bench
+            )
+            if result.get('error'):
+                print(f"❌ 量化失败: {result['error']}")
+                return
+            job = result['job']
+            print(f"🗜️  正在量化模型: {model_name} -> {job['target_name']} ({job['quant']})，任务 {job['id']}")
+            
+            stages = {"quantizing": "量化", "registering": "登记", "benchmarking": "测速"}
+            while job['status'] in ('queued', 'running'):
+                time.sleep(1)
+                job = self.manager.get_quantize_job(job['id'])
+                if job is None:
+                    print("\n❌ 量化任务不存在（服务可能已重启）")
+                    return
+                if job['status'] not in ('queued', 'running'):
+                    break
+                if job['status'] == 'queued':
+                    label = "等待其他量化任务完成"
+                else:
+                    label = f"{stages.get(job['stage'], job['stage'] or '')} {job['progress'] * 100:5.1f}%  已写出 {job['written_bytes'] / 1024 ** 3:.2f} GB"
+                print(f"\r  {label}  {job['elapsed_s']:.0f}s", end="", flush=True)
+            print()
+        except KeyboardInterrupt:
+            if self.remote:
+                print("\n⏹️  已停止等待，量化任务仍在服务端运行")
+            else:
+                print("\n❌ 已中断")
+            return
+        except Exception as e:
+            print(f"\n❌ 量化失败: {str(e)}")
+            return
+        
+        if job['status'] != 'completed':
+            print(f"❌ 量化失败: {job.get('error') or '未知错误'}")
+            return
+        
+        report = job['result']
+        size = report['size']
+        print(f"✅ 已登记为 {job['target_name']}: {report['model_info']['path']}")
+        print(f"   大小: {size['source_bytes'] / 1024 ** 3:.2f} GB -> {size['quantized_bytes'] / 1024 ** 3:.2f} GB"
+              f" ({size['ratio'] * 100:.1f}%，节省 {size['saved_bytes'] / 1024 ** 3:.2f} GB)")
+        speed = report.get('speed')
+        if speed:
+            before, after = speed['source'], speed['quantized']
+            if 'error' in before or 'error' in after:
+                print(f"   ⚠️  测速失败: {before.get('error') or after.get('error')}")
+            else:
+                print(f"   提示词评估: {before['prompt_tps']:.1f} -> {after['prompt_tps']:.1f} tok/s (x{speed['prompt_speedup']})")
+                print(f"   解码:       {before['decode_tps']:.1f} -> {after['decode_tps']:.1f} tok/s (x{speed['decode_speedup']})")
+        print("💡 使用 'llm eval' 对比两个版本在数据集上的困惑度/准确率")
+    
+    def eval(self, model_name, dataset, batch_size=64, output=None, compare=None):
+        """在数据集上计算困惑度和选择题准确率"""
+        from utils import evaluation
+        
+        try:
+            examples = evaluation.load_dataset(dataset)
+        except (OSError, ValueError) as e:
+            print(f"❌ 读取数据集失败: {str(e)}")
+            return
+        if not examples:
+            print("❌ 数据集为空")
+            return
+        
+        print(f"📏 正在评测模型: {model_name}，数据集 {dataset}（{len(examples)} 条）")
+        
+        def progress(done, total):
+            print(f"\r  {done}/{total}", end="", flush=True)
+        
+        try:
+            result = evaluation.evaluate(self.manager, model_name, examples, batch_size, progress=progress)
+        except Exception as e:
+            print(f"\n❌ 评测失败: {str(e)}")
+            return
+        print()
+        if result.get('error'):
+            print(f"❌ 评测失败: {result['error']}")
+            return
+        
+        summary = result['summary']
+        if 'perplexity' in summary:
+            print(f"  困惑度: {summary['perplexity']:.4f}  (每token负对数似然 {summary['nll_per_token']:.4f}，共 {summary['n_tokens']} token)")
+            print(f"  贪心一致率: {summary['greedy_rate'] * 100:.2f}%")
+        if 'accuracy' in summary:
+            print(f"  准确率: {summary['accuracy'] * 100:.2f}%  (按长度归一化 {summary['accuracy_norm'] * 100:.2f}%，共 {summary['questions']} 题)")
+        if summary['errors']:
+            errors = [row['error'] for row in result['rows'] if 'error' in row]
+            print(f"  ⚠️  {summary['errors']} 条失败，例如: {errors[0]}")
+        print(f"  评估 {summary['evaluated_tokens']} token，耗时 {summary['elapsed_s']}s（{summary['tokens_per_second']} token/s）")
+        
+        if output:
+            with open(output, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            print(f"💾 结果已保存: {output}")
+        
+        if compare:
+            try:
+                with open(compare, "r", encoding="utf-8") as f:
+                    baseline = json.load(f)["summary"]
+            except (OSError, ValueError, KeyError) as e:
+                print(f"❌ 读取对比结果失败: {str(e)}")
+                return
+            print(f"📊 对比 {compare}（{baseline.get('model_name')}）:")
+            for key in ("perplexity", "nll_per_token", "greedy_rate", "accuracy", "accuracy_norm", "tokens_per_second"):
+                if key in baseline and key in summary and baseline[key]:
+                    old, new = baseline[key], summary[key]
+                    print(f"  {key:<18} {old:>12.4f} -> {new:<12.4f} ({(new - old) / old * 100:+.2f}%)")
+    
     def generate(self, model_name, prompt, max_tokens=100, temperature=0.7):
         """单次文本生成"""
         print(f"🚀 单次生成模式")
+        if self.remote:
+            print("🔗 使用本地服务")
         print(f"🤖 模型: {model_name}")
         print(f"📝 提示: {prompt}")
         print("=" * 50)
@@ -78,7 +271,7 @@ class SimpleLLM:
         try:
             # 加载模型
             result = self.manager.load_model(model_name)
-            if not result.get('success'):
+            if result.get('error'):
                 print(f"❌ 模型加载失败: {result.get('error')}")
                 return
             
@@ -90,11 +283,11 @@ class SimpleLLM:
                 temperature=temperature
             )
             
-            if response.get('success'):
-                print("🤖 生成结果:")
-                print(response['response'])
-            else:
+            if response.get('error'):
                 print(f"❌ 生成失败: {response.get('error')}")
+            else:
+                print("🤖 生成结果:")
+                print(response['generated_text'])
                 
         except Exception as e:
             print(f"❌ 生成失败: {str(e)}")
@@ -111,11 +304,13 @@ class SimpleLLM:
             model_name = list(models.keys())[0]
         
         print(f"🚀 启动模型: {model_name}")
+        if self.remote:
+            print("🔗 使用本地服务")
         
         try:
             # 加载模型
             result = self.manager.load_model(model_name)
-            if not result.get('success'):
+            if result.get('error'):
                 print(f"❌ 模型加载失败: {result.get('error')}")
                 return
             
@@ -190,6 +385,124 @@ class SimpleLLM:
         except Exception as e:
             print(f"❌ 运行失败: {str(e)}")
 
+def bench(args):
+    """压测本地服务（或进程内的模拟后端服务）"""
+    from utils import bench as bench_utils
+    
+    if args.micro:
+        micro_bench(bench_utils, args.micro)
+        return
+    
+    try:
+        if args.workload:
+            workload = bench_utils.load_workload(args.workload)
+            if args.requests:
+                workload = workload[:args.requests]
+        else:
+            workload = bench_utils.synthetic_workload(
+                args.requests or 100,
+                prompt_tokens=bench_utils.parse_range(args.prompt_tokens),
+                max_tokens=bench_utils.parse_range(args.max_tokens),
+                chat_ratio=args.chat_ratio,
+                stream_ratio=args.stream_ratio,
+                seed=args.seed
+            )
+    except (OSError, ValueError) as e:
+        print(f"❌ 读取请求负载失败: {str(e)}")
+        return
+    if not workload:
+        print("❌ 请求负载为空")
+        return
+    
+    offsets = bench_utils.schedule(workload, args.rate, args.seed)
+    settings = {
+        "workload": args.workload or "synthetic",
+        "requests": len(workload),
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "fake": args.fake,
+        "model": args.model
+    }
+    if not args.workload:
+        settings.update({
+            "prompt_tokens": args.prompt_tokens,
+            "max_tokens": args.max_tokens,
+            "chat_ratio": args.chat_ratio,
+            "stream_ratio": args.stream_ratio,
+            "seed": args.seed
+        })
+    
+    print(f"🚀 压测: {len(workload)} 个请求, 并发 {args.concurrency}" + (f", 到达率 {args.rate}/s" if args.rate else ""))
+    try:
+        if args.fake:
+            print("🧪 使用进程内服务和模拟推理后端")
+            with bench_utils.inprocess_server(args.fake_prompt_ms, args.fake_decode_ms) as (host, port):
+                results, elapsed = bench_utils.run_bench(
+                    workload, offsets, args.model or bench_utils.FAKE_MODEL_NAME,
+                    args.concurrency, host=host, port=port, socket_path=""
+                )
+        else:
+            if not args.model:
+                print("❌ 请使用 --model 指定模型")
+                return
+            results, elapsed = bench_utils.run_bench(workload, offsets, args.model, args.concurrency)
+    except Exception as e:
+        print(f"❌ 压测失败: {str(e)}")
+        return
+    
+    summary = bench_utils.summarize(results, elapsed)
+    print("=" * 50)
+    print(f"请求数: {summary['requests']}  错误: {summary['errors']} ({summary['error_rate'] * 100:.2f}%)  耗时: {summary['duration_s']}s")
+    print(f"吞吐: {summary['throughput_rps']} req/s, {summary['tokens_per_s']} token/s")
+    for key, label in (("ttft_ms", "首token延迟"), ("itl_ms", "token间隔"), ("latency_ms", "总延迟"), ("lag_ms", "发送滞后")):
+        stats = summary[key]
+        if stats:
+            print(f"{label} (ms): p50={stats['p50']} p90={stats['p90']} p99={stats['p99']} max={stats['max']}")
+    for error, count in summary["error_types"].items():
+        print(f"  ❌ {count} × {error}")
+    
+    if args.output:
+        bench_utils.save_results(args.output, settings, summary, results)
+        print(f"💾 结果已保存: {args.output}")
+    
+    if args.compare:
+        try:
+            with open(args.compare, "r", encoding="utf-8") as f:
+                baseline = json.load(f)["summary"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"❌ 读取对比结果失败: {str(e)}")
+            return
+        print(f"📊 对比 {args.compare}:")
+        for name, old, new, change in bench_utils.compare_summaries(baseline, summary):
+            print(f"  {name:<16} {old:>12} -> {new:<12} ({change:+.2f}%)")
+
+def micro_bench(bench_utils, kind: str):
+    """微基准：与改动前的实现对比单项开销"""
+    if kind == "stream":
+        print("🔬 流式聊天每个token的服务内开销（已扣除模拟后端自身的耗时）")
+        for row in bench_utils.stream_microbench():
+            print(f"  {row['case']:<16} {row['us_per_token']:>8} us/token")
+        return
+    from utils.serialization import orjson
+    print(f"🔬 编码开销（{'orjson' if orjson is not None else '标准库 json'}，对比旧的标准库 json 编码）")
+    print(f"  {'场景':<22} {'旧字节数':>10} {'字节数':>10} {'旧耗时(us)':>12} {'耗时(us)':>10}")
+    for row in bench_utils.serialization_microbench():
+        print(f"  {row['case']:<24} {row['legacy_bytes']:>10} {row['bytes']:>10} {row['legacy_us']:>12} {row['us']:>10}")
+
+def serve_store(args):
+    """以只读方式提供本地模型存储，供其他节点作为模型来源拉取"""
+    from utils.sources import serve_store as create_store_server
+    server = create_store_server(args.dir, args.host, args.port)
+    print(f"📦 正在提供模型存储 {args.dir}: http://{args.host}:{server.server_address[1]}")
+    print(f"   其他节点设置 MODEL_SOURCES=http://<本机地址>:{server.server_address[1]},hf 即可从这里拉取")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n已停止")
+    finally:
+        server.server_close()
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="简化的 LLM 命令行工具",
@@ -199,17 +512,30 @@ def main():
   llm pull microsoft/Phi-3-mini-4k-instruct-gguf    # 拉取模型
   llm list                                           # 列出模型
   llm delete <model_name>                            # 删除模型
+  llm gc                                             # 整理模型存储
+  llm tune <model>                                   # 在本机上调优线程数和批大小
+  llm quantize <model> --to Q4_K_M                  # 在本地量化出更小的版本（登记为 <model>:q4_k_m）
+  llm eval <model> dataset.jsonl                     # 计算数据集上的困惑度/选择题准确率
+  llm serve-store --port 8001                        # 向局域网内其他节点提供本机的模型文件
   llm run                                           # 运行第一个可用模型
   llm run Qwen/Qwen2-1.5B-Instruct-GGUF            # 运行指定模型
   llm generate <model> "你好"                        # 单次生成文本
+  llm bench --fake --requests 200 --concurrency 8    # 压测（进程内模拟后端）
+  llm bench --model <model> --workload traffic.jsonl # 回放请求记录压测本地服务
+
+本地服务 (python main.py) 在运行时，命令会转发给服务执行，复用其已加载的模型；
+使用 --local 强制在当前进程中加载模型。
         """
     )
+    parser.add_argument('--local', action='store_true', help='不连接本地服务，在当前进程中加载模型')
     
     subparsers = parser.add_subparsers(dest='command', help='可用命令')
     
     # pull 命令
     pull_parser = subparsers.add_parser('pull', help='拉取模型')
     pull_parser.add_argument('model', help='模型名称 (例: microsoft/Phi-3-mini-4k-instruct-gguf)')
+    pull_parser.add_argument('--force', action='store_true', help='模型已存在时重新拉取新版本并无缝切换')
+    pull_parser.add_argument('--base', help='作为LoRA适配器拉取，并指定其基础模型')
     
     # list 命令
     subparsers.add_parser('list', help='列出已下载的模型')
@@ -218,6 +544,41 @@ def main():
     delete_parser = subparsers.add_parser('delete', help='删除模型')
     delete_parser.add_argument('model', help='要删除的模型名称')
     
+    # gc 命令
+    subparsers.add_parser('gc', help='整理模型存储（合并重复文件、回收空间、执行磁盘配额）')
+    
+    # tune 命令
+    tune_parser = subparsers.add_parser('tune', help='在本机上测量并选择模型的线程数和批大小')
+    tune_parser.add_argument('model', help='模型名称')
+    tune_parser.add_argument('--threads', help='候选线程数，逗号分隔 (默认按CPU核心数生成)')
+    tune_parser.add_argument('--batch', help='候选批大小 n_batch:n_ubatch，逗号分隔 (例: 512:512,1024:256)')
+    tune_parser.add_argument('--prompt-tokens', type=int, default=512, help='测量用的提示词长度 (默认: 512)')
+    tune_parser.add_argument('--decode-tokens', type=int, default=64, help='测量用的生成token数 (默认: 64)')
+    tune_parser.add_argument('--repeats', type=int, default=2, help='每组参数的测量次数 (默认: 2)')
+    
+    # quantize 命令
+    quantize_parser = subparsers.add_parser('quantize', help='在本地把模型（如 F16 GGUF）量化为更小的版本')
+    quantize_parser.add_argument('model', help='源模型名称')
+    quantize_parser.add_argument('--to', default='Q4_K_M', help='目标量化方式 (默认: Q4_K_M)')
+    quantize_parser.add_argument('--name', help='量化版本的模型名称 (默认: <model>:<量化方式>)')
+    quantize_parser.add_argument('--allow-requantize', action='store_true', help='允许从已量化的模型再量化（会叠加误差）')
+    quantize_parser.add_argument('--force', action='store_true', help='目标名称已存在时生成新版本并切换')
+    quantize_parser.add_argument('--no-bench', action='store_true', help='完成后不对比源模型与量化版本的速度')
+    
+    # eval 命令
+    eval_parser = subparsers.add_parser('eval', help='计算模型在数据集上的困惑度和选择题准确率（用于比较量化版本）')
+    eval_parser.add_argument('model', help='模型名称')
+    eval_parser.add_argument('dataset', help='JSONL数据集，每行 {"text"}、{"prompt","continuation"} 或 {"prompt","choices","answer"}')
+    eval_parser.add_argument('--batch-size', type=int, default=64, help='每次评分请求的数据条数 (默认: 64)')
+    eval_parser.add_argument('--output', help='保存汇总和逐条结果的JSON文件')
+    eval_parser.add_argument('--compare', help='与之前保存的结果对比（如另一个量化版本）')
+    
+    # serve-store 命令
+    store_parser = subparsers.add_parser('serve-store', help='只读地提供本机模型存储（不加载推理后端），供其他节点拉取')
+    store_parser.add_argument('--dir', default='models', help='模型目录 (默认: models)')
+    store_parser.add_argument('--host', default='0.0.0.0', help='监听地址 (默认: 0.0.0.0)')
+    store_parser.add_argument('--port', type=int, default=8001, help='监听端口 (默认: 8001)')
+    
     # run 命令
     run_parser = subparsers.add_parser('run', help='运行交互式聊天')
     run_parser.add_argument('model', nargs='?', help='模型名称 (可选，默认使用第一个可用模型)')
@@ -229,20 +590,59 @@ def main():
     generate_parser.add_argument('--max-tokens', type=int, default=32768, help='最大生成token数 (默认: 32768)')
     generate_parser.add_argument('--temperature', type=float, default=0.7, help='温度参数 (默认: 0.7)')
     
+    # bench 命令
+    bench_parser = subparsers.add_parser('bench', help='压测服务（回放请求记录或合成负载）')
+    bench_parser.add_argument('--model', help='模型名称（--fake 时默认使用模拟模型）')
+    bench_parser.add_argument('--workload', help='JSONL请求记录文件，不指定时按分布合成请求')
+    bench_parser.add_argument('--requests', type=int, help='请求数量（合成负载默认100）')
+    bench_parser.add_argument('--concurrency', type=int, default=4, help='并发连接数 (默认: 4)')
+    bench_parser.add_argument('--rate', type=float, help='平均到达率（请求/秒，泊松分布），不指定时尽快发送')
+    bench_parser.add_argument('--prompt-tokens', default='16:256', help='合成提示词长度范围 (默认: 16:256)')
+    bench_parser.add_argument('--max-tokens', default='16:128', help='合成生成长度范围 (默认: 16:128)')
+    bench_parser.add_argument('--chat-ratio', type=float, default=0.5, help='聊天请求比例 (默认: 0.5)')
+    bench_parser.add_argument('--stream-ratio', type=float, default=1.0, help='聊天请求中流式的比例 (默认: 1.0)')
+    bench_parser.add_argument('--seed', type=int, default=0, help='随机种子 (默认: 0)')
+    bench_parser.add_argument('--fake', action='store_true', help='在进程内启动服务并使用模拟推理后端')
+    bench_parser.add_argument('--fake-prompt-ms', type=float, default=0.05, help='模拟后端每个提示词token的耗时 (默认: 0.05)')
+    bench_parser.add_argument('--fake-decode-ms', type=float, default=2.0, help='模拟后端每个生成token的耗时 (默认: 2.0)')
+    bench_parser.add_argument('--micro', choices=['serialization', 'stream'], help='运行微基准（不发送请求）：serialization 为响应编码开销，stream 为流式每个token的开销')
+    bench_parser.add_argument('--output', help='保存结果的JSON文件')
+    bench_parser.add_argument('--compare', help='与之前保存的结果对比')
+    
     args = parser.parse_args()
     
     if not args.command:
         parser.print_help()
         return
     
-    llm = SimpleLLM()
+    if args.command == 'bench':
+        bench(args)
+        return
+    if args.command == 'serve-store':
+        serve_store(args)
+        return
+    
+    llm = SimpleLLM(local=args.local)
     
     if args.command == 'pull':
-        llm.pull(args.model)
+        llm.pull(args.model, args.force, args.base)
     elif args.command == 'list':
         llm.list_models()
     elif args.command == 'delete':
         llm.delete(args.model)
+    elif args.command == 'gc':
+        llm.gc()
+    elif args.command == 'tune':
+        threads = [int(t) for t in args.threads.split(',')] if args.threads else None
+        batches = None
+        if args.batch:
+            # n_batch:n_ubatch，只写 n_batch 时两者相同
+            batches = [(int(b.split(':')[0]), int(b.split(':')[-1])) for b in args.batch.split(',')]
+        llm.tune(args.model, threads, batches, args.prompt_tokens, args.decode_tokens, args.repeats)
+    elif args.command == 'quantize':
+        llm.quantize(args.model, args.to, args.name, args.allow_requantize, args.force, not args.no_bench)
+    elif args.command == 'eval':
+        llm.eval(args.model, args.dataset, args.batch_size, args.output, args.compare)
     elif args.command == 'run':
         llm.run(args.model)
     elif args.command == 'generate':
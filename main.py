@@ -5,7 +5,6 @@ Python LLM - 类似Ollama的本地大语言模型服务
 import uvicorn
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
 import logging
 import sys
 import os
@@ -15,7 +14,15 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from api.models import router as models_router
 from api.generate import router as generate_router
-from model_manager import ModelManager
+from api.debug import router as debug_router
+from api.blobs import router as blobs_router
+from api.score import router as score_router
+from api.middleware import TracingMiddleware, AdmissionMiddleware
+from api.responses import FastJSONResponse
+from model_manager import get_model_manager
+from utils.pressure import memory_controller
+from utils.preload import preloader
+import config
 
 # 配置日志
 logging.basicConfig(
@@ -30,7 +37,8 @@ app = FastAPI(
     description="类似Ollama的本地大语言模型服务",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=FastJSONResponse
 )
 
 # 添加CORS中间件
@@ -42,9 +50,45 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 内存压力准入控制（先添加的中间件在内层，被拒绝的请求也会留下追踪）
+app.add_middleware(AdmissionMiddleware)
+
+# 请求追踪中间件（追踪ID经上下文传递到模型管理器和推理引擎）
+app.add_middleware(TracingMiddleware)
+
 # 注册路由
 app.include_router(models_router)
 app.include_router(generate_router)
+app.include_router(blobs_router)
+app.include_router(score_router)
+
+# 调试接口可以开启全进程采样和 cProfile，没有鉴权，只在显式开启时挂载
+if config.DEBUG_ENDPOINTS:
+    app.include_router(debug_router)
+
+
+@app.on_event("startup")
+async def start_memory_pressure_control():
+    """启动内存压力控制（每个工作进程各自采样和降载）"""
+    if config.MEMORY_PRESSURE_CONTROL:
+        memory_controller.start(get_model_manager().relieve_memory_pressure)
+
+
+@app.on_event("startup")
+async def start_predictive_prefetch():
+    """按请求统计预测即将被使用的模型并提前预取"""
+    if config.PREDICTIVE_PREFETCH:
+        preloader.start(get_model_manager())
+
+
+@app.on_event("shutdown")
+async def stop_memory_pressure_control():
+    memory_controller.stop()
+
+
+@app.on_event("shutdown")
+async def stop_predictive_prefetch():
+    preloader.stop()
 
 
 @app.get("/")
@@ -56,7 +100,9 @@ async def root():
         "docs": "/docs",
         "endpoints": {
             "models": "/models",
-            "generate": "/generate"
+            "generate": "/generate",
+            "score": "/score",
+            **({"traces": "/debug/traces"} if config.DEBUG_ENDPOINTS else {})
         }
     }
 
@@ -66,13 +112,14 @@ async def health_check():
     """健康检查"""
     try:
         # 检查模型管理器是否正常工作
-        model_manager = ModelManager()
+        model_manager = get_model_manager()
         models = model_manager.list_models()
         
         return {
             "status": "healthy",
             "models_count": models["total"],
-            "loaded_models_count": len(model_manager.get_loaded_models())
+            "loaded_models_count": len(model_manager.get_loaded_models()),
+            "memory_pressure": memory_controller.level
         }
     except Exception as e:
         logger.error(f"健康检查失败: {str(e)}")
@@ -83,7 +130,7 @@ async def health_check():
 async def global_exception_handler(request, exc):
     """全局异常处理器"""
     logger.error(f"未处理的异常: {str(exc)}")
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=500,
         content={"error": "内部服务器错误", "detail": str(exc)}
     )
@@ -93,14 +140,25 @@ def main():
     """主函数"""
     logger.info("启动 Python LLM 服务...")
     
-    # 启动服务器
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
-        log_level="info"
-    )
+    # 多工作进程时各进程分别加载模型，权重通过mmap共享页缓存；reload 不支持多进程
+    server_kwargs = {"reload": config.WORKERS <= 1, "workers": config.WORKERS}
+    
+    # 启动服务器（设置 LLM_SOCKET 时改为监听 Unix socket）
+    if config.SOCKET_PATH:
+        uvicorn.run(
+            "main:app",
+            uds=config.SOCKET_PATH,
+            log_level="info",
+            **server_kwargs
+        )
+    else:
+        uvicorn.run(
+            "main:app",
+            host=config.HOST,
+            port=config.PORT,
+            log_level="info",
+            **server_kwargs
+        )
 
 
 if __name__ == "__main__":
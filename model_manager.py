@@ -1,9 +1,19 @@
 """
 模型管理器模块
 """
-from typing import Dict, Any, Optional, List
+import gc
+import os
+import time
+import uuid
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple
 from utils.download import ModelDownloader
-from inference import InferenceEngine
+from utils.tracing import record_error, current_trace
+from utils.singleflight import SingleFlight, flight_key
+from utils.profiling import endpoint_profiler
+import config
 import logging
 
 logger = logging.getLogger(__name__)
@@ -14,22 +24,225 @@ class ModelManager:
     
     def __init__(self, models_dir: str = "models"):
         self.downloader = ModelDownloader(models_dir)
-        self.inference_engine = InferenceEngine()
+        self._inference_engine = None
+        self._tokenizers = None
+        # 保护“名称 -> 版本”的解析与切换，切换后新请求只会解析到新版本
+        self._swap_lock = threading.RLock()
+        # 同一时间只进行一次调优（调优会占满CPU，并发测量没有意义）
+        self._tune_lock = threading.RLock()
+        # 合并相同的进行中确定性请求
+        self.flights = SingleFlight()
+        # 后台量化任务（按创建顺序，只保留最近的若干个）；同一时间只运行一个
+        self._quantize_jobs: "OrderedDict[str, Any]" = OrderedDict()
+        self._quantize_jobs_lock = threading.Lock()
+        self._quantize_lock = threading.Lock()
     
-    def pull_model(self, model_name: str, model_type: str = "auto") -> Dict[str, Any]:
+    @property
+    def inference_engine(self):
+        """推理引擎（首次使用时才创建，list/pull/delete 等命令不加载推理后端）"""
+        if self._inference_engine is None:
+            from inference import InferenceEngine
+            self._inference_engine = InferenceEngine()
+        return self._inference_engine
+    
+    @property
+    def tokenizers(self):
+        """只加载词表的分词器（与推理引擎相互独立，用于token计数）"""
+        if self._tokenizers is None:
+            from tokenizer import TokenizerPool
+            self._tokenizers = TokenizerPool()
+        return self._tokenizers
+    
+    def _is_model_loaded(self, model_path: str) -> bool:
+        """检查模型是否已加载（推理引擎未创建时直接返回False）"""
+        if self._inference_engine is None:
+            return False
+        return self._inference_engine.is_model_loaded(model_path)
+    
+    def _acquire_model(
+        self,
+        model_name: str,
+        adapter: Optional[str] = None
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        解析模型名称的当前版本并登记一个请求，必要时加载模型
+        
+        模型名称是LoRA适配器时，解析为其基础模型加该适配器。
+        
+        Args:
+            model_name: 模型名称（基础模型或LoRA适配器）
+            adapter: 额外指定的LoRA适配器名称
+            
+        Returns:
+            (基础模型信息, 适配器信息, 错误结果)，成功时错误结果为None，用完后需调用 _release_model
+        """
+        with self._swap_lock:
+            model_info = self.downloader.get_model_info(model_name)
+            if not model_info:
+                return None, None, {"error": "模型不存在"}
+            
+            adapter_info = None
+            if model_info.get("type") == "lora":
+                adapter_info = model_info
+                model_info = self.downloader.get_model_info(adapter_info["base_model"])
+                if not model_info:
+                    return None, None, {"error": f"基础模型 {adapter_info['base_model']} 不存在"}
+            elif adapter:
+                adapter_info = self.downloader.get_model_info(adapter)
+                if not adapter_info or adapter_info.get("type") != "lora":
+                    return None, None, {"error": f"LoRA适配器 {adapter} 不存在"}
+            
+            for info in (model_info, adapter_info):
+                if info is None:
+                    continue
+                status = self.downloader.check_file_status(info["path"])
+                if status != "ready":
+                    return None, None, {"error": f"模型状态异常: {status}"}
+                self.downloader.touch(info["name"])
+            
+            self.inference_engine.acquire_model(model_info["path"])
+            if adapter_info:
+                self.inference_engine.acquire_model(adapter_info["path"])
+        
+        # 确保模型已加载（使用本机的调优结果）
+        if not (
+            self.inference_engine.is_model_loaded(model_info["path"])
+            or self.inference_engine.load_model(model_info["path"], **self._load_params(model_info))
+        ):
+            self._release_model(model_info, adapter_info)
+            return None, None, {"error": "模型加载失败"}
+        return model_info, adapter_info, None
+    
+    def _release_model(self, model_info: Dict[str, Any], adapter_info: Optional[Dict[str, Any]] = None):
+        """请求结束，释放对该版本（及适配器）的引用"""
+        self.inference_engine.release_model(model_info["path"])
+        if adapter_info:
+            self.inference_engine.release_model(adapter_info["path"])
+    
+    @staticmethod
+    def _adapter_kwargs(adapter_info: Optional[Dict[str, Any]], adapter_scale: float) -> Dict[str, Any]:
+        """生成传给推理引擎的适配器参数"""
+        if not adapter_info:
+            return {}
+        return {"adapter_path": adapter_info["path"], "adapter_scale": adapter_scale}
+    
+    def _load_params(self, model_info: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        本机调优得到的加载参数，没有调优结果时为空（使用默认参数）
+        
+        开启 AUTOTUNE 时，没有调优结果的模型先调优再加载。
+        """
+        from tuner import tuning_key
+        key = tuning_key(model_info)
+        profile = model_info.get("tuning", {}).get(key)
+        if profile is None and config.AUTOTUNE:
+            with self._tune_lock:
+                profile = model_info.get("tuning", {}).get(key)
+                if profile is None:
+                    logger.info(f"模型 {model_info['name']} 在本机没有调优结果，开始调优")
+                    profile = self.tune_model(model_info["name"]).get("profile")
+        return dict(profile["params"]) if profile else {}
+    
+    def _retire_version(self, model_info: Dict[str, Any]):
+        """等待旧版本上进行中的请求结束，再卸载并删除其文件"""
+        if self._inference_engine is not None:
+            self._inference_engine.unload_model(
+                model_info["path"], wait=True, timeout=config.MODEL_DRAIN_TIMEOUT
+            )
+            if model_info.get("type") == "lora":
+                self._inference_engine.drop_adapter(model_info["path"])
+        if self._tokenizers is not None:
+            self._tokenizers.drop(model_info["path"])
+        self.downloader.remove_model_files(model_info)
+        logger.info(f"旧版本模型已清理: {model_info['path']}")
+    
+    def _pull_new_version(
+        self,
+        model_name: str,
+        model_type: str,
+        current_info: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """下载新版本，预热后切换名称，旧版本排空后卸载"""
+        model_info = self.downloader.download_model(
+            model_name, model_type, new_version=True, base_model=current_info.get("base_model")
+        )
+        
+        status = self.downloader.check_file_status(model_info["path"])
+        if status != "ready":
+            self.downloader.remove_model_files(model_info)
+            return {"error": f"模型状态异常: {status}", "success": False}
+        
+        # 调优结果按量化方式保存，新版本量化方式相同时沿用
+        if current_info.get("tuning"):
+            model_info.setdefault("tuning", dict(current_info["tuning"]))
+        
+        # 旧版本已在内存中时，先加载并预热新版本，切换后不会出现冷启动
+        if self._is_model_loaded(current_info["path"]):
+            if not self.inference_engine.load_model(model_info["path"], **self._load_params(model_info)):
+                self.downloader.remove_model_files(model_info)
+                return {"error": "新版本模型加载失败", "success": False}
+            self.inference_engine.warm_up(model_info["path"])
+        
+        with self._swap_lock:
+            old_info = self.downloader.promote_version(model_name, model_info)
+        
+        if old_info:
+            threading.Thread(
+                target=self._retire_version,
+                args=(old_info,),
+                name=f"retire-{model_name}",
+                daemon=True
+            ).start()
+        self._enforce_disk_quota(keep=model_name)
+        
+        return {
+            "success": True,
+            "model_info": model_info,
+            "message": f"模型 {model_name} 已更新到 v{model_info['version']}"
+        }
+    
+    def pull_model(
+        self,
+        model_name: str,
+        model_type: str = "auto",
+        force: bool = False,
+        base_model: Optional[str] = None
+    ) -> Dict[str, Any]:
         """
         拉取模型
         
         Args:
             model_name: 模型名称
-            model_type: 模型类型
+            model_type: 模型类型（lora 表示LoRA适配器）
+            force: 模型已存在时重新拉取新版本，预热后无缝切换
+            base_model: LoRA适配器对应的基础模型名称（model_type 为 lora 时必填）
             
         Returns:
             模型信息
         """
+        if model_type == "lora":
+            if not base_model:
+                return {"error": "拉取LoRA适配器需要指定基础模型", "success": False}
+            if not self.downloader.get_model_info(base_model):
+                return {"error": f"基础模型 {base_model} 不存在，请先拉取", "success": False}
+        
         try:
+            current_info = self.downloader.get_model_info(model_name)
+            if force and current_info and self.downloader.check_model_status(model_name) == "ready":
+                # 新版本沿用已登记的类型和基础模型，不能借重新拉取改变
+                is_lora = current_info.get("type") == "lora"
+                if model_type == "lora" and not is_lora:
+                    return {"error": f"模型 {model_name} 不是LoRA适配器", "success": False}
+                if base_model and base_model != current_info.get("base_model"):
+                    return {
+                        "error": f"LoRA适配器 {model_name} 的基础模型是 {current_info.get('base_model')}，"
+                                 f"与指定的 {base_model} 不一致",
+                        "success": False
+                    }
+                return self._pull_new_version(model_name, "lora" if is_lora else model_type, current_info)
+            
             # 下载模型
-            model_info = self.downloader.download_model(model_name, model_type)
+            model_info = self.downloader.download_model(model_name, model_type, base_model=base_model)
             
             # 检查模型状态
             status = self.downloader.check_model_status(model_name)
@@ -39,6 +252,7 @@ class ModelManager:
                     "model_info": model_info
                 }
             
+            self._enforce_disk_quota(keep=model_name)
             return {
                 "success": True,
                 "model_info": model_info,
@@ -52,6 +266,306 @@ class ModelManager:
                 "success": False
             }
     
+    def _enforce_disk_quota(self, keep: Optional[str] = None) -> List[str]:
+        """
+        模型文件超出磁盘配额时，按最近使用时间淘汰模型
+        
+        已加载的模型、仍有LoRA适配器依赖的基础模型以及 keep 指定的模型不会被淘汰。
+        
+        Returns:
+            被淘汰的模型名称
+        """
+        quota = int(config.MODELS_DISK_QUOTA_GB * 1024 ** 3)
+        evicted = []
+        if quota <= 0:
+            return evicted
+        
+        for model_name in self.downloader.lru_models():
+            if self.downloader.disk_usage() <= quota:
+                break
+            model_info = self.downloader.get_model_info(model_name)
+            if model_name == keep or model_info is None or self._is_model_loaded(model_info["path"]):
+                continue
+            if any(info.get("base_model") == model_name for info in self.downloader.list_models().values()):
+                continue
+            logger.info(f"模型文件超出磁盘配额，淘汰最久未使用的模型: {model_name}")
+            self.delete_model(model_name)
+            evicted.append(model_name)
+        
+        if self.downloader.disk_usage() > quota:
+            logger.warning("模型文件仍超出磁盘配额（其余模型正在使用或被依赖）")
+        return evicted
+    
+    def tune_model(
+        self,
+        model_name: str,
+        threads: Optional[List[int]] = None,
+        batches: Optional[List[Tuple[int, int]]] = None,
+        prompt_tokens: int = 512,
+        decode_tokens: int = 64,
+        repeats: int = 2,
+        progress=None
+    ) -> Dict[str, Any]:
+        """
+        在本机上测量并选择模型的线程数和批大小，结果保存到模型信息中
+        
+        调优期间会多次加载模型并占满CPU，测量结果受同时进行的推理影响。
+        已加载的模型在下次加载时使用新的参数。
+        
+        Args:
+            model_name: 模型名称
+            threads: 候选线程数（默认按核心数生成）
+            batches: 候选 (n_batch, n_ubatch)（默认按提示词长度生成）
+            prompt_tokens: 测量用的提示词长度
+            decode_tokens: 测量用的生成token数
+            repeats: 每组参数的测量次数
+            progress: 每完成一组测量时的回调
+            
+        Returns:
+            {"success": True, "profile": 调优结果}
+        """
+        model_info = self.downloader.get_model_info(model_name)
+        if not model_info:
+            return {"error": "模型不存在"}
+        if model_info.get("type") == "lora":
+            return {"error": "LoRA适配器使用其基础模型的调优结果，请调优基础模型"}
+        status = self.downloader.check_file_status(model_info["path"])
+        if status != "ready":
+            return {"error": f"模型状态异常: {status}"}
+        
+        from tuner import Tuner, tuning_key
+        with self._tune_lock:
+            tuner = Tuner(
+                model_info["path"],
+                self.inference_engine.default_load_params(model_info["path"]),
+                prompt_tokens=prompt_tokens,
+                decode_tokens=decode_tokens,
+                repeats=repeats
+            )
+            try:
+                profile = tuner.run(threads, batches, progress=progress)
+            except Exception as e:
+                logger.error(f"调优模型 {model_name} 时出错: {str(e)}")
+                return {"error": str(e)}
+            
+            key = tuning_key(model_info)
+            self.downloader.save_tuning(model_name, key, profile)
+        
+        baseline = profile["baseline"]
+        logger.info(
+            f"模型 {model_name} 调优完成: {profile['params']}，提示词评估 "
+            f"{baseline['prompt_tps']} -> {profile['prompt_tps']} tok/s，解码 "
+            f"{baseline['decode_tps']} -> {profile['decode_tps']} tok/s"
+        )
+        return {
+            "success": True,
+            "key": key,
+            "profile": profile,
+            "loaded": self._is_model_loaded(model_info["path"])
+        }
+    
+    def quantize_model(
+        self,
+        model_name: str,
+        quant: str,
+        target_name: Optional[str] = None,
+        allow_requantize: bool = False,
+        force: bool = False,
+        bench: bool = True
+    ) -> Dict[str, Any]:
+        """
+        在本地把模型量化为更小的版本，作为新模型登记（后台任务）
+        
+        Args:
+            model_name: 源模型名称
+            quant: 目标量化方式（如 Q4_K_M）
+            target_name: 量化版本的模型名称，默认为 "<源模型>:<量化方式>"
+            allow_requantize: 允许从已量化（非 F16/BF16/F32）的模型再量化
+            force: 目标名称已存在时生成新版本并切换
+            bench: 完成后在相同参数下测量源模型与量化版本的速度
+            
+        Returns:
+            {"success": True, "job": 任务信息}，可通过 get_quantize_job 查询进度
+        """
+        from quantizer import QUANT_TYPES, UNQUANTIZED, QuantizeJob, normalize_quant, estimate_size
+        from tuner import gguf_quant
+        
+        quant = normalize_quant(quant)
+        if quant not in QUANT_TYPES:
+            return {"error": f"不支持的量化方式: {quant.upper()}，可选: {', '.join(q.upper() for q in QUANT_TYPES)}"}
+        
+        model_info = self.downloader.get_model_info(model_name)
+        if not model_info:
+            return {"error": "模型不存在"}
+        if model_info.get("type") == "lora":
+            return {"error": "不能量化LoRA适配器，请量化其基础模型"}
+        status = self.downloader.check_file_status(model_info["path"])
+        if status != "ready":
+            return {"error": f"模型状态异常: {status}"}
+        
+        source_quant = gguf_quant(model_info.get("gguf_file") or model_info["path"])
+        if source_quant == quant:
+            return {"error": f"模型 {model_name} 已经是 {quant.upper()}"}
+        if source_quant not in UNQUANTIZED and not allow_requantize:
+            return {"error": f"模型 {model_name} 已量化（{source_quant.upper()}），再量化会叠加误差；确需量化请指定 allow_requantize"}
+        
+        target_name = target_name or f"{model_name}:{quant}"
+        if self.downloader.get_model_info(target_name) and not force:
+            return {"error": f"模型 {target_name} 已存在，使用 force 生成新版本"}
+        
+        estimated = estimate_size(os.path.getsize(model_info["path"]), source_quant, quant)
+        if estimated and shutil.disk_usage(self.downloader.models_dir).free < estimated:
+            return {"error": f"磁盘空间不足，量化版本约需 {estimated / 1024 ** 3:.2f} GB"}
+        
+        job = QuantizeJob(uuid.uuid4().hex[:12], model_name, quant, target_name)
+        job.estimated_bytes = estimated
+        with self._quantize_jobs_lock:
+            self._quantize_jobs[job.id] = job
+            self._prune_quantize_jobs()
+        threading.Thread(
+            target=self._run_quantize,
+            args=(job, allow_requantize, bench),
+            name=f"quantize-{job.id}",
+            daemon=True
+        ).start()
+        return {"success": True, "job": job.to_dict()}
+    
+    def _prune_quantize_jobs(self, keep: int = 32):
+        """只保留最近的若干个已结束任务（调用方持有 _quantize_jobs_lock）"""
+        finished = [job_id for job_id, job in self._quantize_jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(self._quantize_jobs) - keep)]:
+            del self._quantize_jobs[job_id]
+    
+    def get_quantize_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """查询量化任务"""
+        job = self._quantize_jobs.get(job_id)
+        return job.to_dict() if job else None
+    
+    def list_quantize_jobs(self) -> List[Dict[str, Any]]:
+        """列出量化任务（从早到晚）"""
+        with self._quantize_jobs_lock:
+            jobs = list(self._quantize_jobs.values())
+        return [job.to_dict() for job in jobs]
+    
+    def _run_quantize(self, job, allow_requantize: bool, bench: bool):
+        """在后台线程中执行量化任务：量化、纳入模型存储并登记、对比大小和速度"""
+        from quantizer import quantize_gguf, output_filename, speed_delta
+        from tuner import Tuner, gguf_quant
+        
+        # 量化会占满CPU和内存带宽，多个任务依次执行
+        with self._quantize_lock:
+            job.status = "running"
+            job.stage = "quantizing"
+            job.started_at = time.time()
+            model_dir = None
+            registered = False
+            try:
+                source_info = self.downloader.get_model_info(job.model_name)
+                if not source_info:
+                    raise RuntimeError("源模型已被删除")
+                current_info = self.downloader.get_model_info(job.target_name)
+                version = current_info.get("version", 1) + 1 if current_info else 1
+                
+                model_dir = self.downloader.model_dir(job.target_name, version)
+                model_dir.mkdir(parents=True, exist_ok=True)
+                output_path = str(model_dir / output_filename(source_info.get("gguf_file") or source_info["path"], job.quant))
+                partial_path = output_path + ".part"
+                
+                logger.info(f"开始量化模型 {job.model_name} -> {job.target_name} ({job.quant.upper()})")
+                quantize_gguf(
+                    source_info["path"],
+                    partial_path,
+                    job.quant,
+                    nthread=config.QUANTIZE_THREADS,
+                    allow_requantize=allow_requantize,
+                    progress=job.update_written
+                )
+                os.replace(partial_path, output_path)
+                job.progress = 1.0
+                
+                job.stage = "registering"
+                model_info = self.downloader.add_local_model(
+                    job.target_name,
+                    output_path,
+                    version,
+                    quantized_from={
+                        "model": source_info["name"],
+                        "gguf_file": source_info.get("gguf_file"),
+                        "digest": source_info.get("digest"),
+                        "quant": gguf_quant(source_info.get("gguf_file") or source_info["path"])
+                    }
+                )
+                with self._swap_lock:
+                    old_info = self.downloader.promote_version(job.target_name, model_info)
+                registered = True
+                if old_info:
+                    threading.Thread(
+                        target=self._retire_version,
+                        args=(old_info,),
+                        name=f"retire-{job.target_name}",
+                        daemon=True
+                    ).start()
+                
+                source_bytes = os.path.getsize(source_info["path"])
+                result: Dict[str, Any] = {
+                    "model_info": model_info,
+                    "size": {
+                        "source_bytes": source_bytes,
+                        "quantized_bytes": model_info["size_bytes"],
+                        "saved_bytes": source_bytes - model_info["size_bytes"],
+                        "ratio": round(model_info["size_bytes"] / source_bytes, 4) if source_bytes else None
+                    }
+                }
+                
+                if bench:
+                    job.stage = "benchmarking"
+                    with self._tune_lock:
+                        measurements = []
+                        for path in (source_info["path"], output_path):
+                            tuner = Tuner(
+                                path,
+                                self.inference_engine.default_load_params(path),
+                                prompt_tokens=config.QUANTIZE_BENCH_PROMPT_TOKENS,
+                                decode_tokens=config.QUANTIZE_BENCH_DECODE_TOKENS,
+                                repeats=1
+                            )
+                            measurements.append(tuner.measure())
+                    result["speed"] = speed_delta(*measurements)
+                
+                job.result = result
+                job.status = "completed"
+                logger.info(
+                    f"模型 {job.target_name} 量化完成: {source_bytes / 1024 ** 3:.2f} GB -> "
+                    f"{model_info['size_bytes'] / 1024 ** 3:.2f} GB"
+                )
+            except Exception as e:
+                logger.error(f"量化模型 {job.model_name} 时出错: {str(e)}")
+                job.error = str(e)
+                job.status = "failed"
+                # 清理未登记的输出（已纳入存储的内容一并回收）
+                if not registered and model_dir is not None and model_dir.exists():
+                    shutil.rmtree(model_dir)
+                    self.downloader.collect_garbage()
+            finally:
+                job.stage = None
+                job.finished_at = time.time()
+        
+        if job.status == "completed":
+            self._enforce_disk_quota(keep=job.target_name)
+    
+    def collect_garbage(self) -> Dict[str, Any]:
+        """把旧版本下载的文件纳入内容存储（合并重复内容），回收未引用的blob并执行磁盘配额"""
+        ingested = self.downloader.ingest_existing()
+        result = self.downloader.collect_garbage()
+        evicted = self._enforce_disk_quota()
+        return {
+            "ingested": ingested,
+            "removed_blobs": result["removed"],
+            "freed_bytes": result["freed_bytes"],
+            "evicted": evicted,
+            "disk_usage_bytes": self.downloader.disk_usage()
+        }
+    
     def list_models(self) -> Dict[str, Any]:
         """列出所有模型"""
         models = self.downloader.list_models()
@@ -60,11 +574,15 @@ class ModelManager:
         for model_name, model_info in models.items():
             status = self.downloader.check_model_status(model_name)
             model_info["status"] = status
-            model_info["loaded"] = self.inference_engine.is_model_loaded(model_info["path"])
+            model_info["loaded"] = self._is_model_loaded(model_info["path"])
         
         return {
             "models": models,
-            "total": len(models)
+            "total": len(models),
+            "disk": {
+                "used_bytes": self.downloader.disk_usage(),
+                "quota_bytes": int(config.MODELS_DISK_QUOTA_GB * 1024 ** 3) or None
+            }
         }
     
     def get_model_info(self, model_name: str) -> Optional[Dict[str, Any]]:
@@ -73,39 +591,72 @@ class ModelManager:
         if model_info:
             status = self.downloader.check_model_status(model_name)
             model_info["status"] = status
-            model_info["loaded"] = self.inference_engine.is_model_loaded(model_info["path"])
+            model_info["loaded"] = self._is_model_loaded(model_info["path"])
         return model_info
     
     def load_model(self, model_name: str) -> Dict[str, Any]:
         """加载模型到内存"""
         model_info = self.downloader.get_model_info(model_name)
-        if not model_info:
-            return {"error": "模型不存在"}
-        
-        status = self.downloader.check_model_status(model_name)
-        if status != "ready":
-            return {"error": f"模型状态异常: {status}"}
-        
-        if self.inference_engine.is_model_loaded(model_info["path"]):
+        if model_info and self._is_model_loaded(model_info["path"]):
             return {"message": "模型已加载", "model_info": model_info}
         
-        success = self.inference_engine.load_model(model_info["path"])
-        if success:
-            return {
-                "success": True,
-                "message": f"模型 {model_name} 加载成功",
-                "model_info": model_info
-            }
-        else:
-            return {"error": "模型加载失败"}
+        model_info, adapter_info, error = self._acquire_model(model_name)
+        if error:
+            return error
+        self._release_model(model_info, adapter_info)
+        
+        return {
+            "success": True,
+            "message": f"模型 {model_name} 加载成功",
+            "model_info": model_info
+        }
+    
+    def preload_model(self, model_name: str) -> bool:
+        """
+        预测到即将有请求时提前加载模型（不计入请求统计，避免预加载本身抬高预测）
+    
+        Returns:
+            是否加载成功
+        """
+        with self._swap_lock:
+            model_info = self.downloader.get_model_info(model_name)
+            if not model_info or model_info.get("type") == "lora":
+                return False
+            if self.downloader.check_file_status(model_info["path"]) != "ready":
+                return False
+            # 登记引用，加载期间不会被内存压力控制卸载
+            self.inference_engine.acquire_model(model_info["path"])
+        try:
+            return self.inference_engine.load_model(model_info["path"], **self._load_params(model_info))
+        finally:
+            self.inference_engine.release_model(model_info["path"])
+    
+    def loaded_model_names(self) -> List[str]:
+        """已加载的模型名称"""
+        if self._inference_engine is None:
+            return []
+        with self._swap_lock:
+            return [
+                name for name, model_info in self.downloader.list_models().items()
+                if self._inference_engine.is_model_loaded(model_info["path"])
+            ]
+    
+    def save_usage(self) -> bool:
+        """把各模型的请求统计写入统计文件（在文件锁下与其他工作进程的统计合并）"""
+        return self.downloader.save_usage()
     
     def unload_model(self, model_name: str) -> Dict[str, Any]:
-        """卸载模型"""
+        """卸载模型（等待进行中的请求结束）"""
         model_info = self.downloader.get_model_info(model_name)
         if not model_info:
             return {"error": "模型不存在"}
         
-        success = self.inference_engine.unload_model(model_info["path"])
+        success = (
+            self._inference_engine is not None
+            and self._inference_engine.unload_model(
+                model_info["path"], wait=True, timeout=config.MODEL_DRAIN_TIMEOUT
+            )
+        )
         if success:
             return {"message": f"模型 {model_name} 卸载成功"}
         else:
@@ -113,15 +664,16 @@ class ModelManager:
     
     def delete_model(self, model_name: str) -> Dict[str, Any]:
         """删除模型"""
-        # 先卸载模型
-        self.unload_model(model_name)
-        
-        # 删除模型文件
-        success = self.downloader.delete_model(model_name)
-        if success:
-            return {"message": f"模型 {model_name} 删除成功"}
-        else:
+        # 先移除模型信息，之后的请求不会再解析到该模型
+        with self._swap_lock:
+            model_info = self.downloader.get_model_info(model_name)
+            success = self.downloader.delete_model(model_name, remove_files=False)
+        if not success:
             return {"error": "模型不存在或删除失败"}
+        
+        # 等待进行中的请求结束后卸载，再删除模型文件
+        self._retire_version(model_info)
+        return {"message": f"模型 {model_name} 删除成功"}
     
     def generate_text(
         self, 
@@ -132,6 +684,9 @@ class ModelManager:
         top_p: float = 0.9,
         top_k: int = 40,
         repeat_penalty: float = 1.1,
+        n: int = 1,
+        adapter: Optional[str] = None,
+        adapter_scale: float = 1.0,
         **kwargs
     ) -> Dict[str, Any]:
         """
@@ -145,37 +700,59 @@ class ModelManager:
             top_p: top-p采样参数
             top_k: top-k采样参数
             repeat_penalty: 重复惩罚
+            n: 返回的候选数量
+            adapter: 应用在基础模型上的LoRA适配器名称（可选）
+            adapter_scale: LoRA适配器强度
             
         Returns:
             生成结果
         """
-        model_info = self.downloader.get_model_info(model_name)
-        if not model_info:
-            return {"error": "模型不存在"}
-        
-        status = self.downloader.check_model_status(model_name)
-        if status != "ready":
-            return {"error": f"模型状态异常: {status}"}
-        
-        # 确保模型已加载
-        if not self.inference_engine.is_model_loaded(model_info["path"]):
-            load_result = self.load_model(model_name)
-            if "error" in load_result:
-                return load_result
+        params = dict(
+            model_name=model_name, prompt=prompt, max_tokens=max_tokens, temperature=temperature,
+            top_p=top_p, top_k=top_k, repeat_penalty=repeat_penalty, n=n,
+            adapter=adapter, adapter_scale=adapter_scale, **kwargs
+        )
+        return self._coalesce("generate", self._generate_text, params)
+
+    def _generate_text(
+        self,
+        model_name: str,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        top_p: float,
+        top_k: int,
+        repeat_penalty: float,
+        n: int,
+        adapter: Optional[str],
+        adapter_scale: float,
+        **kwargs
+    ) -> Dict[str, Any]:
+        model_info, adapter_info, error = self._acquire_model(model_name, adapter)
+        if error:
+            record_error(error["error"])
+            return error
         
         # 生成文本
-        result = self.inference_engine.generate_text(
-            model_info["path"],
-            prompt,
-            max_tokens,
-            temperature,
-            top_p,
-            top_k,
-            repeat_penalty,
-            **kwargs
-        )
+        try:
+            with endpoint_profiler.profile("generate"):
+                result = self.inference_engine.generate_text(
+                    model_info["path"],
+                    prompt,
+                    max_tokens,
+                    temperature,
+                    top_p,
+                    top_k,
+                    repeat_penalty,
+                    n=n,
+                    **self._adapter_kwargs(adapter_info, adapter_scale),
+                    **kwargs
+                )
+        finally:
+            self._release_model(model_info, adapter_info)
         
         if "error" in result:
+            record_error(result["error"])
             return result
         
         # 添加模型信息
@@ -188,6 +765,8 @@ class ModelManager:
         messages: List[Dict[str, str]],
         max_tokens: int = 32768,
         temperature: float = 0.7,
+        adapter: Optional[str] = None,
+        adapter_scale: float = 1.0,
         **kwargs
     ) -> Dict[str, Any]:
         """
@@ -198,34 +777,49 @@ class ModelManager:
             messages: 消息列表，格式: [{"role": "user", "content": "..."}]
             max_tokens: 最大生成token数
             temperature: 温度参数
+            adapter: 应用在基础模型上的LoRA适配器名称（可选）
+            adapter_scale: LoRA适配器强度
             
         Returns:
             聊天补全结果
         """
-        model_info = self.downloader.get_model_info(model_name)
-        if not model_info:
-            return {"error": "模型不存在"}
-        
-        status = self.downloader.check_model_status(model_name)
-        if status != "ready":
-            return {"error": f"模型状态异常: {status}"}
-        
-        # 确保模型已加载
-        if not self.inference_engine.is_model_loaded(model_info["path"]):
-            load_result = self.load_model(model_name)
-            if "error" in load_result:
-                return load_result
+        params = dict(
+            model_name=model_name, messages=messages, max_tokens=max_tokens, temperature=temperature,
+            adapter=adapter, adapter_scale=adapter_scale, **kwargs
+        )
+        return self._coalesce("chat", self._chat_completion, params)
+
+    def _chat_completion(
+        self,
+        model_name: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        temperature: float,
+        adapter: Optional[str],
+        adapter_scale: float,
+        **kwargs
+    ) -> Dict[str, Any]:
+        model_info, adapter_info, error = self._acquire_model(model_name, adapter)
+        if error:
+            record_error(error["error"])
+            return error
         
         # 聊天补全
-        result = self.inference_engine.chat_completion(
-            model_info["path"],
-            messages,
-            max_tokens,
-            temperature,
-            **kwargs
-        )
+        try:
+            with endpoint_profiler.profile("chat"):
+                result = self.inference_engine.chat_completion(
+                    model_info["path"],
+                    messages,
+                    max_tokens,
+                    temperature,
+                    **self._adapter_kwargs(adapter_info, adapter_scale),
+                    **kwargs
+                )
+        finally:
+            self._release_model(model_info, adapter_info)
         
         if "error" in result:
+            record_error(result["error"])
             return result
         
         # 添加模型信息
@@ -238,6 +832,8 @@ class ModelManager:
         messages: List[Dict[str, str]],
         max_tokens: int = 32768,
         temperature: float = 0.7,
+        adapter: Optional[str] = None,
+        adapter_scale: float = 1.0,
         **kwargs
     ):
         """
@@ -248,53 +844,219 @@ class ModelManager:
             messages: 消息列表，格式: [{"role": "user", "content": "..."}]
             max_tokens: 最大生成token数
             temperature: 温度参数
+            adapter: 应用在基础模型上的LoRA适配器名称（可选）
+            adapter_scale: LoRA适配器强度
             
         Yields:
             流式聊天补全结果
         """
-        model_info = self.downloader.get_model_info(model_name)
-        if not model_info:
-            yield {"error": "模型不存在"}
+        params = dict(
+            model_name=model_name, messages=messages, max_tokens=max_tokens, temperature=temperature,
+            adapter=adapter, adapter_scale=adapter_scale, **kwargs
+        )
+        if not self._coalescable(params):
+            yield from self._chat_completion_stream(**params)
             return
-        
-        status = self.downloader.check_model_status(model_name)
-        if status != "ready":
-            yield {"error": f"模型状态异常: {status}"}
+
+        stream, joined = self.flights.stream(
+            flight_key("chat_stream", **params),
+            lambda: self._chat_completion_stream(**params)
+        )
+        if joined:
+            self._mark_coalesced()
+        yield from stream
+
+    def _chat_completion_stream(
+        self,
+        model_name: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        temperature: float,
+        adapter: Optional[str],
+        adapter_scale: float,
+        **kwargs
+    ):
+        model_info, adapter_info, error = self._acquire_model(model_name, adapter)
+        if error:
+            record_error(error["error"])
+            yield error
             return
         
-        # 确保模型已加载
-        if not self.inference_engine.is_model_loaded(model_info["path"]):
-            load_result = self.load_model(model_name)
-            if "error" in load_result:
-                yield load_result
-                return
-        
         # 流式聊天补全
-        for chunk in self.inference_engine.chat_completion_stream(
-            model_info["path"],
-            messages,
-            max_tokens,
-            temperature,
-            **kwargs
-        ):
-            if "error" in chunk:
+        try:
+            for chunk in self.inference_engine.chat_completion_stream(
+                model_info["path"],
+                messages,
+                max_tokens,
+                temperature,
+                **self._adapter_kwargs(adapter_info, adapter_scale),
+                **kwargs
+            ):
+                if "error" in chunk:
+                    record_error(chunk["error"])
+                    yield chunk
+                    return
+                
+                # 添加模型信息
+                chunk["model"] = model_name
                 yield chunk
-                return
+        finally:
+            self._release_model(model_info, adapter_info)
+
+    @staticmethod
+    def _coalescable(params: Dict[str, Any]) -> bool:
+        """只有确定性（temperature<=0）的请求结果与执行次数无关，才能合并"""
+        return config.SINGLE_FLIGHT and params.get("temperature", 1) <= 0
+
+    @staticmethod
+    def _mark_coalesced():
+        trace = current_trace()
+        if trace is not None:
+            trace.attrs["coalesced"] = True
+
+    def _coalesce(self, kind: str, fn, params: Dict[str, Any]) -> Dict[str, Any]:
+        """相同的确定性请求正在进行时等待它的结果，而不是再推理一次"""
+        if not self._coalescable(params):
+            return fn(**params)
+        result, coalesced = self.flights.do(flight_key(kind, **params), lambda: fn(**params))
+        if coalesced:
+            self._mark_coalesced()
+            if "error" in result:
+                record_error(result["error"])
+        # 每个调用方拿到独立的副本，调用方修改结果不影响其他等待者
+        return dict(result)
+
+    def count_tokens(self, model_name: str, texts: List[str], add_bos: bool = True) -> Dict[str, Any]:
+        """
+        计算文本的token数（只加载词表，不要求模型已加载，也不等待推理）
+        
+        Args:
+            model_name: 模型名称（LoRA适配器使用其基础模型的词表）
+            texts: 文本列表
+            add_bos: 是否计入BOS等特殊token
             
-            # 添加模型信息
-            chunk["model"] = model_name
-            yield chunk
+        Returns:
+            {"counts": [...], "total": N}
+        """
+        with self._swap_lock:
+            model_info = self.downloader.get_model_info(model_name)
+            if model_info and model_info.get("type") == "lora":
+                model_info = self.downloader.get_model_info(model_info["base_model"])
+        if not model_info:
+            return {"error": "模型不存在"}
+        
+        try:
+            counts = self.tokenizers.count_tokens(model_info["path"], texts, add_bos)
+        except Exception as e:
+            logger.error(f"计算token数时出错: {str(e)}")
+            record_error(str(e))
+            return {"error": str(e)}
+        return {"counts": counts, "total": sum(counts)}
+
+    def score(
+        self,
+        model_name: str,
+        pairs: List[Tuple[str, str]],
+        token_logprobs: bool = False
+    ) -> Dict[str, Any]:
+        """
+        计算续写在提示词下的对数似然，用于给候选续写排序或比较不同量化版本的困惑度
+
+        Args:
+            model_name: 模型名称
+            pairs: [(提示词, 续写)]，提示词为空时计算整段续写的困惑度
+            token_logprobs: 是否返回逐token的对数概率
+
+        Returns:
+            评分结果
+        """
+        model_info, adapter_info, error = self._acquire_model(model_name)
+        if error:
+            record_error(error["error"])
+            return error
+
+        try:
+            if adapter_info:
+                result = {"error": "评分暂不支持LoRA适配器，请使用基础模型"}
+            else:
+                with endpoint_profiler.profile("score"):
+                    result = self.inference_engine.score(model_info["path"], pairs, token_logprobs)
+        finally:
+            self._release_model(model_info, adapter_info)
+
+        if "error" in result:
+            record_error(result["error"])
+            return result
+
+        result["model_name"] = model_name
+        return result
 
     def get_loaded_models(self) -> List[Dict[str, Any]]:
         """获取已加载的模型列表"""
         loaded_models = []
+        if self._inference_engine is None:
+            return loaded_models
         for model_path in self.inference_engine.list_loaded_models():
             model_info = self.inference_engine.get_model_info(model_path)
             if model_info:
                 loaded_models.append(model_info)
         return loaded_models
     
+    def relieve_memory_pressure(self, level: str) -> List[str]:
+        """
+        内存压力降载（由内存压力控制器在后台线程调用）
+
+        elevated 时释放可以重建的缓存；critical 时另外卸载最久未使用的一个空闲模型。
+
+        Args:
+            level: 压力级别（elevated / critical）
+
+        Returns:
+            执行的动作描述
+        """
+        actions = []
+        if self._inference_engine is not None:
+            freed = self._inference_engine.shrink_caches()
+            if any(freed.values()):
+                actions.append(
+                    f"释放缓存: 语法 {freed['grammars']} 个，评分上下文 {freed['scorers']} 个，"
+                    f"token文本 {freed['token_texts']} 条"
+                )
+        if self._tokenizers is not None:
+            dropped = self._tokenizers.clear()
+            if dropped:
+                actions.append(f"释放分词器 {dropped} 个")
+        gc.collect()
+
+        if level != "critical" or self._inference_engine is None:
+            return actions
+
+        # 在切换锁内检查并卸载：新请求在同一把锁内登记，检查之后不会再被分配到该模型
+        with self._swap_lock:
+            for name in self.downloader.lru_models():
+                model_info = self.downloader.get_model_info(name)
+                if model_info.get("type") == "lora":
+                    continue
+                path = model_info["path"]
+                if self._is_model_loaded(path) and self._inference_engine.is_model_idle(path):
+                    self._inference_engine.unload_model(path)
+                    actions.append(f"卸载空闲模型 {name}")
+                    break
+        return actions
+
     def clear_all_models(self):
         """清除所有已加载的模型"""
-        self.inference_engine.clear_all_models()
-        return {"message": "所有模型已清除"}
\ No newline at end of file
+        if self._inference_engine is not None:
+            self._inference_engine.clear_all_models()
+        return {"message": "所有模型已清除"}
+
+
+_default_manager: Optional[ModelManager] = None
+
+
+def get_model_manager() -> ModelManager:
+    """获取进程内共享的模型管理器（各API路由共用同一份已加载模型）"""
+    global _default_manager
+    if _default_manager is None:
+        _default_manager = ModelManager()
+    return _default_manager
@@ -0,0 +1,192 @@
+"""
+本地量化模块 - 把已下载的 F16/F32 等GGUF模型量化为更小的版本（llm quantize）
+
+仓库只提供 F16/F32 文件时，下载得到的模型比常用的 Q4_K_M 大 2~4 倍，解码受内存带宽
+限制，速度也相应变慢。这里调用 llama.cpp 的 llama_model_quantize 在本地生成量化版本，
+作为新的模型名称登记到模型信息中。量化在后台任务中运行，按输出文件的增长估计进度。
+"""
+import os
+import re
+import time
+import ctypes
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from inference import _import_quantize_api
+from tuner import gguf_quant
+
+# 支持的目标量化方式 -> (llama.cpp 文件类型名称, 近似的每权重比特数)
+# 比特数用于估计输出大小（进度和磁盘空间检查）；IQ1/IQ2/IQ3 需要重要性矩阵，不在此列
+QUANT_TYPES = {
+    "q2_k": ("MOSTLY_Q2_K", 3.35),
+    "q3_k_s": ("MOSTLY_Q3_K_S", 3.5),
+    "q3_k_m": ("MOSTLY_Q3_K_M", 3.91),
+    "q3_k_l": ("MOSTLY_Q3_K_L", 4.27),
+    "iq4_xs": ("MOSTLY_IQ4_XS", 4.25),
+    "iq4_nl": ("MOSTLY_IQ4_NL", 4.5),
+    "q4_0": ("MOSTLY_Q4_0", 4.55),
+    "q4_1": ("MOSTLY_Q4_1", 5.0),
+    "q4_k_s": ("MOSTLY_Q4_K_S", 4.58),
+    "q4_k_m": ("MOSTLY_Q4_K_M", 4.89),
+    "q5_0": ("MOSTLY_Q5_0", 5.54),
+    "q5_1": ("MOSTLY_Q5_1", 6.0),
+    "q5_k_s": ("MOSTLY_Q5_K_S", 5.54),
+    "q5_k_m": ("MOSTLY_Q5_K_M", 5.69),
+    "q6_k": ("MOSTLY_Q6_K", 6.56),
+    "q8_0": ("MOSTLY_Q8_0", 8.5),
+    "bf16": ("MOSTLY_BF16", 16.0),
+    "f16": ("MOSTLY_F16", 16.0),
+    "f32": ("ALL_F32", 32.0),
+}
+
+# 未量化的源格式；从其他量化版本再量化会叠加误差，需要显式允许
+UNQUANTIZED = ("f32", "f16", "bf16")
+
+
+def normalize_quant(quant: str) -> str:
+    """规范化量化方式名称（Q4_K_M、q4-k-m -> q4_k_m）"""
+    return quant.strip().lower().replace("-", "_")
+
+
+def estimate_size(source_bytes: int, source_quant: str, quant: str) -> Optional[int]:
+    """按每权重比特数估计量化后的文件大小，无法识别源格式时返回None"""
+    if source_quant not in QUANT_TYPES or quant not in QUANT_TYPES:
+        return None
+    return int(source_bytes * QUANT_TYPES[quant][1] / QUANT_TYPES[source_quant][1])
+
+
+def output_filename(gguf_file: str, quant: str) -> str:
+    """量化版本的文件名：替换原文件名中的量化方式，识别不到时追加"""
+    name = os.path.basename(gguf_file)
+    stem = name[:-5] if name.lower().endswith(".gguf") else name
+    source_quant = gguf_quant(name)
+    if source_quant in QUANT_TYPES:
+        matches = list(re.finditer(re.escape(source_quant), stem, re.IGNORECASE))
+        if matches:
+            last = matches[-1]
+            return f"{stem[:last.start()]}{quant.upper()}{stem[last.end():]}.gguf"
+    return f"{stem}-{quant.upper()}.gguf"
+
+
+def quantize_gguf(
+    source_path: str,
+    output_path: str,
+    quant: str,
+    nthread: int = 0,
+    allow_requantize: bool = False,
+    progress: Optional[Callable[[int], None]] = None,
+    interval: float = 0.5
+):
+    """
+    量化GGUF文件（阻塞直到完成）
+
+    llama_model_quantize 没有进度回调；量化在单独的线程中进行（ctypes 调用期间释放GIL），
+    当前线程每隔 interval 秒回报一次已写出的字节数。
+
+    Args:
+        source_path: 源GGUF文件
+        output_path: 输出文件
+        quant: 目标量化方式（QUANT_TYPES 中的名称）
+        nthread: 量化线程数，0 表示使用全部核心
+        allow_requantize: 是否允许从已量化的文件再量化
+        progress: 回调 progress(已写出的字节数)
+        interval: 回报进度的间隔（秒）
+    """
+    default_params, llama_model_quantize, ftypes = _import_quantize_api()
+    ftype_name = QUANT_TYPES[quant][0]
+    if ftype_name not in ftypes:
+        raise RuntimeError(f"当前 llama-cpp-python 版本不支持量化为 {quant.upper()}")
+
+    params = default_params()
+    params.nthread = nthread
+    params.ftype = ftypes[ftype_name]
+    params.allow_requantize = allow_requantize
+
+    outcome: Dict[str, Any] = {}
+
+    def run():
+        try:
+            outcome["code"] = llama_model_quantize(
+                source_path.encode("utf-8"),
+                output_path.encode("utf-8"),
+                ctypes.byref(params)
+            )
+        except BaseException as e:
+            outcome["error"] = e
+
+    worker = threading.Thread(target=run, name="quantize", daemon=True)
+    worker.start()
+    while worker.is_alive():
+        worker.join(interval)
+        if progress is not None and os.path.exists(output_path):
+            progress(os.path.getsize(output_path))
+
+    if "error" in outcome:
+        raise outcome["error"]
+    if outcome.get("code") != 0:
+        raise RuntimeError(f"llama.cpp 量化失败（返回码 {outcome.get('code')}）")
+
+
+class QuantizeJob:
+    """
+    一次后台量化任务
+
+    status: queued -> running -> completed / failed；running 期间 stage 为
+    quantizing（量化）、registering（纳入模型存储）或 benchmarking（对比速度）。
+    """
+
+    def __init__(self, job_id: str, model_name: str, quant: str, target_name: str):
+        self.id = job_id
+        self.model_name = model_name
+        self.quant = quant
+        self.target_name = target_name
+        self.status = "queued"
+        self.stage: Optional[str] = None
+        self.progress = 0.0
+        self.written_bytes = 0
+        self.estimated_bytes: Optional[int] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def update_written(self, written: int):
+        """量化过程中的进度（按估计的输出大小，完成前最多 99%）"""
+        self.written_bytes = written
+        if self.estimated_bytes:
+            self.progress = min(0.99, written / self.estimated_bytes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = self.finished_at or time.time()
+        return {
+            "id": self.id,
+            "model_name": self.model_name,
+            "quant": self.quant.upper(),
+            "target_name": self.target_name,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 4),
+            "written_bytes": self.written_bytes,
+            "estimated_bytes": self.estimated_bytes,
+            "elapsed_s": round(now - self.started_at, 1) if self.started_at else 0.0,
+            "created_at": self.created_at,
+            "result": self.result,
+            "error": self.error
+        }
+
+
+def speed_delta(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+    """源模型与量化版本在相同参数下的速度对比"""
+    report: Dict[str, Any] = {
+        "source": {key: before.get(key) for key in ("prompt_tps", "decode_tps", "error") if key in before},
+        "quantized": {key: after.get(key) for key in ("prompt_tps", "decode_tps", "error") if key in after}
+    }
+    for key, label in (("prompt_tps", "prompt_speedup"), ("decode_tps", "decode_speedup")):
+        if before.get(key) and after.get(key):
+            report[label] = round(after[key] / before[key], 3)
+    return report
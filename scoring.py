@@ -0,0 +1,286 @@
+"""
+评分模块 - 计算续写在给定提示词下的逐token对数概率（对数似然 / 困惑度）
+
+评分只做提示词评估、不采样：在与已加载模型共享权重的独立上下文中批量评估，
+每个位置的 logits 一次取出，用 NumPy 计算 log_softmax。
+- 提示词按token排序，相同的提示词只评估一次，相邻提示词的公共前缀也保留在KV缓存中复用
+- 同一提示词下的多个续写各占一个序列，从提示词的KV缓存复制后打包进同一批评估
+"""
+import math
+import logging
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _import_score_api() -> Dict[str, Any]:
+    """
+    延迟导入 llama.cpp 的上下文、批和KV缓存接口（不同版本函数名不同）
+
+    Returns:
+        {"new_context", "free", "seq_rm", "seq_cp", "clear", ...}，KV缓存函数的第一个参数为上下文
+    """
+    try:
+        import llama_cpp
+    except ImportError:
+        raise ImportError("请安装 llama-cpp-python: pip install llama-cpp-python")
+
+    api: Dict[str, Any] = {}
+    for name in ("llama_init_from_model", "llama_new_context_with_model"):
+        if hasattr(llama_cpp, name):
+            api["new_context"] = getattr(llama_cpp, name)
+            break
+
+    if hasattr(llama_cpp, "llama_get_memory") and hasattr(llama_cpp, "llama_memory_seq_rm"):
+        memory = llama_cpp.llama_get_memory
+        api["seq_rm"] = lambda ctx, *args: llama_cpp.llama_memory_seq_rm(memory(ctx), *args)
+        api["seq_cp"] = lambda ctx, *args: llama_cpp.llama_memory_seq_cp(memory(ctx), *args)
+        api["clear"] = lambda ctx: llama_cpp.llama_memory_clear(memory(ctx), True)
+    else:
+        for prefix in ("llama_kv_self_", "llama_kv_cache_"):
+            if hasattr(llama_cpp, prefix + "seq_rm"):
+                api["seq_rm"] = getattr(llama_cpp, prefix + "seq_rm")
+                api["seq_cp"] = getattr(llama_cpp, prefix + "seq_cp")
+                api["clear"] = getattr(llama_cpp, prefix + "clear")
+                break
+
+    required = ("new_context", "seq_rm", "llama_context_default_params", "llama_batch_init", "llama_decode", "llama_get_logits")
+    if any(name not in api and not hasattr(llama_cpp, name) for name in required):
+        raise RuntimeError("当前 llama-cpp-python 版本不支持批量评分，请升级到 0.3.0 以上")
+
+    api.update({
+        "default_params": llama_cpp.llama_context_default_params,
+        "free": llama_cpp.llama_free,
+        "batch_init": llama_cpp.llama_batch_init,
+        "batch_free": llama_cpp.llama_batch_free,
+        "decode": llama_cpp.llama_decode,
+        "get_logits": llama_cpp.llama_get_logits,
+        "n_seq_max": getattr(llama_cpp, "llama_n_seq_max", None),
+    })
+    return api
+
+
+def _common_prefix(a: Sequence[int], b: Sequence[int]) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def _log_normalizers(logits: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    每行 logits 的 logsumexp（log_softmax 的归一化项）和概率最大的token
+
+    Args:
+        logits: (行数, 词表大小) float32
+    """
+    peak = logits.max(axis=1)
+    # exp 在 float32 下计算，求和累加到 float64，词表很大时不损失精度
+    total = np.exp(logits - peak[:, None]).sum(axis=1, dtype=np.float64)
+    return peak + np.log(total), logits.argmax(axis=1)
+
+
+class Scorer:
+    """
+    单个模型的评分上下文
+
+    与模型常驻的推理上下文共享权重，只另外分配KV缓存；调用方需持有模型锁。
+
+    Args:
+        llama_model: 已加载的 Llama 实例
+        n_ctx: KV缓存容量（所有序列共用，提示词只占一份）
+        n_seq: 最多同时评估的序列数（含保存提示词的序列）
+        load_params: 模型的加载参数（沿用线程数、批大小和KV缓存类型）
+    """
+
+    def __init__(self, llama_model, n_ctx: int, n_seq: int, load_params: Dict[str, Any]):
+        self._api = _import_score_api()
+        self.n_vocab = llama_model.n_vocab()
+        self.n_batch = int(load_params.get("n_batch") or 512)
+
+        params = self._api["default_params"]()
+        params.n_ctx = n_ctx
+        params.n_batch = self.n_batch
+        params.n_ubatch = int(load_params.get("n_ubatch") or min(self.n_batch, 512))
+        params.n_seq_max = max(2, n_seq)
+        params.n_threads = load_params.get("n_threads") or params.n_threads
+        params.n_threads_batch = load_params.get("n_threads_batch") or params.n_threads
+        for key in ("type_k", "type_v"):
+            if key in load_params:
+                setattr(params, key, load_params[key])
+        if load_params.get("flash_attn"):
+            if hasattr(params, "flash_attn_type"):
+                params.flash_attn_type = 1
+            else:
+                params.flash_attn = True
+        if hasattr(params, "kv_unified"):
+            # 各序列共用同一块KV缓存，复制提示词只增加序列标记、不复制数据
+            params.kv_unified = True
+        if hasattr(params, "logits_all"):
+            params.logits_all = False
+
+        self._ctx = self._api["new_context"](llama_model.model, params)
+        if not self._ctx:
+            raise RuntimeError("创建评分上下文失败")
+        self._batch = self._api["batch_init"](self.n_batch, 0, 1)
+        n_seq_max = self._api["n_seq_max"]
+        self.n_ctx = n_ctx
+        self.n_seq = int(n_seq_max(self._ctx)) if n_seq_max is not None else params.n_seq_max
+        # 序列0中当前保存的提示词
+        self._prefix: List[int] = []
+        # 最近一次评分实际评估的token数（公共前缀只计一次）
+        self.evaluated = 0
+
+    def close(self):
+        """释放评分上下文（需在模型释放之前调用）"""
+        if self._ctx is not None:
+            self._api["batch_free"](self._batch)
+            self._api["free"](self._ctx)
+            self._ctx = None
+
+    def _decode(self, entries: List[Tuple[int, int, int, bool]]) -> Optional[np.ndarray]:
+        """
+        评估一批token
+
+        Args:
+            entries: [(token, 位置, 序列, 是否需要logits)]
+
+        Returns:
+            需要logits的token按顺序对应的 (行数, 词表大小) 视图，下次评估前有效
+        """
+        batch = self._batch
+        n_outputs = 0
+        for i, (token, pos, seq, output) in enumerate(entries):
+            batch.token[i] = token
+            batch.pos[i] = pos
+            batch.n_seq_id[i] = 1
+            batch.seq_id[i][0] = seq
+            batch.logits[i] = output
+            n_outputs += output
+        batch.n_tokens = len(entries)
+
+        status = self._api["decode"](self._ctx, batch)
+        if status != 0:
+            raise RuntimeError(f"评分时 llama_decode 失败（返回 {status}），可调大 SCORE_N_CTX")
+        if not n_outputs:
+            return None
+        return np.ctypeslib.as_array(self._api["get_logits"](self._ctx), shape=(n_outputs, self.n_vocab))
+
+    def _eval_prefix(self, prompt: List[int]) -> np.ndarray:
+        """把提示词放入序列0（保留与上一个提示词的公共前缀），返回最后一个位置的logits"""
+        # 至少重新评估最后一个token，才能得到它的logits
+        keep = min(_common_prefix(self._prefix, prompt), len(prompt) - 1)
+        self._api["seq_rm"](self._ctx, 0, keep, -1)
+        self._prefix = prompt[:keep]
+
+        logits = None
+        for start in range(keep, len(prompt), self.n_batch):
+            end = min(start + self.n_batch, len(prompt))
+            entries = [(prompt[pos], pos, 0, pos == len(prompt) - 1) for pos in range(start, end)]
+            logits = self._decode(entries)
+            self._prefix = prompt[:end]
+        self.evaluated += len(prompt) - keep
+        return np.array(logits[0])
+
+    def _score_group(self, prompt_len: int, last_logits: np.ndarray, members: List[Tuple[int, List[int]]], results: Dict[int, Dict[str, Any]]):
+        """
+        对同一提示词下的续写评分
+
+        续写的第一个token由提示词最后一个位置的logits给出（所有续写共用），
+        其余token的logits来自续写自身的前一个位置，各续写打包后批量评估。
+        """
+        norm, top = _log_normalizers(last_logits[None, :])
+        for index, cont in members:
+            results[index] = {"logprobs": [last_logits[cont[0]] - norm[0]], "greedy": bool(cont[0] == top[0])}
+
+        pending = deque((index, cont) for index, cont in members if len(cont) > 1)
+        while pending:
+            # 一轮：不超过序列数和KV缓存容量的若干续写，每个续写占一个序列；
+            # 上下文只支持一个序列时逐个在序列0上评估，评估后截回提示词
+            group = []
+            cells = self.n_ctx - prompt_len
+            while pending and len(group) < max(self.n_seq - 1, 1):
+                index, cont = pending[0]
+                if group and len(cont) - 1 > cells:
+                    break
+                pending.popleft()
+                group.append((index, cont))
+                cells -= len(cont) - 1
+
+            entries = []
+            targets = []
+            seqs = range(1, len(group) + 1) if self.n_seq > 1 else [0]
+            for seq, (index, cont) in zip(seqs, group):
+                if seq:
+                    self._api["seq_cp"](self._ctx, 0, seq, -1, -1)
+                for k in range(len(cont) - 1):
+                    entries.append((cont[k], prompt_len + k, seq, True))
+                    targets.append((index, cont[k + 1]))
+
+            for start in range(0, len(entries), self.n_batch):
+                chunk = entries[start:start + self.n_batch]
+                logits = self._decode(chunk)
+                chunk_targets = targets[start:start + self.n_batch]
+                ids = np.array([t for _, t in chunk_targets])
+                norm, top = _log_normalizers(logits)
+                logprobs = logits[np.arange(len(ids)), ids] - norm
+                for (index, _), lp, greedy in zip(chunk_targets, logprobs, top == ids):
+                    result = results[index]
+                    result["logprobs"].append(lp)
+                    result["greedy"] = result["greedy"] and bool(greedy)
+            self.evaluated += len(entries)
+
+            for seq in seqs:
+                self._api["seq_rm"](self._ctx, seq, prompt_len if seq == 0 else -1, -1)
+
+    def score(self, requests: List[Tuple[List[int], List[int]]]) -> List[Dict[str, Any]]:
+        """
+        对 (提示词token, 续写token) 批量评分
+
+        Returns:
+            与输入顺序一致的结果，每项包含 logprob（总和）、token_logprobs、is_greedy；
+            超出上下文长度的项为 {"error": ...}
+        """
+        self.evaluated = 0
+        results: Dict[int, Dict[str, Any]] = {}
+        valid = []
+        for index, (prompt, cont) in enumerate(requests):
+            if not prompt or not cont:
+                results[index] = {"error": "提示词和续写都不能为空"}
+            elif len(prompt) + len(cont) - 1 > self.n_ctx:
+                results[index] = {"error": f"提示词与续写共 {len(prompt) + len(cont)} 个token，超出评分上下文长度 {self.n_ctx}"}
+            else:
+                valid.append((index, prompt, cont))
+
+        # 按提示词排序：相同提示词相邻，相邻提示词的公共前缀最长
+        valid.sort(key=lambda item: item[1])
+        i = 0
+        while i < len(valid):
+            prompt = valid[i][1]
+            j = i
+            while j < len(valid) and valid[j][1] == prompt:
+                j += 1
+            last_logits = self._eval_prefix(prompt)
+            self._score_group(len(prompt), last_logits, [(index, cont) for index, _, cont in valid[i:j]], results)
+            i = j
+
+        scored = []
+        for index in range(len(requests)):
+            result = results[index]
+            if "error" in result:
+                scored.append(result)
+                continue
+            logprobs = [float(lp) for lp in result["logprobs"]]
+            total = math.fsum(logprobs)
+            scored.append({
+                "logprob": total,
+                "n_tokens": len(logprobs),
+                "perplexity": math.exp(-total / len(logprobs)),
+                "is_greedy": result["greedy"],
+                "token_logprobs": logprobs
+            })
+        return scored
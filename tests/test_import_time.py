@@ -0,0 +1,48 @@
+"""
+CLI 启动开销测试 - list/pull/delete 等命令不应导入推理和下载后端
+
+llama_cpp（及其依赖的 numpy）只在加载模型时导入，huggingface_hub 只在查询仓库或下载文件时导入；
+在模块顶层导入它们会让每次命令行调用都多出数百毫秒。
+"""
+import os
+import sys
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 不应在 CLI 启动时导入的重量级模块
+HEAVY_MODULES = ("llama_cpp", "huggingface_hub", "numpy")
+# 导入耗时上限（毫秒，-X importtime 中各顶层模块的累计耗时之和，不含解释器启动）
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", 500))
+
+
+def _importtime(tmp_path):
+    """在临时目录中运行 `llm --local list`，返回 [(模块名, 嵌套层级, 累计耗时微秒)]"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", os.path.join(ROOT, "llm.py"), "--local", "list"],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+        timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        modules.append((name.strip(), depth, int(cumulative)))
+    return modules
+
+
+def test_cli_does_not_import_backends(tmp_path):
+    imported = {name.split(".")[0] for name, _, _ in _importtime(tmp_path)}
+    assert "model_manager" in imported
+    for module in HEAVY_MODULES:
+        assert module not in imported, f"llm list 导入了 {module}"
+
+
+def test_cli_import_time_budget(tmp_path):
+    total_ms = sum(cumulative for _, depth, cumulative in _importtime(tmp_path) if depth == 0) / 1000
+    assert total_ms < IMPORT_BUDGET_MS, f"导入耗时 {total_ms:.0f}ms 超过 {IMPORT_BUDGET_MS:.0f}ms"
@@ -0,0 +1,147 @@
+"""
+分词器模块 - 只加载GGUF中的词表，用于高频的token计数（如网关配额检查）
+
+与 InferenceEngine 中常驻的模型相互独立：不加载权重、不占用推理锁，
+模型是否已加载、正在推理或切换版本都不影响计数。
+"""
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import config
+from inference import _import_llama
+
+logger = logging.getLogger(__name__)
+
+
+class Tokenizer:
+    """
+    单个模型的只读词表分词器，带最近字符串的LRU缓存
+
+    Args:
+        model_path: GGUF模型文件路径
+        cache_size: 缓存的字符串条数
+        max_cached_chars: 超过该长度的字符串不缓存
+    """
+
+    def __init__(self, model_path: str, cache_size: int = 50000, max_cached_chars: int = 4096):
+        Llama = _import_llama()
+        # vocab_only 只读取GGUF元数据和词表，不映射权重、不创建推理上下文
+        self._vocab = Llama(model_path=model_path, vocab_only=True, verbose=False)
+        # add_bos 时额外增加的特殊token数（取决于词表的 add_bos/add_eos 设置，可能为0）
+        self._special_count = (
+            len(self._vocab.tokenize(b"", add_bos=True, special=True))
+            - len(self._vocab.tokenize(b"", add_bos=False, special=True))
+        )
+        self.model_path = model_path
+        self.cache_size = cache_size
+        self.max_cached_chars = max_cached_chars
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _tokenize_count(self, text: str, add_bos: bool) -> int:
+        return len(self._vocab.tokenize(text.encode("utf-8"), add_bos=add_bos, special=True))
+
+    def count_tokens(self, texts: List[str], add_bos: bool = True) -> List[int]:
+        """
+        批量计算token数
+
+        Args:
+            texts: 文本列表
+            add_bos: 是否计入BOS（与生成时的提示词计数方式一致）
+
+        Returns:
+            与 texts 一一对应的token数
+        """
+        counts: List[Optional[int]] = [None] * len(texts)
+        misses = []
+        # BOS 只影响计数的常数项，缓存中统一保存不带BOS的数量
+        bos = self._special_count if add_bos else 0
+
+        with self._lock:
+            for i, text in enumerate(texts):
+                count = self._cache.get(text)
+                if count is None:
+                    misses.append(i)
+                else:
+                    self._cache.move_to_end(text)
+                    counts[i] = count + bos
+            self.hits += len(texts) - len(misses)
+
+        if not misses:
+            return counts
+
+        # 分词在锁外进行：词表只读，llama.cpp 的分词可以并发调用
+        computed = {}
+        for i in misses:
+            text = texts[i]
+            count = computed.get(text)
+            if count is None:
+                count = computed[text] = self._tokenize_count(text, add_bos=False)
+            counts[i] = count + bos
+
+        with self._lock:
+            # 同一批中重复的文本只分词一次，记为命中
+            self.hits += len(misses) - len(computed)
+            self.misses += len(computed)
+            for text, count in computed.items():
+                if len(text) > self.max_cached_chars:
+                    continue
+                self._cache[text] = count
+                self._cache.move_to_end(text)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return counts
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"cached": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+class TokenizerPool:
+    """按模型路径管理分词器，首次使用时加载词表"""
+
+    def __init__(self, cache_size: Optional[int] = None, max_cached_chars: Optional[int] = None):
+        self.cache_size = cache_size or config.TOKENIZER_CACHE_SIZE
+        self.max_cached_chars = max_cached_chars or config.TOKENIZER_CACHE_MAX_CHARS
+        self._tokenizers: Dict[str, Tokenizer] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_path: str) -> Tokenizer:
+        """获取模型的分词器（不存在时加载词表）"""
+        tokenizer = self._tokenizers.get(model_path)
+        if tokenizer is not None:
+            return tokenizer
+        with self._lock:
+            tokenizer = self._tokenizers.get(model_path)
+            if tokenizer is None:
+                logger.info(f"正在加载词表: {model_path}")
+                tokenizer = Tokenizer(model_path, self.cache_size, self.max_cached_chars)
+                self._tokenizers[model_path] = tokenizer
+        return tokenizer
+
+    def count_tokens(self, model_path: str, texts: List[str], add_bos: bool = True) -> List[int]:
+        """批量计算token数"""
+        return self.get(model_path).count_tokens(texts, add_bos)
+
+    def drop(self, model_path: str):
+        """
+        移除模型的分词器（模型版本被替换或删除时调用）
+
+        不主动释放词表：进行中的计数可能仍持有引用，由最后一个引用释放
+        """
+        with self._lock:
+            self._tokenizers.pop(model_path, None)
+
+    def clear(self) -> int:
+        """移除全部分词器（内存压力下调用，下次计数时重新加载词表），返回移除的数量"""
+        with self._lock:
+            count = len(self._tokenizers)
+            self._tokenizers.clear()
+        return count
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {path: tokenizer.stats() for path, tokenizer in list(self._tokenizers.items())}
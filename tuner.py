@@ -0,0 +1,234 @@
+"""
+性能调优模块 - 在本机上测量不同线程数和批大小下的提示词评估与解码速度
+
+最优参数随主机（核心数、缓存、内存带宽）和模型量化方式变化：解码受内存带宽限制，
+线程数超过物理核心后通常变慢；提示词评估是计算密集的，能用满超线程和更大的批。
+调优结果按 (主机, 量化方式) 保存在模型信息中，加载模型时自动使用。
+"""
+import gc
+import re
+import time
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from inference import _import_llama
+from utils.hostinfo import cpu_info, host_id
+
+logger = logging.getLogger(__name__)
+
+# 调优结果中会应用到模型加载的参数
+TUNED_PARAMS = ("n_threads", "n_threads_batch", "n_batch", "n_ubatch")
+
+_QUANT_PATTERN = re.compile(r"(?:^|[-_.])(i?q\d(?:_[a-z0-9]+)*|bf16|f16|f32)(?=[-_.]|$)")
+
+# 用于构造提示词的文本（只测速度，内容无关）
+_FILLER = (
+    "The quick brown fox jumps over the lazy dog. 敏捷的棕色狐狸跳过了懒狗。"
+    "Performance depends on memory bandwidth, cache sizes and the number of cores. "
+)
+
+
+def gguf_quant(filename: str) -> str:
+    """从GGUF文件名中识别量化方式（如 q4_k_m、q8_0、f16），无法识别时返回文件名"""
+    name = filename.lower().rsplit("/", 1)[-1]
+    if name.endswith(".gguf"):
+        name = name[:-5]
+    matches = _QUANT_PATTERN.findall(name)
+    return matches[-1] if matches else name
+
+
+def tuning_key(model_info: Dict[str, Any]) -> str:
+    """调优结果在模型信息中的键：主机标识/量化方式"""
+    return f"{host_id()}/{gguf_quant(model_info.get('gguf_file') or model_info['path'])}"
+
+
+def thread_candidates(info: Optional[Dict[str, Any]] = None) -> List[int]:
+    """根据核心数生成候选线程数（物理核心附近以及全部逻辑核心）"""
+    info = info or cpu_info()
+    physical = max(1, info["physical_cores"])
+    logical = max(physical, info["logical_cores"])
+    candidates = {max(1, physical // 4), max(1, physical // 2), max(1, physical - 1), physical, logical}
+    return sorted(candidates)
+
+
+def batch_candidates(prompt_tokens: int) -> List[Tuple[int, int]]:
+    """生成候选 (n_batch, n_ubatch)，包括 llama.cpp 的默认值 (512, 512)"""
+    candidates = {(512, 512)}
+    for n_batch in (256, 512, 1024, 2048):
+        # 超过提示词长度的批不会被用满
+        if n_batch > max(prompt_tokens, 512):
+            continue
+        for n_ubatch in (128, 256, 512, 1024):
+            if n_ubatch <= n_batch:
+                candidates.add((n_batch, n_ubatch))
+    return sorted(candidates)
+
+
+class Tuner:
+    """
+    单个模型的调优器
+
+    Args:
+        model_path: GGUF模型文件路径
+        base_params: 基准加载参数（推理引擎的默认参数，调优只覆盖线程数和批大小）
+        prompt_tokens: 测量提示词评估时的提示词长度
+        decode_tokens: 测量解码时生成的token数
+        repeats: 每组参数重复测量的次数（取最好的一次）
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        base_params: Dict[str, Any],
+        prompt_tokens: int = 512,
+        decode_tokens: int = 64,
+        repeats: int = 2
+    ):
+        self.model_path = model_path
+        self.base_params = dict(base_params)
+        self.prompt_tokens = max(8, prompt_tokens)
+        self.decode_tokens = max(1, decode_tokens)
+        self.repeats = max(1, repeats)
+        self.measurements: List[Dict[str, Any]] = []
+        self._prompt_ids: Optional[List[int]] = None
+
+    def _prompt(self, llama_model) -> List[int]:
+        if self._prompt_ids is None:
+            ids = llama_model.tokenize(_FILLER.encode("utf-8"), add_bos=False)
+            ids = ids * (self.prompt_tokens // max(len(ids), 1) + 1)
+            self._prompt_ids = [llama_model.token_bos()] + ids[:self.prompt_tokens - 1]
+        return self._prompt_ids
+
+    def measure(self, **params) -> Dict[str, Any]:
+        """
+        用给定参数加载模型并测量速度
+
+        Returns:
+            {"params", "prompt_tps", "decode_tps"}，加载或推理失败时包含 error
+        """
+        load_params = dict(self.base_params)
+        load_params.update(params)
+        load_params["n_ctx"] = self.prompt_tokens + self.decode_tokens + 16
+        load_params["verbose"] = False
+        result: Dict[str, Any] = {"params": params}
+
+        Llama = _import_llama()
+        llama_model = None
+        try:
+            llama_model = Llama(**load_params)
+            prompt = self._prompt(llama_model)
+
+            # 预热：触发权重页的缺页加载，不计入测量
+            llama_model.reset()
+            llama_model.eval(prompt[:8])
+
+            prompt_s = decode_s = float("inf")
+            for _ in range(self.repeats):
+                llama_model.reset()
+                start = time.perf_counter()
+                llama_model.eval(prompt)
+                prompt_s = min(prompt_s, time.perf_counter() - start)
+
+                # 解码阶段每次只评估一个token，与生成时相同
+                start = time.perf_counter()
+                for i in range(self.decode_tokens):
+                    llama_model.eval([prompt[1 + i % (len(prompt) - 1)]])
+                decode_s = min(decode_s, time.perf_counter() - start)
+
+            result["prompt_tps"] = round(len(prompt) / prompt_s, 2)
+            result["decode_tps"] = round(self.decode_tokens / decode_s, 2)
+        except Exception as e:
+            logger.warning(f"调优参数 {params} 测量失败: {str(e)}")
+            result["error"] = str(e)
+        finally:
+            if llama_model is not None:
+                close = getattr(llama_model, "close", None)
+                if close is not None:
+                    close()
+                del llama_model
+                gc.collect()
+
+        self.measurements.append(result)
+        return result
+
+    def run(
+        self,
+        threads: Optional[List[int]] = None,
+        batches: Optional[List[Tuple[int, int]]] = None,
+        progress: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        调优：先选线程数，再在最优线程数下选批大小
+
+        解码和提示词评估的最优线程数分别选取（n_threads / n_threads_batch），
+        批大小只影响提示词评估，按提示词评估速度选取。
+
+        Args:
+            threads: 候选线程数，None 时按核心数生成
+            batches: 候选 (n_batch, n_ubatch)，None 时按提示词长度生成
+            progress: 每完成一组测量调用一次
+
+        Returns:
+            调优结果（params 为应用到模型加载的参数）
+        """
+        base_threads = self.base_params.get("n_threads")
+        threads = sorted(set(threads or thread_candidates()) | ({base_threads} if base_threads else set()))
+        batches = sorted(set(batches or batch_candidates(self.prompt_tokens)))
+
+        def record(measurement):
+            if progress is not None:
+                progress(measurement)
+            return measurement
+
+        # 第一阶段：线程数（使用默认批大小）
+        by_threads = []
+        for n in threads:
+            measurement = record(self.measure(n_threads=n, n_threads_batch=n))
+            if "error" not in measurement:
+                by_threads.append((n, measurement))
+        if not by_threads:
+            raise RuntimeError("所有候选线程数的测量都失败了")
+        baseline = next((m for n, m in by_threads if n == base_threads), by_threads[-1][1])
+        decode_threads = max(by_threads, key=lambda item: item[1]["decode_tps"])[0]
+        batch_threads = max(by_threads, key=lambda item: item[1]["prompt_tps"])[0]
+
+        # 第二阶段：批大小
+        best = None
+        for n_batch, n_ubatch in batches:
+            measurement = record(self.measure(
+                n_threads=decode_threads,
+                n_threads_batch=batch_threads,
+                n_batch=n_batch,
+                n_ubatch=n_ubatch
+            ))
+            if "error" in measurement:
+                continue
+            if best is None or measurement["prompt_tps"] > best["prompt_tps"]:
+                best = measurement
+        if best is None:
+            raise RuntimeError("所有候选批大小的测量都失败了")
+
+        info = cpu_info()
+        return {
+            "host_id": host_id(),
+            "quant": gguf_quant(self.model_path),
+            "cpu": {
+                "model": info["model"],
+                "physical_cores": info["physical_cores"],
+                "logical_cores": info["logical_cores"],
+                "flags": info["flags"],
+                "caches": info["caches"]
+            },
+            "params": {key: best["params"][key] for key in TUNED_PARAMS if key in best["params"]},
+            "prompt_tps": best["prompt_tps"],
+            "decode_tps": dict(by_threads)[decode_threads]["decode_tps"],
+            "baseline": {
+                "params": baseline["params"],
+                "prompt_tps": baseline["prompt_tps"],
+                "decode_tps": baseline["decode_tps"]
+            },
+            "prompt_tokens": self.prompt_tokens,
+            "decode_tokens": self.decode_tokens,
+            "tuned_at": time.time(),
+            "measurements": self.measurements
+        }
@@ -0,0 +1,598 @@
+"""
+压测工具模块 - 回放请求记录或按合成分布向服务发压，统计首token延迟、token间隔、吞吐和错误率
+
+请求记录为JSONL，每行一个请求:
+    {"endpoint": "generate", "prompt": "...", "max_tokens": 64, "offset": 0.5}
+    {"endpoint": "chat", "messages": [{"role": "user", "content": "..."}], "stream": true}
+
+endpoint 为 generate 或 chat（默认 generate）；offset 为相对压测开始的发送时间（秒，可选）；
+model_name 缺省时使用命令行指定的模型；其余字段原样作为请求参数。
+"""
+import json
+import math
+import time
+import timeit
+import random
+import shutil
+import socket
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple
+
+from inference import InferenceEngine
+from utils.tracing import current_trace
+
+logger = logging.getLogger(__name__)
+
+FAKE_MODEL_NAME = "bench/fake-model"
+
+# 请求中不作为额外参数透传的字段
+_META_FIELDS = ("endpoint", "offset", "model_name", "prompt", "messages", "max_tokens", "temperature", "stream")
+
+# 合成提示词使用的词表（约每个词一个token）
+_WORDS = ("the", "model", "server", "token", "cache", "request", "latency", "stream", "prompt", "reply")
+
+
+# ---------------------------------------------------------------------------
+# 模拟推理后端
+# ---------------------------------------------------------------------------
+
+def _sleep_ms(ms: float):
+    """模拟计算耗时；为0时不调用 sleep（微基准中 sleep(0) 本身的开销远大于被测代码）"""
+    if ms > 0:
+        time.sleep(ms / 1000)
+
+
+class FakeLlama:
+    """
+    模拟 llama_cpp.Llama 的推理接口，按token数休眠来模拟计算耗时
+
+    Args:
+        prompt_ms: 每个提示词token的评估耗时（毫秒）
+        decode_ms: 每个生成token的耗时（毫秒）
+    """
+
+    ctx = None
+    model = None
+
+    def __init__(self, prompt_ms: float = 0.05, decode_ms: float = 2.0):
+        self.prompt_ms = prompt_ms
+        self.decode_ms = decode_ms
+        # 上下文中已评估的token数（与 Llama 相同：每个token在取下一个token时才被评估）
+        self.n_tokens = 0
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        return list(range(len(text) // 4 + 1))
+
+    def token_bos(self) -> int:
+        return 1
+
+    def reset(self):
+        pass
+
+    def __call__(self, prompt, max_tokens: int = 16, stream: bool = False, **kwargs):
+        n_prompt = len(prompt) if isinstance(prompt, list) else len(self.tokenize(prompt.encode("utf-8")))
+        if stream:
+            return self._stream_completion(n_prompt, max_tokens)
+        time.sleep((n_prompt * self.prompt_ms + max_tokens * self.decode_ms) / 1000)
+        return {
+            "choices": [{"text": "tok " * max_tokens, "finish_reason": "length"}],
+            "usage": {
+                "prompt_tokens": n_prompt,
+                "completion_tokens": max_tokens,
+                "total_tokens": n_prompt + max_tokens
+            }
+        }
+
+    def _stream_completion(self, n_prompt: int, max_tokens: int):
+        _sleep_ms(n_prompt * self.prompt_ms)
+        for i in range(max_tokens):
+            _sleep_ms(self.decode_ms)
+            self.n_tokens = n_prompt + i
+            yield {"choices": [{"text": "tok ", "finish_reason": None}]}
+        yield {"choices": [{"text": "", "finish_reason": "length"}]}
+
+    def create_chat_completion(self, messages: List[Dict[str, str]], max_tokens: int = 16, stream: bool = False, **kwargs):
+        text = "".join(m.get("content", "") for m in messages)
+        n_prompt = len(self.tokenize(text.encode("utf-8")))
+        if not stream:
+            time.sleep((n_prompt * self.prompt_ms + max_tokens * self.decode_ms) / 1000)
+            return {
+                "choices": [{"message": {"role": "assistant", "content": "tok " * max_tokens}, "finish_reason": "length"}],
+                "usage": {
+                    "prompt_tokens": n_prompt,
+                    "completion_tokens": max_tokens,
+                    "total_tokens": n_prompt + max_tokens
+                }
+            }
+        return self._stream(n_prompt, max_tokens)
+
+    def _stream(self, n_prompt: int, max_tokens: int):
+        _sleep_ms(n_prompt * self.prompt_ms)
+        yield {"choices": [{"delta": {"role": "assistant"}, "finish_reason": None}]}
+        for _ in range(max_tokens):
+            _sleep_ms(self.decode_ms)
+            yield {"choices": [{"delta": {"content": "tok "}, "finish_reason": None}]}
+        yield {"choices": [{"delta": {}, "finish_reason": "length"}]}
+
+
+class FakeInferenceEngine(InferenceEngine):
+    """使用 FakeLlama 的推理引擎，不加载任何权重，用于压测服务本身的开销"""
+
+    def __init__(self, prompt_ms: float = 0.05, decode_ms: float = 2.0):
+        super().__init__()
+        self.prompt_ms = prompt_ms
+        self.decode_ms = decode_ms
+
+    def _load_model(self, model_path: str, **kwargs) -> bool:
+        self.loaded_models[model_path] = self._model_entry(
+            model_path,
+            FakeLlama(self.prompt_ms, self.decode_ms),
+            {"model_path": model_path, "n_ctx": self.n_ctx, "fake": True},
+            stop=[]
+        )
+        return True
+
+    @contextmanager
+    def _inference_span(self, llama_model):
+        trace = current_trace()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if trace is not None:
+                trace.add_span("inference", trace.offset_ms(start), (time.perf_counter() - start) * 1000)
+
+
+@contextmanager
+def inprocess_server(prompt_ms: float = 0.05, decode_ms: float = 2.0):
+    """
+    在当前进程的后台线程中启动API服务，推理后端替换为 FakeInferenceEngine
+
+    Yields:
+        (host, port)，其中已注册名为 FAKE_MODEL_NAME 的模型
+    """
+    import uvicorn
+    import main
+    from model_manager import get_model_manager
+    from utils.download import ModelDownloader
+
+    models_dir = tempfile.mkdtemp(prefix="llm-bench-")
+    model_dir = Path(models_dir) / FAKE_MODEL_NAME.replace("/", "_")
+    model_dir.mkdir()
+    model_path = model_dir / "fake-model.gguf"
+    # check_file_status 认为小于1KB的文件不完整
+    model_path.write_bytes(b"GGUF" + b"\0" * 4092)
+
+    downloader = ModelDownloader(models_dir)
+    downloader.promote_version(FAKE_MODEL_NAME, {
+        "name": FAKE_MODEL_NAME,
+        "type": "gguf",
+        "path": str(model_path),
+        "status": "ready",
+        "version": 1
+    })
+
+    # API路由在导入时已绑定共享的模型管理器，这里临时替换它的模型目录和推理引擎
+    manager = get_model_manager()
+    previous = (manager.downloader, manager._inference_engine)
+    manager.downloader = downloader
+    manager._inference_engine = FakeInferenceEngine(prompt_ms, decode_ms)
+    inference_level = logging.getLogger("inference").level
+    logging.getLogger("inference").setLevel(logging.WARNING)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    host, port = sock.getsockname()
+    server = uvicorn.Server(uvicorn.Config(main.app, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    try:
+        deadline = time.monotonic() + 10
+        while not server.started:
+            if not thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError("进程内服务启动失败")
+            time.sleep(0.01)
+        yield host, port
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+        sock.close()
+        manager.downloader, manager._inference_engine = previous
+        logging.getLogger("inference").setLevel(inference_level)
+        shutil.rmtree(models_dir, ignore_errors=True)
+
+
+# ---------------------------------------------------------------------------
+# 请求负载
+# ---------------------------------------------------------------------------
+
+def load_workload(path: str) -> List[Dict[str, Any]]:
+    """读取JSONL请求记录（跳过空行和 # 开头的注释行）"""
+    workload = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path} 第{line_no}行不是有效的JSON: {str(e)}")
+            item.setdefault("endpoint", "generate")
+            if item["endpoint"] not in ("generate", "chat"):
+                raise ValueError(f"{path} 第{line_no}行: 不支持的 endpoint {item['endpoint']}")
+            workload.append(item)
+    return workload
+
+
+def parse_range(value: str) -> Tuple[int, int]:
+    """解析 "16:256" 或 "64" 形式的取值范围"""
+    low, _, high = value.partition(":")
+    low_value = int(low)
+    high_value = int(high) if high else low_value
+    if low_value < 1 or high_value < low_value:
+        raise ValueError(f"无效的范围: {value}")
+    return low_value, high_value
+
+
+def synthetic_workload(
+    count: int,
+    prompt_tokens: Tuple[int, int] = (16, 256),
+    max_tokens: Tuple[int, int] = (16, 128),
+    chat_ratio: float = 0.5,
+    stream_ratio: float = 1.0,
+    seed: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    按分布生成请求
+
+    Args:
+        count: 请求数量
+        prompt_tokens: 提示词长度范围（约等于token数）
+        max_tokens: 生成长度范围
+        chat_ratio: 聊天请求所占比例，其余为 /generate
+        stream_ratio: 聊天请求中使用流式的比例
+        seed: 随机种子，相同种子生成相同的负载
+    """
+    rng = random.Random(seed)
+    workload = []
+    for _ in range(count):
+        prompt = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(*prompt_tokens)))
+        item: Dict[str, Any] = {"max_tokens": rng.randint(*max_tokens)}
+        if rng.random() < chat_ratio:
+            item["endpoint"] = "chat"
+            item["messages"] = [{"role": "user", "content": prompt}]
+            item["stream"] = rng.random() < stream_ratio
+        else:
+            item["endpoint"] = "generate"
+            item["prompt"] = prompt
+        workload.append(item)
+    return workload
+
+
+def schedule(workload: List[Dict[str, Any]], rate: Optional[float] = None, seed: Optional[int] = None) -> List[float]:
+    """
+    计算每个请求的发送时间（相对开始的秒数）
+
+    指定 rate 时按泊松到达（平均每秒 rate 个）；否则使用记录中的 offset，
+    没有 offset 的请求立即发送（由并发数限流）。
+    """
+    if rate:
+        rng = random.Random(seed)
+        offsets, t = [], 0.0
+        for _ in workload:
+            offsets.append(t)
+            t += rng.expovariate(rate)
+        return offsets
+    return [float(item.get("offset") or 0.0) for item in workload]
+
+
+# ---------------------------------------------------------------------------
+# 执行与统计
+# ---------------------------------------------------------------------------
+
+def _run_request(client, item: Dict[str, Any], model_name: str) -> Dict[str, Any]:
+    """发送一个请求并记录各项耗时（毫秒）"""
+    model = item.get("model_name") or model_name
+    extra = {k: v for k, v in item.items() if k not in _META_FIELDS}
+    max_tokens = item.get("max_tokens", 64)
+    temperature = item.get("temperature", 0.7)
+    record: Dict[str, Any] = {"endpoint": item["endpoint"], "stream": bool(item.get("stream"))}
+
+    start = time.perf_counter()
+    try:
+        if item["endpoint"] == "chat" and item.get("stream"):
+            token_times = []
+            result: Dict[str, Any] = {}
+            for frame in client.chat_completion_stream(model, item["messages"], max_tokens, temperature, **extra):
+                if frame.get("error"):
+                    result = frame
+                    break
+                if frame.get("content"):
+                    token_times.append(time.perf_counter())
+            end = time.perf_counter()
+            record["tokens"] = len(token_times)
+            if token_times:
+                record["ttft_ms"] = (token_times[0] - start) * 1000
+                record["itl_ms"] = [(b - a) * 1000 for a, b in zip(token_times, token_times[1:])]
+        else:
+            if item["endpoint"] == "chat":
+                result = client.chat_completion(model, item["messages"], max_tokens, temperature, **extra)
+            else:
+                result = client.generate_text(model, item.get("prompt", ""), max_tokens, temperature, **extra)
+            end = time.perf_counter()
+            # 非流式请求的首token时间即完整响应时间
+            record["ttft_ms"] = (end - start) * 1000
+            record["tokens"] = (result.get("usage") or {}).get("completion_tokens", 0)
+    except Exception as e:
+        end = time.perf_counter()
+        result = {"error": f"{type(e).__name__}: {str(e)}"}
+        client.close()
+
+    record["latency_ms"] = (end - start) * 1000
+    if result.get("error"):
+        record["error"] = str(result["error"])
+        record["tokens"] = 0
+    return record
+
+
+def run_bench(
+    workload: List[Dict[str, Any]],
+    offsets: List[float],
+    model_name: str,
+    concurrency: int = 4,
+    host: Optional[str] = None,
+    port: Optional[int] = None,
+    socket_path: Optional[str] = None,
+    timeout: Optional[float] = None
+) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    按发送时间执行请求，每个并发线程复用一条 keep-alive 连接
+
+    Returns:
+        (每个请求的记录, 总耗时秒数)
+    """
+    from client import RemoteModelManager
+
+    local = threading.local()
+    clients = []
+    clients_lock = threading.Lock()
+
+    def worker(item: Dict[str, Any], scheduled: float) -> Dict[str, Any]:
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = RemoteModelManager(host, port, socket_path, timeout)
+            with clients_lock:
+                clients.append(client)
+        record = _run_request(client, item, model_name)
+        # 开环压测时请求可能因并发已满而晚于计划时间发送
+        record["lag_ms"] = max((time.perf_counter() - t0) * 1000 - record["latency_ms"] - scheduled * 1000, 0.0)
+        return record
+
+    order = sorted(range(len(workload)), key=lambda i: offsets[i])
+    futures = [None] * len(workload)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        t0 = time.perf_counter()
+        for i in order:
+            delay = offsets[i] - (time.perf_counter() - t0)
+            if delay > 0:
+                time.sleep(delay)
+            futures[i] = executor.submit(worker, workload[i], offsets[i])
+        results = [f.result() for f in futures]
+        elapsed = time.perf_counter() - t0
+
+    for client in clients:
+        client.close()
+    return results, elapsed
+
+
+def _percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+    if not values:
+        return None
+    values = sorted(values)
+
+    def pick(q: float) -> float:
+        # 线性插值
+        pos = (len(values) - 1) * q
+        low = math.floor(pos)
+        high = min(low + 1, len(values) - 1)
+        return values[low] + (values[high] - values[low]) * (pos - low)
+
+    return {
+        "p50": round(pick(0.5), 3),
+        "p90": round(pick(0.9), 3),
+        "p99": round(pick(0.99), 3),
+        "mean": round(sum(values) / len(values), 3),
+        "max": round(values[-1], 3)
+    }
+
+
+def summarize(results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    """汇总压测结果"""
+    ok = [r for r in results if "error" not in r]
+    errors = [r for r in results if "error" in r]
+    tokens = sum(r.get("tokens", 0) for r in ok)
+    itl = [v for r in ok for v in r.get("itl_ms", ())]
+
+    error_counts: Dict[str, int] = {}
+    for r in errors:
+        error_counts[r["error"]] = error_counts.get(r["error"], 0) + 1
+
+    return {
+        "requests": len(results),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(results), 4) if results else 0.0,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "tokens_per_s": round(tokens / elapsed, 3) if elapsed else 0.0,
+        "ttft_ms": _percentiles([r["ttft_ms"] for r in ok if "ttft_ms" in r]),
+        "itl_ms": _percentiles(itl),
+        "latency_ms": _percentiles([r["latency_ms"] for r in ok]),
+        "lag_ms": _percentiles([r["lag_ms"] for r in results]),
+        "error_types": error_counts
+    }
+
+
+def save_results(path: str, settings: Dict[str, Any], summary: Dict[str, Any], results: List[Dict[str, Any]]):
+    """保存压测结果（JSON），用于之后对比"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "created_at": time.time(),
+            "settings": settings,
+            "summary": summary,
+            "results": results
+        }, f, ensure_ascii=False, indent=2)
+
+
+def compare_summaries(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[Tuple[str, float, float, float]]:
+    """
+    对比两次压测的汇总
+
+    Returns:
+        [(指标名, 基准值, 当前值, 变化百分比)]，基准值为0的指标变化记为0
+    """
+    rows = []
+    for key in ("throughput_rps", "tokens_per_s", "error_rate"):
+        rows.append((key, baseline.get(key) or 0.0, current.get(key) or 0.0))
+    for key in ("ttft_ms", "itl_ms", "latency_ms"):
+        for q in ("p50", "p90", "p99"):
+            old = (baseline.get(key) or {}).get(q)
+            new = (current.get(key) or {}).get(q)
+            if old is not None and new is not None:
+                rows.append((f"{key}.{q}", old, new))
+    return [
+        (name, old, new, round((new - old) / old * 100, 2) if old else 0.0)
+        for name, old, new in rows
+    ]
+
+
+# ---------------------------------------------------------------------------
+# 微基准（llm bench --micro），与改动前的实现对比单项开销
+# ---------------------------------------------------------------------------
+
+def _best_us(fn, repeat: int = 5) -> float:
+    """fn 单次调用的最短耗时（微秒），按自动确定的次数重复取最好的一轮"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number * 1e6
+
+
+def _legacy_dumps(obj: Any) -> bytes:
+    """改用 orjson 之前的编码：Starlette JSONResponse 的标准库 json"""
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def _legacy_dumps_line(obj: Any) -> bytes:
+    """改用 orjson 之前的流式行编码（默认分隔符）"""
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def serialization_microbench(prompt_chars: int = 2048, stream_tokens: int = 1000, repeat: int = 5) -> List[Dict[str, Any]]:
+    """
+    响应编码开销：每个响应的字节数和编码耗时（CPU），旧实现为标准库 json 且流式每帧带 full_response
+
+    Args:
+        prompt_chars: /generate 回显的提示词长度（字符）
+        stream_tokens: 流式聊天的片段数
+        repeat: 计时重复轮数
+
+    Returns:
+        [{"case", "legacy_bytes", "bytes", "legacy_us", "us"}]
+    """
+    from utils.serialization import dumps, dumps_line
+
+    text = "生成的文本 tok " * 32
+    full = {
+        "success": True,
+        "generated_text": text,
+        "model_name": FAKE_MODEL_NAME,
+        "usage": {"prompt_tokens": prompt_chars // 4, "completion_tokens": 128, "total_tokens": prompt_chars // 4 + 128},
+        "choices": [{"text": text, "finish_reason": "length", "usage": {"completion_tokens": 128}}],
+        "prompt": ("提示词 prompt " * prompt_chars)[:prompt_chars],
+        "parameters": {"max_tokens": 128, "temperature": 0.7, "top_p": 0.9, "top_k": 40, "repeat_penalty": 1.1, "n": 1}
+    }
+    compact = {key: full[key] for key in ("success", "generated_text", "model_name", "usage")}
+
+    piece = "tok "
+    legacy_frames = [
+        {"success": True, "content": piece, "full_response": piece * (i + 1), "finish_reason": None, "model_name": FAKE_MODEL_NAME}
+        for i in range(stream_tokens)
+    ]
+    frames = [
+        {"success": True, "content": piece, "finish_reason": None, "model_name": FAKE_MODEL_NAME}
+        for _ in range(stream_tokens)
+    ]
+    final = {"success": True, "content": "", "full_response": piece * stream_tokens, "finish_reason": "length",
+             "done": True, "model_name": FAKE_MODEL_NAME}
+    legacy_frames.append(final)
+    frames.append(final)
+
+    def encode_stream(encode, items):
+        return sum(len(encode(item)) for item in items)
+
+    cases = (
+        ("generate", lambda: _legacy_dumps(full), lambda: dumps(full)),
+        ("generate_compact", lambda: _legacy_dumps(full), lambda: dumps(compact)),
+        (f"chat_stream_{stream_tokens}", lambda: encode_stream(_legacy_dumps_line, legacy_frames),
+         lambda: encode_stream(dumps_line, frames)),
+    )
+    rows = []
+    for name, legacy, current in cases:
+        legacy_bytes, current_bytes = legacy(), current()
+        rows.append({
+            "case": name,
+            "legacy_bytes": legacy_bytes if isinstance(legacy_bytes, int) else len(legacy_bytes),
+            "bytes": current_bytes if isinstance(current_bytes, int) else len(current_bytes),
+            "legacy_us": round(_best_us(legacy, repeat), 2),
+            "us": round(_best_us(current, repeat), 2)
+        })
+    return rows
+
+
+def stream_microbench(tokens: int = 4000, repeat: int = 5) -> List[Dict[str, Any]]:
+    """
+    流式聊天每个token在服务内的开销（微秒）：模拟后端不休眠，扣除模拟后端自身的耗时
+
+    Args:
+        tokens: 每次流式生成的token数
+        repeat: 计时重复轮数
+
+    Returns:
+        [{"case", "us_per_token"}]：模拟后端本身、引擎（停止词匹配、组帧）、引擎加NDJSON编码
+    """
+    from utils.serialization import dumps_line
+
+    level = logging.getLogger("inference").level
+    logging.getLogger("inference").setLevel(logging.WARNING)
+    engine = FakeInferenceEngine(prompt_ms=0.0, decode_ms=0.0)
+    model_path = "bench-fake-model.gguf"
+    engine.load_model(model_path)
+    llama = engine.loaded_models[model_path]["model"]
+    messages = [{"role": "user", "content": "hello"}]
+
+    def raw():
+        for _ in llama.create_chat_completion(messages, max_tokens=tokens, stream=True):
+            pass
+
+    def engine_only():
+        for _ in engine.chat_completion_stream(model_path, messages, max_tokens=tokens):
+            pass
+
+    def engine_encode():
+        for frame in engine.chat_completion_stream(model_path, messages, max_tokens=tokens):
+            dumps_line(frame)
+
+    try:
+        baseline = _best_us(raw, repeat)
+        rows = [{"case": "fake_llama", "us_per_token": round(baseline / tokens, 3)}]
+        for name, fn in (("engine", engine_only), ("engine+encode", engine_encode)):
+            rows.append({"case": name, "us_per_token": round((_best_us(fn, repeat) - baseline) / tokens, 3)})
+    finally:
+        logging.getLogger("inference").setLevel(level)
+    return rows
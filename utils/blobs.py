@@ -0,0 +1,154 @@
+"""
+内容寻址的模型文件存储 - 文件按 SHA-256 命名，相同内容只存一份
+
+模型目录中的 GGUF 文件是指向 blobs/sha256-<hex> 的硬链接（不支持时依次尝试
+reflink 和复制），因此现有按路径加载、mmap 共享页缓存的逻辑都不受影响。
+blob 的引用来自模型信息中的 digest 字段以及模型目录中的硬链接，两者都没有时才会被回收。
+"""
+import os
+import shutil
+import hashlib
+import logging
+from pathlib import Path
+from typing import Iterable, Optional, Dict
+
+logger = logging.getLogger(__name__)
+
+# Linux FICLONE ioctl（btrfs/xfs 等支持写时复制的文件系统）
+_FICLONE = 0x40049409
+
+
+def file_sha256(path: str, chunk_size: int = 4 * 1024 * 1024) -> str:
+    """计算文件的 SHA-256（十六进制）"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _reflink(src: str, dst: str) -> bool:
+    """尝试写时复制克隆文件，不支持时返回False"""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+
+
+def link_file(src: str, dst: str) -> str:
+    """
+    让 dst 与 src 共享内容：优先硬链接，其次 reflink，最后复制
+
+    Returns:
+        使用的方式（hardlink/reflink/copy）
+    """
+    Path(dst).parent.mkdir(parents=True, exist_ok=True)
+    tmp = f"{dst}.linking"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+        method = "hardlink"
+    except OSError:
+        if _reflink(src, tmp):
+            method = "reflink"
+        else:
+            shutil.copyfile(src, tmp)
+            method = "copy"
+    os.replace(tmp, dst)
+    return method
+
+
+class BlobStore:
+    """按内容哈希存放模型文件"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, digest: str) -> Path:
+        """blob 文件路径（digest 形如 sha256:<hex>）"""
+        return self.root / digest.replace(":", "-")
+
+    def has(self, digest: str) -> bool:
+        return self.path(digest).exists()
+
+    def link(self, digest: str, dest: str) -> str:
+        """把已有 blob 放到模型目录中"""
+        return link_file(str(self.path(digest)), dest)
+
+    def ingest(self, file_path: str, expected: Optional[str] = None, verified: bool = False) -> str:
+        """
+        把模型目录中的文件纳入存储：计算哈希，内容已存在时改为链接到已有 blob
+
+        Args:
+            file_path: 文件路径
+            expected: 期望的 digest（来自远端元数据），不一致时抛出异常
+            verified: 传输时已按 expected 校验过，不再重新计算哈希
+
+        Returns:
+            digest
+        """
+        if verified and expected:
+            digest = expected
+        else:
+            digest = f"sha256:{file_sha256(file_path)}"
+        if expected and expected != digest:
+            raise ValueError(f"文件校验失败: 期望 {expected}，实际 {digest}")
+
+        blob = self.path(digest)
+        if blob.exists():
+            if not os.path.samefile(blob, file_path):
+                method = link_file(str(blob), file_path)
+                logger.info(f"内容已存在，复用 {digest[:19]} ({method})")
+        else:
+            try:
+                os.link(file_path, blob)
+            except OSError:
+                # 不支持硬链接时，blob 另存一份（reflink 时不额外占用空间）
+                link_file(file_path, str(blob))
+        return digest
+
+    def size(self, digest: str) -> int:
+        try:
+            return self.path(digest).stat().st_size
+        except OSError:
+            return 0
+
+    def usage(self) -> int:
+        """所有 blob 占用的字节数"""
+        return sum(p.stat().st_size for p in self.root.iterdir() if p.is_file())
+
+    def collect(self, referenced: Iterable[str]) -> Dict[str, int]:
+        """
+        回收没有被引用的 blob
+
+        Args:
+            referenced: 模型信息中仍在使用的 digest
+
+        Returns:
+            {"removed": 数量, "freed_bytes": 字节数}
+        """
+        keep = {self.path(d).name for d in referenced}
+        removed = freed = 0
+        for blob in self.root.iterdir():
+            if not blob.is_file() or blob.name in keep:
+                continue
+            stat = blob.stat()
+            # 仍有模型目录中的硬链接（如正在预热、尚未切换的新版本）时保留
+            if stat.st_nlink > 1:
+                continue
+            blob.unlink()
+            removed += 1
+            freed += stat.st_size
+        if removed:
+            logger.info(f"回收 {removed} 个未引用的blob，释放 {freed / 1024 / 1024:.1f} MB")
+        return {"removed": removed, "freed_bytes": freed}
@@ -3,24 +3,39 @@
 """
 import os
 import json
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, Dict, Any, List
-from tqdm import tqdm
-import requests
-from huggingface_hub import hf_hub_download, list_repo_files
+from typing import Optional, Dict, Any, List, Tuple
 import logging
 
+import config
+from utils.blobs import BlobStore
+from utils.filelock import file_lock
+from utils.sources import ModelSource, parse_sources, fetch_order
+from utils.usage import UsageStore
+
 logger = logging.getLogger(__name__)
 
 
 class ModelDownloader:
     """GGUF模型下载器"""
     
-    def __init__(self, models_dir: str = "models"):
+    def __init__(self, models_dir: str = "models", sources: Optional[List[ModelSource]] = None):
         self.models_dir = Path(models_dir)
         self.models_dir.mkdir(exist_ok=True)
         self.models_info_file = self.models_dir / "models_info.json"
-        self.models_info = self._load_models_info()
+        # 多个工作进程共用模型信息文件：修改在文件锁下重新读取后进行，文件变化后读取时重新加载
+        self._models_info_lock = self.models_dir / "models_info.lock"
+        self._models_info_stamp = None
+        self.models_info: Dict[str, Any] = {}
+        self._refresh_models_info()
+        # 模型文件按内容存放，模型目录中的文件是指向 blob 的链接
+        self.blobs = BlobStore(self.models_dir / "blobs")
+        # 模型来源，按顺序回退（Hub、本地目录/NFS、局域网内的其他实例）
+        self.sources = sources if sources is not None else parse_sources(config.MODEL_SOURCES)
+        # 各模型的请求统计，单独存放，由 save_usage 定期合并写入
+        self.usage = UsageStore(self.models_dir / "usage.json")
     
     def _load_models_info(self) -> Dict[str, Any]:
         """加载模型信息"""
@@ -29,20 +44,78 @@ class ModelDownloader:
                 return json.load(f)
         return {}
     
+    def _refresh_models_info(self):
+        """模型信息文件被（其他工作进程）改写后重新加载，保留本进程内存中较新的 last_used"""
+        try:
+            st = os.stat(self.models_info_file)
+            stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            stamp = None
+        if stamp == self._models_info_stamp:
+            return
+        models_info = self._load_models_info()
+        for model_name, model_info in models_info.items():
+            current = self.models_info.get(model_name)
+            if current and current.get("path") == model_info.get("path"):
+                model_info["last_used"] = max(model_info.get("last_used", 0), current.get("last_used", 0))
+        self.models_info = models_info
+        self._models_info_stamp = stamp
+    
     def _save_models_info(self):
-        """保存模型信息"""
-        with open(self.models_info_file, 'w', encoding='utf-8') as f:
+        """保存模型信息（先写临时文件再替换，避免读到写了一半的文件；调用方持有文件锁）"""
+        tmp_file = self.models_info_file.with_suffix(f".json.{os.getpid()}.tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             json.dump(self.models_info, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.models_info_file)
+        st = os.stat(self.models_info_file)
+        self._models_info_stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
     
-    def _find_gguf_files(self, repo_id: str) -> List[str]:
-        """查找仓库中的GGUF文件"""
-        try:
-            files = list_repo_files(repo_id)
-            gguf_files = [f for f in files if f.endswith('.gguf')]
-            return gguf_files
-        except Exception as e:
-            logger.error(f"查找GGUF文件失败: {str(e)}")
-            return []
+    @contextmanager
+    def _editing_models_info(self):
+        """在文件锁下加载最新的模型信息，修改后写回（不会覆盖其他工作进程的修改）"""
+        with file_lock(self._models_info_lock):
+            self._refresh_models_info()
+            yield self.models_info
+            self._save_models_info()
+    
+    def _find_gguf_files(self, repo_id: str) -> Tuple[List[str], Optional[ModelSource]]:
+        """
+        查找仓库中的GGUF文件（使用第一个有该仓库的来源）
+        
+        Returns:
+            (文件列表, 提供文件列表的来源)
+        """
+        for source in self.sources:
+            files = source.list_files(repo_id)
+            if files:
+                return files, source
+        return [], None
+    
+    def _remote_sha256(self, repo_id: str, filename: str, first: Optional[ModelSource] = None) -> Optional[str]:
+        """查询文件的 SHA-256（优先询问提供文件列表的来源），都不知道时返回None"""
+        sources = [first] + [s for s in self.sources if s is not first] if first else self.sources
+        for source in sources:
+            digest = source.sha256(repo_id, filename)
+            if digest:
+                return digest
+        return None
+    
+    def _fetch(self, repo_id: str, filename: str, digest: Optional[str], dest: str) -> Optional[str]:
+        """
+        依次尝试各来源获取文件
+        
+        Returns:
+            传输过程中已校验的 digest，未校验时为None
+        """
+        errors = []
+        for source in fetch_order(self.sources, digest):
+            try:
+                print(f"正在从 {source.name} 获取 {filename}...")
+                return source.fetch(repo_id, filename, digest, dest)
+            except Exception as e:
+                logger.warning(f"从 {source.name} 获取 {filename} 失败: {str(e)}")
+                errors.append(f"{source.name}: {str(e)}")
+        raise RuntimeError("所有模型来源都获取失败: " + "; ".join(errors or ["没有可用的来源"]))
     
     def _select_best_gguf_file(self, gguf_files: List[str]) -> str:
         """选择最佳的GGUF文件"""
@@ -60,13 +133,22 @@ class ModelDownloader:
         # 如果没有找到优先级文件，返回第一个
         return gguf_files[0]
     
-    def download_model(self, model_name: str, model_type: str = "auto") -> Dict[str, Any]:
+    def download_model(
+        self,
+        model_name: str,
+        model_type: str = "auto",
+        new_version: bool = False,
+        base_model: Optional[str] = None
+    ) -> Dict[str, Any]:
         """
         下载GGUF格式模型
         
         Args:
             model_name: 模型名称（Hugging Face Hub格式）
-            model_type: 模型类型（auto, text-generation等）
+            model_type: 模型类型（auto, text-generation等；lora 表示LoRA适配器）
+            new_version: 模型已存在时下载一个新版本到独立目录。新版本不会写入
+                模型信息，需调用 promote_version 切换
+            base_model: LoRA适配器对应的基础模型名称
             
         Returns:
             模型信息字典
@@ -74,16 +156,22 @@ class ModelDownloader:
         print(f"开始下载GGUF模型: {model_name}")
         
         # 检查模型是否已存在
-        if model_name in self.models_info:
-            model_info = self.models_info[model_name]
-            if Path(model_info["path"]).exists():
+        version = 1
+        current_info = self.get_model_info(model_name)
+        if current_info and Path(current_info["path"]).exists():
+            if not new_version:
                 print(f"模型 {model_name} 已存在")
-                return model_info
+                return current_info
+            version = current_info.get("version", 1) + 1
+        else:
+            new_version = False
+        
+        model_dir = self.model_dir(model_name, version)
         
         try:
             # 查找GGUF文件
             print("正在查找GGUF文件...")
-            gguf_files = self._find_gguf_files(model_name)
+            gguf_files, listed_by = self._find_gguf_files(model_name)
             
             if not gguf_files:
                 raise ValueError(f"在仓库 {model_name} 中未找到GGUF文件")
@@ -93,16 +181,19 @@ class ModelDownloader:
             print(f"选择文件: {selected_file}")
             
             # 创建模型目录
-            model_dir = self.models_dir / model_name.replace("/", "_")
             model_dir.mkdir(exist_ok=True)
             
-            # 下载GGUF文件
-            print(f"正在下载 {selected_file}...")
-            local_file_path = hf_hub_download(
-                repo_id=model_name,
-                filename=selected_file,
-                local_dir=str(model_dir)
-            )
+            # 内容已在本地（其他仓库的同一文件、重新拉取等）时直接链接，跳过下载
+            expected = self._remote_sha256(model_name, selected_file, listed_by)
+            local_file_path = str(model_dir / selected_file)
+            if expected and self.blobs.has(expected):
+                print(f"本地已有相同内容的文件，跳过下载 {selected_file}")
+                self.blobs.link(expected, local_file_path)
+                digest = expected
+            else:
+                Path(local_file_path).parent.mkdir(parents=True, exist_ok=True)
+                verified = self._fetch(model_name, selected_file, expected, local_file_path)
+                digest = self.blobs.ingest(local_file_path, expected, verified=verified is not None)
             
             # 获取模型信息
             model_info = {
@@ -111,58 +202,191 @@ class ModelDownloader:
                 "path": local_file_path,
                 "gguf_file": selected_file,
                 "available_files": gguf_files,
-                "status": "ready"
+                "status": "ready",
+                "version": version,
+                "digest": digest,
+                "size_bytes": os.path.getsize(local_file_path),
+                "last_used": time.time()
             }
+            if model_type == "lora":
+                model_info["type"] = "lora"
+                model_info["base_model"] = base_model
             
-            # 保存模型信息
-            self.models_info[model_name] = model_info
-            self._save_models_info()
+            # 保存模型信息（新版本由调用方预热后再切换）
+            if not new_version:
+                with self._editing_models_info() as models_info:
+                    models_info[model_name] = model_info
             
-            print(f"模型 {model_name} 下载完成")
+            print(f"模型 {model_name} 下载完成 (v{version})")
             return model_info
             
         except Exception as e:
             print(f"下载模型 {model_name} 时出错: {str(e)}")
             # 清理失败的下载
-            model_dir = self.models_dir / model_name.replace("/", "_")
             if model_dir.exists():
                 import shutil
                 shutil.rmtree(model_dir)
+            self.collect_garbage()
             raise
     
+    def model_dir(self, model_name: str, version: int = 1) -> Path:
+        """模型（某个版本）的目录"""
+        model_dir = self.models_dir / model_name.replace("/", "_").replace(":", "_")
+        if version > 1:
+            model_dir = model_dir.with_name(f"{model_dir.name}@v{version}")
+        return model_dir
+    
+    def add_local_model(
+        self,
+        model_name: str,
+        file_path: str,
+        version: int = 1,
+        **extra
+    ) -> Dict[str, Any]:
+        """
+        把本地生成的GGUF文件（如量化版本）纳入内容存储并生成模型信息
+        
+        模型信息不会被写入，由调用方通过 promote_version 登记。
+        
+        Args:
+            model_name: 模型名称
+            file_path: 模型目录中的GGUF文件
+            version: 版本号
+            extra: 额外写入模型信息的字段
+        """
+        model_info = {
+            "name": model_name,
+            "type": "gguf",
+            "path": file_path,
+            "gguf_file": os.path.basename(file_path),
+            "available_files": [os.path.basename(file_path)],
+            "status": "ready",
+            "version": version,
+            "digest": self.blobs.ingest(file_path),
+            "size_bytes": os.path.getsize(file_path),
+            "last_used": time.time()
+        }
+        model_info.update(extra)
+        return model_info
+    
     def get_model_info(self, model_name: str) -> Optional[Dict[str, Any]]:
         """获取模型信息"""
+        self._refresh_models_info()
         return self.models_info.get(model_name)
     
     def list_models(self) -> Dict[str, Any]:
         """列出所有已下载的模型"""
+        self._refresh_models_info()
         return self.models_info
     
-    def delete_model(self, model_name: str) -> bool:
-        """删除模型"""
-        if model_name not in self.models_info:
-            return False
-        
-        model_info = self.models_info[model_name]
-        model_path = Path(model_info["path"])
+    def promote_version(self, model_name: str, model_info: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        将模型名称切换到新版本
         
-        # 删除整个模型目录
-        model_dir = model_path.parent
-        if model_dir.exists():
+        Returns:
+            被替换的旧版本信息
+        """
+        with self._editing_models_info() as models_info:
+            old_info = models_info.get(model_name)
+            models_info[model_name] = model_info
+        return old_info
+    
+    def remove_model_files(self, model_info: Dict[str, Any]):
+        """删除某个版本的模型文件（整个模型目录），内容不再被引用时一并回收"""
+        model_dir = Path(model_info["path"]).parent
+        if model_dir.exists() and model_dir != self.models_dir:
             import shutil
             shutil.rmtree(model_dir)
+        if model_info.get("digest"):
+            self.collect_garbage()
+    
+    def collect_garbage(self) -> Dict[str, int]:
+        """回收没有模型引用的 blob"""
+        referenced = [info["digest"] for info in self.list_models().values() if info.get("digest")]
+        return self.blobs.collect(referenced)
+    
+    def ingest_existing(self) -> int:
+        """
+        把旧版本下载（没有 digest）的模型文件纳入内容存储，相同内容会被合并
         
-        del self.models_info[model_name]
-        self._save_models_info()
+        Returns:
+            纳入的模型数量
+        """
+        count = 0
+        with self._editing_models_info() as models_info:
+            for model_info in models_info.values():
+                if model_info.get("digest") or not Path(model_info["path"]).exists():
+                    continue
+                model_info["digest"] = self.blobs.ingest(model_info["path"])
+                model_info["size_bytes"] = os.path.getsize(model_info["path"])
+                count += 1
+        return count
+    
+    def save_tuning(self, model_name: str, key: str, profile: Dict[str, Any]) -> bool:
+        """保存模型在某台主机、某种量化方式下的调优结果"""
+        with self._editing_models_info() as models_info:
+            model_info = models_info.get(model_name)
+            if model_info is None:
+                return False
+            model_info.setdefault("tuning", {})[key] = profile
+        return True
+    
+    def touch(self, model_name: str):
+        """记录模型最近一次使用的时间（只更新内存，随下次保存写入）和请求统计"""
+        model_info = self.models_info.get(model_name)
+        if model_info is not None:
+            now = time.time()
+            model_info["last_used"] = now
+            # 请求统计只用于预测性预取，未开启时不记录（没有后台线程定期写入）
+            if config.PREDICTIVE_PREFETCH:
+                self.usage.record(model_name, now)
+    
+    def save_usage(self) -> bool:
+        """合并写入各模型的请求统计，返回是否写入"""
+        return self.usage.flush()
+    
+    def disk_usage(self) -> int:
+        """模型文件占用的字节数（相同内容只计一次）"""
+        used = self.blobs.usage()
+        for model_info in self.list_models().values():
+            if not model_info.get("digest") and Path(model_info["path"]).exists():
+                used += os.path.getsize(model_info["path"])
+        return used
+    
+    def lru_models(self) -> List[str]:
+        """按最近使用时间从早到晚排列的模型名称"""
+        models_info = self.list_models()
+        return sorted(models_info, key=lambda name: models_info[name].get("last_used", 0))
+    
+    def delete_model(self, model_name: str, remove_files: bool = True) -> bool:
+        """
+        删除模型
+        
+        Args:
+            model_name: 模型名称
+            remove_files: 是否同时删除模型文件（为False时只移除模型信息，由调用方稍后删除）
+        """
+        with self._editing_models_info() as models_info:
+            if model_name not in models_info:
+                return False
+            model_info = models_info.pop(model_name)
+        
+        # 删除整个模型目录
+        if remove_files:
+            self.remove_model_files(model_info)
         return True
     
     def check_model_status(self, model_name: str) -> str:
         """检查GGUF模型状态"""
-        if model_name not in self.models_info:
+        model_info = self.get_model_info(model_name)
+        if model_info is None:
             return "not_found"
         
-        model_info = self.models_info[model_name]
-        model_path = Path(model_info["path"])
+        return self.check_file_status(model_info["path"])
+    
+    def check_file_status(self, path: str) -> str:
+        """检查GGUF文件状态"""
+        model_path = Path(path)
         
         if not model_path.exists():
             return "corrupted"
@@ -0,0 +1,147 @@
+"""
+评测工具模块 - 通过评分接口计算数据集的困惑度和选择题准确率（llm eval）
+
+数据集为JSONL，每行一条:
+    {"text": "..."}                                              整段文本的困惑度
+    {"prompt": "...", "continuation": "..."}                     续写在提示词下的对数似然
+    {"prompt": "...", "choices": ["...", "..."], "answer": 0}    选择题：对数似然最大的选项为预测
+
+同一模型的不同量化版本在同一数据集上的困惑度、准确率可以直接比较。
+"""
+import json
+import math
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def load_dataset(path: str) -> List[Dict[str, Any]]:
+    """读取JSONL数据集（跳过空行和 # 开头的注释行）"""
+    examples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                example = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path} 第{line_no}行不是有效的JSON: {str(e)}")
+            if "choices" in example:
+                if not example["choices"]:
+                    raise ValueError(f"{path} 第{line_no}行: choices 不能为空")
+                answer = example.get("answer")
+                if answer is not None and not 0 <= answer < len(example["choices"]):
+                    raise ValueError(f"{path} 第{line_no}行: answer 超出 choices 范围")
+            elif "continuation" not in example and "text" not in example:
+                raise ValueError(f"{path} 第{line_no}行: 需要 text、continuation 或 choices 字段")
+            examples.append(example)
+    return examples
+
+
+def _pairs(example: Dict[str, Any]) -> List[Tuple[str, str]]:
+    if "choices" in example:
+        return [(example.get("prompt", ""), choice) for choice in example["choices"]]
+    if "continuation" in example:
+        return [(example.get("prompt", ""), example["continuation"])]
+    return [("", example["text"])]
+
+
+def _choice_row(example: Dict[str, Any], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    errors = [r["error"] for r in results if "error" in r]
+    if errors:
+        return {"error": errors[0]}
+    logprobs = [r["logprob"] for r in results]
+    # 按字符数归一化，避免短选项因token少而占优
+    normalized = [lp / max(len(choice), 1) for lp, choice in zip(logprobs, example["choices"])]
+    row = {
+        "logprobs": logprobs,
+        "prediction": max(range(len(logprobs)), key=logprobs.__getitem__),
+        "prediction_norm": max(range(len(normalized)), key=normalized.__getitem__)
+    }
+    if example.get("answer") is not None:
+        row["correct"] = row["prediction"] == example["answer"]
+        row["correct_norm"] = row["prediction_norm"] == example["answer"]
+    return row
+
+
+def evaluate(
+    manager,
+    model_name: str,
+    examples: List[Dict[str, Any]],
+    batch_size: int = 64,
+    token_logprobs: bool = False,
+    progress: Optional[Callable[[int, int], None]] = None
+) -> Dict[str, Any]:
+    """
+    评测数据集
+
+    每次请求发送 batch_size 条数据（选择题的各选项在同一请求中，共用提示词的评估）。
+
+    Args:
+        manager: ModelManager 或 RemoteModelManager
+        model_name: 模型名称
+        examples: load_dataset 读取的数据
+        batch_size: 每次评分请求的数据条数
+        token_logprobs: 逐条结果中是否包含每个token的对数概率
+        progress: 每完成一次请求调用 progress(已完成条数, 总条数)
+
+    Returns:
+        {"summary": 汇总指标, "rows": 逐条结果}，请求失败时为 {"error": ...}
+    """
+    rows: List[Dict[str, Any]] = []
+    evaluated_tokens = 0
+    start = time.perf_counter()
+
+    for offset in range(0, len(examples), max(1, batch_size)):
+        batch = examples[offset:offset + max(1, batch_size)]
+        pairs = []
+        for example in batch:
+            pairs.extend(_pairs(example))
+        result = manager.score(model_name, pairs, token_logprobs)
+        if "error" in result:
+            return {"error": result["error"]}
+        evaluated_tokens += result["usage"]["evaluated_tokens"]
+
+        results = iter(result["results"])
+        for index, example in enumerate(batch, offset):
+            example_results = [next(results) for _ in _pairs(example)]
+            if "choices" in example:
+                row = _choice_row(example, example_results)
+            else:
+                row = example_results[0]
+            row["index"] = index
+            rows.append(row)
+        if progress is not None:
+            progress(min(offset + len(batch), len(examples)), len(examples))
+
+    elapsed = time.perf_counter() - start
+    summary: Dict[str, Any] = {
+        "model_name": model_name,
+        "examples": len(examples),
+        "errors": sum(1 for row in rows if "error" in row),
+        "evaluated_tokens": evaluated_tokens,
+        "elapsed_s": round(elapsed, 3),
+        "tokens_per_second": round(evaluated_tokens / elapsed, 1) if elapsed > 0 else None
+    }
+
+    # 困惑度只统计文本/续写，选择题的错误选项不计入
+    scored = [row for row, example in zip(rows, examples) if "choices" not in example and "error" not in row]
+    if scored:
+        total = math.fsum(row["logprob"] for row in scored)
+        n_tokens = sum(row["n_tokens"] for row in scored)
+        summary.update({
+            "logprob": total,
+            "n_tokens": n_tokens,
+            "nll_per_token": -total / n_tokens,
+            "perplexity": math.exp(-total / n_tokens),
+            "greedy_rate": sum(1 for row in scored if row["is_greedy"]) / len(scored)
+        })
+
+    graded = [row for row in rows if "correct" in row]
+    if graded:
+        summary.update({
+            "questions": len(graded),
+            "accuracy": sum(1 for row in graded if row["correct"]) / len(graded),
+            "accuracy_norm": sum(1 for row in graded if row["correct_norm"]) / len(graded)
+        })
+    return {"summary": summary, "rows": rows}
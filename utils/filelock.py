@@ -0,0 +1,22 @@
+"""
+文件锁模块 - 多个工作进程共用模型目录中的文件时，读取-修改-写回在排他锁下进行
+"""
+from contextlib import contextmanager
+from pathlib import Path
+
+
+@contextmanager
+def file_lock(path: Path):
+    """跨进程的排他锁（没有 fcntl 的平台上不加锁）"""
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,172 @@
+"""
+主机硬件信息模块 - CPU型号、指令集、物理/逻辑核心数和缓存大小
+"""
+import os
+import re
+import socket
+import hashlib
+import platform
+import subprocess
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+# 与 llama.cpp 算子性能相关的CPU特性（x86 来自 /proc/cpuinfo flags，ARM 来自 Features）
+SIMD_FLAGS = (
+    "sse3", "ssse3", "avx", "avx2", "fma", "f16c",
+    "avx512f", "avx512bw", "avx512vl", "avx512_vnni", "avx512_bf16", "avx_vnni",
+    "amx_tile", "amx_int8", "amx_bf16",
+    "neon", "asimd", "asimddp", "asimdhp", "i8mm", "sve", "sve2", "bf16",
+)
+
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def _parse_size(text: str) -> Optional[int]:
+    """解析 32K / 1M 这类缓存大小"""
+    match = re.match(r"^\s*(\d+)\s*([KMG]?)", text.upper())
+    if not match:
+        return None
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2)]
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _sysctl(name: str) -> Optional[str]:
+    try:
+        out = subprocess.run(["sysctl", "-n", name], capture_output=True, text=True, timeout=2)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() if out.returncode == 0 and out.stdout.strip() else None
+
+
+def _usable_cpus() -> List[int]:
+    """当前进程可以使用的CPU编号（考虑 taskset/cgroup cpuset 限制）"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _linux_cpu_info() -> Dict[str, Any]:
+    cpus = _usable_cpus()
+    info: Dict[str, Any] = {"logical_cores": len(cpus)}
+
+    model = None
+    flags: List[str] = []
+    cpuinfo = _read("/proc/cpuinfo") or ""
+    for line in cpuinfo.splitlines():
+        key, _, value = line.partition(":")
+        key = key.strip().lower()
+        if model is None and key in ("model name", "cpu model", "hardware"):
+            model = value.strip()
+        elif not flags and key in ("flags", "features"):
+            flags = value.split()
+    info["model"] = model or platform.processor() or platform.machine()
+    if "pni" in flags:
+        # /proc/cpuinfo 中 SSE3 记为 pni
+        flags.append("sse3")
+    info["flags"] = [flag for flag in SIMD_FLAGS if flag in flags]
+
+    # 物理核心：按 (封装, 核心) 去重，超线程的兄弟逻辑核只计一次
+    cores = set()
+    for cpu in cpus:
+        topology = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+        package = _read(f"{topology}/physical_package_id")
+        core = _read(f"{topology}/core_id")
+        if package is None or core is None:
+            cores = set()
+            break
+        cores.add((package, core))
+    info["physical_cores"] = len(cores) or len(cpus)
+
+    caches: Dict[str, int] = {}
+    cache_dir = f"/sys/devices/system/cpu/cpu{cpus[0] if cpus else 0}/cache"
+    try:
+        indexes = sorted(name for name in os.listdir(cache_dir) if name.startswith("index"))
+    except OSError:
+        indexes = []
+    for index in indexes:
+        level = _read(f"{cache_dir}/{index}/level")
+        cache_type = _read(f"{cache_dir}/{index}/type") or ""
+        size = _parse_size(_read(f"{cache_dir}/{index}/size") or "")
+        if level is None or size is None:
+            continue
+        suffix = {"Data": "d", "Instruction": "i"}.get(cache_type, "")
+        caches[f"L{level}{suffix}"] = size
+    info["caches"] = caches
+    return info
+
+
+def _darwin_cpu_info() -> Dict[str, Any]:
+    logical = int(_sysctl("hw.logicalcpu") or os.cpu_count() or 1)
+    info: Dict[str, Any] = {
+        "model": _sysctl("machdep.cpu.brand_string") or platform.machine(),
+        "logical_cores": logical,
+        # Apple Silicon 上只统计性能核，能效核参与推理通常反而更慢
+        "physical_cores": int(_sysctl("hw.perflevel0.physicalcpu") or _sysctl("hw.physicalcpu") or logical),
+    }
+    features = (_sysctl("machdep.cpu.features") or "").lower().split()
+    features += (_sysctl("machdep.cpu.leaf7_features") or "").lower().split()
+    flags = [flag for flag in SIMD_FLAGS if flag.replace("_", ".") in features or flag in features]
+    if platform.machine() == "arm64":
+        flags.append("neon")
+        if _sysctl("hw.optional.arm.FEAT_DotProd") == "1":
+            flags.append("asimddp")
+        if _sysctl("hw.optional.arm.FEAT_I8MM") == "1":
+            flags.append("i8mm")
+    info["flags"] = flags
+
+    caches = {}
+    for name, key in (("L1d", "hw.l1dcachesize"), ("L2", "hw.l2cachesize"), ("L3", "hw.l3cachesize")):
+        size = _sysctl(key)
+        if size and size.isdigit() and int(size) > 0:
+            caches[name] = int(size)
+    info["caches"] = caches
+    return info
+
+
+@lru_cache(maxsize=1)
+def cpu_info() -> Dict[str, Any]:
+    """
+    检测CPU信息（结果缓存，进程生命周期内不变）
+
+    Returns:
+        {"model", "flags", "physical_cores", "logical_cores", "caches": {"L1d": 字节数, ...}}
+    """
+    try:
+        if platform.system() == "Darwin":
+            return _darwin_cpu_info()
+        if platform.system() == "Linux":
+            return _linux_cpu_info()
+    except Exception:
+        pass
+    count = os.cpu_count() or 1
+    return {
+        "model": platform.processor() or platform.machine(),
+        "flags": [],
+        "physical_cores": count,
+        "logical_cores": count,
+        "caches": {}
+    }
+
+
+def host_id() -> str:
+    """
+    主机标识：主机名加硬件指纹
+
+    同一主机名换了硬件（如虚拟机调整规格）时标识随之变化，旧的调优结果不再适用。
+    """
+    info = cpu_info()
+    fingerprint = "|".join([
+        str(info["model"]),
+        str(info["physical_cores"]),
+        str(info["logical_cores"]),
+        ",".join(info["flags"]),
+        ",".join(f"{k}={v}" for k, v in sorted(info["caches"].items())),
+    ])
+    return f"{socket.gethostname()}-{hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:8]}"
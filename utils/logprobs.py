@@ -0,0 +1,100 @@
+"""
+逐token对数概率记录 - 在采样时直接读取 llama.cpp 的 logits 缓冲区，向量化计算 log_softmax 和 top-k
+
+llama-cpp-python 自带的 logprobs 需要以 logits_all=True 加载模型（为每个位置保留
+n_ctx × 词表大小的 logits），并把每个token的整行 logits 转成 Python 列表排序。
+这里每生成一个token只在原缓冲区上计算一次：归一化项用预分配的暂存数组求出，
+top-k 用 argpartition 选出，结果写入按需扩容的 NumPy 数组，取出时才转换为列表。
+"""
+import math
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+# top_logprobs 的上限（与 OpenAI 接口一致）
+MAX_TOP_LOGPROBS = 20
+
+
+class LogprobRecorder:
+    """
+    一次生成中每个采样token的对数概率及概率最高的候选
+
+    Args:
+        n_vocab: 词表大小
+        top_k: 每个位置额外记录的候选数（0 表示只记录采样到的token）
+        token_text: token -> (输出文本中的字节数, 显示文本)
+    """
+
+    def __init__(self, n_vocab: int, top_k: int, token_text: Callable[[int], Tuple[int, str]]):
+        self.n_vocab = n_vocab
+        self.top_k = min(top_k, n_vocab)
+        self._token_text = token_text
+        self._scratch = np.empty(n_vocab, dtype=np.float32)
+        self._tokens = np.empty(64, dtype=np.int64)
+        self._logprobs = np.empty(64, dtype=np.float64)
+        # 每个token在生成文本中的起始字节位置，用于与实际输出的文本对齐
+        self._offsets = np.empty(64, dtype=np.int64)
+        self._top_ids = np.empty((64, self.top_k), dtype=np.int64)
+        self._top_logprobs = np.empty((64, self.top_k), dtype=np.float64)
+        self.count = 0
+        self._bytes = 0
+        self._taken = 0
+
+    def _grow(self):
+        capacity = len(self._tokens) * 2
+        for name in ("_tokens", "_logprobs", "_offsets", "_top_ids", "_top_logprobs"):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def record(self, token: int, logits_ptr):
+        """
+        记录一个采样token（在采样之后、下一次评估之前调用）
+
+        Args:
+            token: 采样得到的token
+            logits_ptr: 产生该token的 logits（llama_get_logits_ith 返回的指针）
+        """
+        if self.count == len(self._tokens):
+            self._grow()
+        logits = np.ctypeslib.as_array(logits_ptr, shape=(self.n_vocab,))
+        peak = logits.max()
+        scratch = self._scratch
+        np.subtract(logits, peak, out=scratch)
+        np.exp(scratch, out=scratch)
+        log_norm = float(peak) + math.log(scratch.sum(dtype=np.float64))
+
+        i = self.count
+        self._tokens[i] = token
+        self._logprobs[i] = float(logits[token]) - log_norm
+        self._offsets[i] = self._bytes
+        if self.top_k:
+            top = np.argpartition(logits, -self.top_k)[-self.top_k:]
+            top = top[np.argsort(logits[top])[::-1]]
+            self._top_ids[i] = top
+            self._top_logprobs[i] = logits[top] - log_norm
+        self._bytes += self._token_text(token)[0]
+        self.count += 1
+
+    def take(self, emitted_bytes: int) -> List[Dict[str, Any]]:
+        """
+        取出文本已经输出的token（起始位置在已输出的字节数之前）
+
+        停止词截断的部分、结束token等没有出现在输出文本中的token不会被取出。
+        """
+        start = self._taken
+        # 起始位置单调不减，二分查找第一个尚未输出的token
+        end = start + int(np.searchsorted(self._offsets[start:self.count], emitted_bytes, side="left"))
+        self._taken = end
+        if start == end:
+            return []
+
+        text = self._token_text
+        tokens = self._tokens[start:end].tolist()
+        logprobs = self._logprobs[start:end].tolist()
+        entries = [{"token": text(t)[1], "logprob": lp} for t, lp in zip(tokens, logprobs)]
+        if self.top_k:
+            for entry, ids, lps in zip(entries, self._top_ids[start:end].tolist(), self._top_logprobs[start:end].tolist()):
+                entry["top_logprobs"] = [{"token": text(t)[1], "logprob": lp} for t, lp in zip(ids, lps)]
+        return entries
@@ -0,0 +1,126 @@
+"""
+内存工具模块 - 模型文件的共享映射、预读提示和内存占用统计
+"""
+import os
+import mmap
+import logging
+from typing import Optional, Dict
+
+logger = logging.getLogger(__name__)
+
+
+def map_model_file(path: str, prefetch: bool = True, hugepages: bool = False) -> Optional[mmap.mmap]:
+    """
+    以只读共享方式（MAP_SHARED）映射模型文件
+
+    多个工作进程映射同一文件时共用页缓存中的同一份物理页，不会按进程数成倍占用内存。
+
+    Args:
+        path: 模型文件路径
+        prefetch: 是否提示内核预读整个文件（MADV_WILLNEED）
+        hugepages: 是否提示使用透明大页（MADV_HUGEPAGE，需内核支持文件页THP）
+
+    Returns:
+        映射对象，平台不支持时返回None
+    """
+    try:
+        with open(path, "rb") as f:
+            if hasattr(mmap, "MAP_SHARED"):
+                mapping = mmap.mmap(f.fileno(), 0, flags=mmap.MAP_SHARED, prot=mmap.PROT_READ)
+            else:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as e:
+        logger.warning(f"映射模型文件失败 {path}: {str(e)}")
+        return None
+
+    if prefetch:
+        _madvise(mapping, "MADV_WILLNEED")
+    if hugepages:
+        _madvise(mapping, "MADV_HUGEPAGE")
+    return mapping
+
+
+def _madvise(mapping: mmap.mmap, advice_name: str):
+    """给映射区域发送 madvise 提示，不支持时忽略"""
+    advice = getattr(mmap, advice_name, None)
+    if advice is None or not hasattr(mapping, "madvise"):
+        return
+    try:
+        mapping.madvise(advice)
+    except OSError as e:
+        logger.debug(f"madvise({advice_name}) 失败: {str(e)}")
+
+
+def file_mapping_memory(path: str, pid: str = "self") -> Optional[Dict[str, int]]:
+    """
+    统计当前进程中映射了指定文件的内存（读取 /proc/<pid>/smaps）
+
+    Returns:
+        {"rss_kb", "pss_kb", "shared_kb", "private_kb"}，非Linux系统返回None
+    """
+    smaps_file = f"/proc/{pid}/smaps"
+    if not os.path.exists(smaps_file):
+        return None
+
+    target = os.path.realpath(path)
+    totals = {"rss_kb": 0, "pss_kb": 0, "shared_kb": 0, "private_kb": 0}
+    in_target = False
+    try:
+        with open(smaps_file, "r") as f:
+            for line in f:
+                fields = line.split()
+                if not fields:
+                    continue
+                key = fields[0]
+                if not key.endswith(":"):
+                    # 映射区域的头部行：地址 权限 偏移 设备 inode 路径（路径可能含空格）
+                    parts = line.rstrip("\n").split(None, 5)
+                    in_target = len(parts) == 6 and parts[5] == target
+                    continue
+                if not in_target:
+                    continue
+                if key == "Rss:":
+                    totals["rss_kb"] += int(fields[1])
+                elif key == "Pss:":
+                    totals["pss_kb"] += int(fields[1])
+                elif key in ("Shared_Clean:", "Shared_Dirty:"):
+                    totals["shared_kb"] += int(fields[1])
+                elif key in ("Private_Clean:", "Private_Dirty:"):
+                    totals["private_kb"] += int(fields[1])
+    except OSError:
+        return None
+    return totals
+
+
+# KV缓存元素类型：(ggml类型编号, 每个元素的字节数)
+KV_CACHE_TYPES = {
+    "f16": (1, 2.0),
+    "q8_0": (8, 34 / 32),
+    "q4_0": (2, 18 / 32),
+}
+
+
+def kv_cache_bytes_per_token(metadata: Dict[str, str], cache_type: str = "f16") -> Optional[float]:
+    """
+    根据GGUF元数据估算每个token的KV缓存字节数（K和V合计，所有层）
+
+    Args:
+        metadata: Llama.metadata（GGUF键值对）
+        cache_type: KV缓存类型（f16/q8_0/q4_0）
+
+    Returns:
+        字节数，元数据不完整时返回None
+    """
+    arch = metadata.get("general.architecture")
+    if not arch or cache_type not in KV_CACHE_TYPES:
+        return None
+    try:
+        n_layer = int(metadata[f"{arch}.block_count"])
+        n_embd = int(metadata[f"{arch}.embedding_length"])
+        n_head = int(metadata[f"{arch}.attention.head_count"])
+        n_head_kv = int(metadata.get(f"{arch}.attention.head_count_kv", n_head))
+        key_length = int(metadata.get(f"{arch}.attention.key_length", n_embd // n_head))
+        value_length = int(metadata.get(f"{arch}.attention.value_length", n_embd // n_head))
+    except (KeyError, ValueError, ZeroDivisionError):
+        return None
+    return n_layer * n_head_kv * (key_length + value_length) * KV_CACHE_TYPES[cache_type][1]
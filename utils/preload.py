@@ -0,0 +1,191 @@
+"""
+预测性预取模块 - 按请求统计预测即将被使用的模型，提前把模型文件读入页缓存或直接加载
+
+每天第一次请求冷模型时，加载要从磁盘读取整个GGUF文件。后台每隔 PREFETCH_INTERVAL 秒
+预测未来 PREFETCH_LOOKAHEAD_MINUTES 分钟内的请求数（见 utils/usage.py），对达到
+PREFETCH_MIN_REQUESTS 的模型：
+
+- 开启 PREDICTIVE_PRELOAD 且加载后内存仍低于高水位时，直接加载（每轮最多一个）
+- 否则用 posix_fadvise(WILLNEED) 让内核在后台预读文件，之后的 mmap 加载直接命中页缓存
+
+页缓存可被内核随时回收，预取不会造成内存压力；有内存压力时暂停预取和预加载。
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import config
+from utils.pressure import memory_controller, read_cgroup_memory, read_meminfo
+from utils.usage import expected_requests
+
+logger = logging.getLogger(__name__)
+
+# 预加载时按文件大小估计内存占用的放大系数（KV缓存、计算缓冲区）
+_LOAD_OVERHEAD = 1.2
+# 没有 posix_fadvise 的平台上逐块读取文件
+_READ_CHUNK = 8 * 1024 * 1024
+
+
+def prefetch_file(path: str):
+    """让内核把文件读入页缓存（Linux 上异步进行，立即返回）"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        else:
+            while os.read(fd, _READ_CHUNK):
+                pass
+    finally:
+        os.close(fd)
+
+
+class Preloader:
+    """
+    后台预测和预取（每个工作进程一个）
+
+    Args:
+        interval: 预测间隔（秒）
+    """
+
+    def __init__(self, interval: Optional[float] = None):
+        self.interval = interval or config.PREFETCH_INTERVAL
+        self.predictions: List[Dict[str, Any]] = []
+        self.counters = {"runs": 0, "prefetched": 0, "preloaded": 0}
+        self.actions: deque = deque(maxlen=50)
+        self._prefetched: Dict[str, float] = {}
+        self._manager = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self, manager) -> bool:
+        """
+        启动后台预测
+
+        Args:
+            manager: 模型管理器
+        """
+        if self._thread is not None:
+            return True
+        self._manager = manager
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="preload", daemon=True)
+        self._thread.start()
+        logger.info(f"预测性预取已启动，间隔 {self.interval}s")
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        # 退出前保存尚未写入的请求统计
+        if self._manager is not None:
+            self._manager.save_usage()
+
+    @staticmethod
+    def predict(models_info: Dict[str, Any], usage: Dict[str, Any], now: float,
+                lookahead: float) -> List[Dict[str, Any]]:
+        """预测各模型在未来 lookahead 秒内的请求数，按预计请求数从高到低排列（不含LoRA适配器）"""
+        predictions = []
+        for name, model_info in list(models_info.items()):
+            if model_info.get("type") == "lora" or not usage.get(name):
+                continue
+            prediction = expected_requests(usage[name], now, lookahead)
+            prediction["model_name"] = name
+            predictions.append(prediction)
+        predictions.sort(key=lambda p: p["expected"], reverse=True)
+        return predictions
+
+    def run_once(self, manager, now: Optional[float] = None) -> List[str]:
+        """
+        预测一次并预取/预加载（后台线程定期调用，也可手动调用）
+
+        Returns:
+            执行的动作描述
+        """
+        now = now or time.time()
+        lookahead = config.PREFETCH_LOOKAHEAD_MINUTES * 60
+        manager.save_usage()
+        models_info = manager.downloader.list_models()
+        predictions = self.predict(models_info, manager.downloader.usage.usage, now, lookahead)
+        with self._lock:
+            self.predictions = predictions
+            self.counters["runs"] += 1
+
+        if memory_controller.level != "ok":
+            return []
+
+        loaded = set(manager.loaded_model_names())
+        memory = read_cgroup_memory() or read_meminfo()
+        actions = []
+        preloaded = False
+        for prediction in predictions:
+            name = prediction["model_name"]
+            if prediction["expected"] < config.PREFETCH_MIN_REQUESTS:
+                break
+            model_info = models_info.get(name)
+            if name in loaded or not model_info or not os.path.exists(model_info["path"]):
+                continue
+            size = os.path.getsize(model_info["path"])
+            free = memory["limit_bytes"] - memory["working_set_bytes"] if memory else None
+
+            if config.PREDICTIVE_PRELOAD and not preloaded and memory and (
+                memory["working_set_bytes"] + size * _LOAD_OVERHEAD
+                < memory["limit_bytes"] * config.MEMORY_HIGH_WATERMARK
+            ):
+                preloaded = True
+                if manager.preload_model(name):
+                    actions.append(f"预加载 {name}（预计 {prediction['expected']} 个请求）")
+                    with self._lock:
+                        self.counters["preloaded"] += 1
+                    memory = read_cgroup_memory() or read_meminfo()
+                    continue
+
+            # 同一文件在预测窗口内只预取一次；放不下的文件预取也会被立即回收
+            if now - self._prefetched.get(model_info["path"], 0) < lookahead:
+                continue
+            if free is not None and size > free:
+                continue
+            try:
+                prefetch_file(model_info["path"])
+            except OSError as e:
+                logger.warning(f"预取模型文件 {model_info['path']} 失败: {str(e)}")
+                continue
+            self._prefetched[model_info["path"]] = now
+            actions.append(f"预取 {name}（预计 {prediction['expected']} 个请求）")
+            with self._lock:
+                self.counters["prefetched"] += 1
+
+        with self._lock:
+            for action in actions:
+                self.actions.append({"time": now, "action": action})
+        for action in actions:
+            logger.info(f"预测性预取: {action}")
+        return actions
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once(self._manager)
+            except Exception as e:
+                logger.error(f"预测性预取失败: {str(e)}")
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self._thread is not None,
+                "preload": config.PREDICTIVE_PRELOAD,
+                "lookahead_minutes": config.PREFETCH_LOOKAHEAD_MINUTES,
+                "min_requests": config.PREFETCH_MIN_REQUESTS,
+                "predictions": list(self.predictions),
+                "counters": dict(self.counters),
+                "recent_actions": list(self.actions)
+            }
+
+
+# 进程内共享的预取器（服务启动时开始运行）
+preloader = Preloader()
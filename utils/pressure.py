@@ -0,0 +1,361 @@
+"""
+内存压力模块 - 读取 cgroup 内存限制/用量和 PSI 内存压力，在 OOM 之前主动降载
+
+容器内 /proc/meminfo 给出的是宿主机的内存，真正的上限是 cgroup 的 memory.max；
+超过上限时内核直接杀死进程，服务随之反复重启。控制器在后台周期采样：
+
+- elevated: 用量超过高水位或 PSI some 超过阈值，收缩缓存（语法、分词、评分上下文）
+- critical: 用量超过临界水位或 PSI full 超过阈值，另外卸载空闲模型（每次一个），
+  并暂停接收新的推理请求（返回 503 和 Retry-After）
+
+压力上升时立即切换级别；下降时需持续 MEMORY_RECOVERY_SECONDS 才恢复，避免反复抖动。
+
+没有 cgroup 内存限制时只能看到整机的内存和 PSI，其中包含其他进程的用量，这些信号
+最多触发 elevated：不会因为别的进程占用内存而卸载模型、拒绝请求。
+"""
+import os
+import math
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+LEVELS = ("ok", "elevated", "critical")
+
+_CGROUP_ROOT = "/sys/fs/cgroup"
+# cgroup v1 未设置限制时 memory.limit_in_bytes 是一个接近 2^63 的值
+_V1_UNLIMITED = 1 << 60
+
+
+def _read_int(path: str) -> Optional[int]:
+    try:
+        with open(path, "r") as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    if value == "max":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _read_stat(path: str) -> Dict[str, int]:
+    """读取 memory.stat（每行 "键 值"）"""
+    stat = {}
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1].isdigit():
+                    stat[parts[0]] = int(parts[1])
+    except OSError:
+        pass
+    return stat
+
+
+def _cgroup_dirs(root: str = _CGROUP_ROOT) -> List[str]:
+    """当前进程所在的 cgroup v2 目录（没有 cgroup 命名空间时为完整路径），以及根目录"""
+    dirs = []
+    try:
+        with open("/proc/self/cgroup", "r") as f:
+            for line in f:
+                hierarchy, _, path = line.rstrip("\n").split(":", 2)
+                if hierarchy == "0" and path not in ("", "/"):
+                    dirs.append(os.path.join(root, path.lstrip("/")))
+    except (OSError, ValueError):
+        pass
+    dirs.append(root)
+    return dirs
+
+
+def read_cgroup_memory(root: str = _CGROUP_ROOT) -> Optional[Dict[str, Any]]:
+    """
+    读取 cgroup 的内存限制和用量（优先 cgroup v2，兼容 v1）
+
+    working_set 为用量减去不活跃的文件页（可以直接回收的页缓存），与 kubelet 的判断一致。
+
+    Returns:
+        {"version", "path", "limit_bytes", "usage_bytes", "working_set_bytes"}，
+        没有设置内存限制时返回None
+    """
+    for path in _cgroup_dirs(root):
+        limit = _read_int(os.path.join(path, "memory.max"))
+        usage = _read_int(os.path.join(path, "memory.current"))
+        if limit is not None and usage is not None:
+            inactive = _read_stat(os.path.join(path, "memory.stat")).get("inactive_file", 0)
+            return {
+                "version": 2,
+                "path": path,
+                "limit_bytes": limit,
+                "usage_bytes": usage,
+                "working_set_bytes": max(usage - inactive, 0)
+            }
+
+    v1 = os.path.join(root, "memory")
+    limit = _read_int(os.path.join(v1, "memory.limit_in_bytes"))
+    usage = _read_int(os.path.join(v1, "memory.usage_in_bytes"))
+    if limit is not None and usage is not None and limit < _V1_UNLIMITED:
+        inactive = _read_stat(os.path.join(v1, "memory.stat")).get("total_inactive_file", 0)
+        return {
+            "version": 1,
+            "path": v1,
+            "limit_bytes": limit,
+            "usage_bytes": usage,
+            "working_set_bytes": max(usage - inactive, 0)
+        }
+    return None
+
+
+def read_meminfo() -> Optional[Dict[str, Any]]:
+    """没有 cgroup 限制时使用整机内存（MemTotal - MemAvailable 为工作集）"""
+    values = {}
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("MemTotal", "MemAvailable"):
+                    values[key] = int(rest.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        return None
+    if len(values) < 2:
+        return None
+    return {
+        "version": None,
+        "path": "/proc/meminfo",
+        "limit_bytes": values["MemTotal"],
+        "usage_bytes": values["MemTotal"] - values["MemAvailable"],
+        "working_set_bytes": values["MemTotal"] - values["MemAvailable"]
+    }
+
+
+def read_psi(path: str) -> Optional[Dict[str, Dict[str, float]]]:
+    """
+    读取 PSI 压力文件
+
+    Returns:
+        {"some": {"avg10", "avg60", "avg300"}, "full": {...}}（百分比），不支持时返回None
+    """
+    psi = {}
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                parts = line.split()
+                if not parts or parts[0] not in ("some", "full"):
+                    continue
+                fields = dict(part.split("=", 1) for part in parts[1:])
+                psi[parts[0]] = {key: float(fields[key]) for key in ("avg10", "avg60", "avg300") if key in fields}
+    except (OSError, ValueError):
+        return None
+    return psi or None
+
+
+def memory_psi(cgroup: Optional[Dict[str, Any]] = None) -> Tuple[Optional[Dict[str, Dict[str, float]]], Optional[str]]:
+    """
+    优先读取所在 cgroup 的 memory.pressure，否则读取整机的 /proc/pressure/memory
+
+    Returns:
+        (PSI, 范围 cgroup/host)，不支持时为 (None, None)
+    """
+    if cgroup is not None and cgroup["version"] == 2:
+        psi = read_psi(os.path.join(cgroup["path"], "memory.pressure"))
+        if psi is not None:
+            return psi, "cgroup"
+    psi = read_psi("/proc/pressure/memory")
+    return psi, ("host" if psi is not None else None)
+
+
+def _malloc_trim():
+    """把 glibc 堆中已释放的内存归还给系统（非 glibc 平台忽略）"""
+    try:
+        import ctypes
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class MemoryPressureController:
+    """
+    后台内存压力控制器（每个工作进程一个）
+
+    Args:
+        interval: 采样间隔（秒）
+    """
+
+    def __init__(self, interval: Optional[float] = None):
+        self.interval = interval or config.MEMORY_PRESSURE_INTERVAL
+        self.level = "ok"
+        self.snapshot: Dict[str, Any] = {}
+        self.counters = {"samples": 0, "relief_runs": 0, "rejected": 0}
+        self.actions: deque = deque(maxlen=50)
+        self._relieve: Optional[Callable[[str], List[str]]] = None
+        self._calm_since: Optional[float] = None
+        self._paused_until = 0.0
+        self._last_relief = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self, relieve: Callable[[str], List[str]]) -> bool:
+        """
+        启动后台采样
+
+        Args:
+            relieve: 降载回调 relieve(级别)，返回执行的动作描述
+
+        Returns:
+            是否已启动（读取不到任何内存信息的平台不启动）
+        """
+        if self._thread is not None:
+            return True
+        if read_cgroup_memory() is None and read_meminfo() is None:
+            logger.info("读取不到 cgroup 或整机内存信息，不启动内存压力控制")
+            return False
+        self._relieve = relieve
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="memory-pressure", daemon=True)
+        self._thread.start()
+        logger.info(f"内存压力控制已启动，采样间隔 {self.interval}s")
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval * 2)
+            self._thread = None
+
+    def sample(self) -> Dict[str, Any]:
+        """采样一次内存用量和压力"""
+        memory = read_cgroup_memory() or read_meminfo() or {}
+        psi, psi_scope = memory_psi(memory if memory.get("version") else None)
+        limit = memory.get("limit_bytes")
+        snapshot = {
+            "time": time.time(),
+            "source": f"cgroup_v{memory['version']}" if memory.get("version") else ("meminfo" if memory else None),
+            "limit_bytes": limit,
+            "usage_bytes": memory.get("usage_bytes"),
+            "working_set_bytes": memory.get("working_set_bytes"),
+            "usage_ratio": round(memory["working_set_bytes"] / limit, 4) if limit else None,
+            "psi": psi,
+            "psi_scope": psi_scope
+        }
+        return snapshot
+
+    @staticmethod
+    def classify(snapshot: Dict[str, Any]) -> str:
+        """
+        根据水位和 PSI 判断压力级别
+
+        只有本服务所在 cgroup 的信号（真实的内存限制、cgroup 的 PSI）能判为 critical；
+        整机的内存和 PSI 包含其他进程，只作参考，最多判为 elevated。
+        """
+        ratio = snapshot.get("usage_ratio") or 0.0
+        psi = snapshot.get("psi") or {}
+        some = psi.get("some", {}).get("avg10", 0.0)
+        full = psi.get("full", {}).get("avg10", 0.0)
+        cgroup_limit = (snapshot.get("source") or "").startswith("cgroup")
+        cgroup_psi = snapshot.get("psi_scope") == "cgroup"
+        if (cgroup_limit and ratio >= config.MEMORY_CRITICAL_WATERMARK) or (
+            cgroup_psi and full >= config.MEMORY_PSI_FULL_CRITICAL
+        ):
+            return "critical"
+        if ratio >= config.MEMORY_HIGH_WATERMARK or some >= config.MEMORY_PSI_SOME_ELEVATED:
+            return "elevated"
+        return "ok"
+
+    def update(self, snapshot: Dict[str, Any]) -> str:
+        """
+        按采样结果更新级别并执行降载（后台线程每次采样调用，也可手动调用）
+
+        Returns:
+            更新后的级别
+        """
+        observed = self.classify(snapshot)
+        now = snapshot["time"]
+        with self._lock:
+            self.snapshot = snapshot
+            self.counters["samples"] += 1
+            previous = self.level
+            if LEVELS.index(observed) >= LEVELS.index(previous):
+                self.level = observed
+                self._calm_since = None
+            elif self._calm_since is None:
+                self._calm_since = now
+            elif now - self._calm_since >= config.MEMORY_RECOVERY_SECONDS:
+                # 逐级恢复
+                self.level = LEVELS[LEVELS.index(previous) - 1]
+                self._calm_since = now if self.level != observed else None
+            level = self.level
+            if level == "critical":
+                self._paused_until = now + config.MEMORY_RETRY_AFTER
+
+        if level != previous:
+            log = logger.warning if LEVELS.index(level) > LEVELS.index(previous) else logger.info
+            log(
+                f"内存压力 {previous} -> {level}（工作集 {snapshot.get('working_set_bytes')}/"
+                f"{snapshot.get('limit_bytes')} 字节，PSI {snapshot.get('psi')}）"
+            )
+        # 只在当前采样仍有压力时降载；恢复期间不再继续淘汰。卸载模型后文件页
+        # 不会立即计入可回收部分，两次降载之间至少间隔 MEMORY_RELIEF_INTERVAL 秒
+        if observed != "ok" and self._relieve is not None and now - self._last_relief >= config.MEMORY_RELIEF_INTERVAL:
+            self._last_relief = now
+            self._run_relief(observed)
+        return level
+
+    def _run_relief(self, level: str):
+        try:
+            actions = self._relieve(level)
+        except Exception as e:
+            logger.error(f"内存压力降载失败: {str(e)}")
+            return
+        _malloc_trim()
+        with self._lock:
+            self.counters["relief_runs"] += 1
+            for action in actions:
+                self.actions.append({"time": time.time(), "level": level, "action": action})
+        for action in actions:
+            logger.warning(f"内存压力降载: {action}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.update(self.sample())
+            except Exception as e:
+                logger.error(f"内存压力采样失败: {str(e)}")
+
+    def retry_after(self) -> Optional[int]:
+        """
+        暂停接收新请求时返回建议的重试间隔（秒），否则返回None
+
+        临界压力解除后仍保持 MEMORY_RETRY_AFTER 秒，避免积压的请求同时涌入。
+        """
+        if self.level == "critical":
+            wait = config.MEMORY_RETRY_AFTER
+        else:
+            wait = self._paused_until - time.time()
+            if wait <= 0:
+                return None
+        with self._lock:
+            self.counters["rejected"] += 1
+        return max(1, math.ceil(wait))
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self._thread is not None,
+                "level": self.level,
+                "admitting": self.level != "critical" and self._paused_until <= time.time(),
+                "snapshot": dict(self.snapshot),
+                "counters": dict(self.counters),
+                "recent_actions": list(self.actions)
+            }
+
+
+# 进程内共享的控制器（服务启动时开始采样）
+memory_controller = MemoryPressureController()
@@ -0,0 +1,138 @@
+"""
+性能剖析模块 - 采样剖析器（输出火焰图折叠栈格式）和按接口开关的 cProfile
+"""
+import io
+import os
+import sys
+import time
+import cProfile
+import pstats
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# 栈顶位于这些文件中的线程视为空闲等待（线程池空闲、事件循环select等）
+_IDLE_FILES = ("threading.py", "queue.py", "selectors.py")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label.replace(";", ":")
+
+
+class SamplingProfiler:
+    """
+    定时采样所有线程的Python调用栈
+
+    不修改被剖析代码，开销只与采样频率相关，可以在线上短时间开启。
+    原生 llama.cpp 中的耗时会记在调用它的 Python 帧上（如 llama_decode）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def sample(self, seconds: float, interval: float = 0.01, include_idle: bool = False) -> Optional[str]:
+        """
+        采样指定时长
+
+        Args:
+            seconds: 采样时长（秒）
+            interval: 采样间隔（秒）
+            include_idle: 是否包含空闲等待中的线程
+
+        Returns:
+            折叠栈文本（每行 "线程;帧;帧 次数"，可直接用 flamegraph.pl / speedscope 打开），
+            已有采样在进行时返回None
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            return self._sample(seconds, interval, include_idle)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float, interval: float, include_idle: bool) -> str:
+        me = threading.get_ident()
+        counts: Counter = Counter()
+        deadline = time.monotonic() + seconds
+
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                if not include_idle and os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)).replace(";", ":"))
+                stack.reverse()
+                counts[";".join(stack)] += 1
+            time.sleep(interval)
+
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+class EndpointProfiler:
+    """按接口开关的 cProfile，统计在多次请求间累积"""
+
+    def __init__(self):
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        self._enabled: Dict[str, bool] = {}
+        # 同一时刻只允许一个 cProfile 处于激活状态，其余请求不剖析直接执行
+        self._active = threading.Lock()
+
+    def set_enabled(self, endpoint: str, enabled: bool, reset: bool = False):
+        """开启/关闭某个接口的剖析"""
+        if reset or endpoint not in self._profiles:
+            self._profiles[endpoint] = cProfile.Profile()
+        self._enabled[endpoint] = enabled
+
+    def status(self) -> Dict[str, bool]:
+        return dict(self._enabled)
+
+    @contextmanager
+    def profile(self, endpoint: str):
+        """在开启剖析的接口上执行代码块"""
+        if not self._enabled.get(endpoint) or not self._active.acquire(blocking=False):
+            yield
+            return
+        profiler = self._profiles[endpoint]
+        try:
+            profiler.enable()
+        except ValueError:
+            # 其他剖析工具已占用（如 sys.monitoring）
+            self._active.release()
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self._active.release()
+
+    def report(self, endpoint: str, sort: str = "cumulative", limit: int = 50) -> Optional[str]:
+        """输出累积的统计报告"""
+        profiler = self._profiles.get(endpoint)
+        if profiler is None:
+            return None
+        output = io.StringIO()
+        try:
+            stats = pstats.Stats(profiler, stream=output)
+        except TypeError:
+            # 还没有任何数据
+            return ""
+        stats.sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+
+sampling_profiler = SamplingProfiler()
+endpoint_profiler = EndpointProfiler()
@@ -0,0 +1,22 @@
+"""
+JSON序列化工具模块 - 优先使用 orjson，未安装时回退到标准库 json
+"""
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    """序列化为紧凑的UTF-8 JSON字节串"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def dumps_line(obj: Any) -> bytes:
+    """序列化为一行NDJSON（以换行结尾）"""
+    return dumps(obj) + b"\n"
@@ -0,0 +1,211 @@
+"""
+请求合并模块 - 相同的进行中请求只执行一次，结果（或流式片段）分发给所有等待者
+"""
+import json
+import hashlib
+import threading
+import contextvars
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+def flight_key(kind: str, **params) -> str:
+    """由请求类型和全部参数生成合并键"""
+    payload = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return f"{kind}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+class _Call:
+    """一次进行中的非流式调用"""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _StreamFlight:
+    """
+    一次进行中的流式生成
+
+    生成在后台线程中进行，片段保存在列表里；每个订阅者从头读取，
+    晚加入的订阅者先补齐已生成的片段，再与其他订阅者同步接收后续片段。
+    所有订阅者都离开后停止生成。
+    """
+
+    def __init__(self, factory: Callable[[], Iterator[Dict[str, Any]]], on_finish: Callable[[], None]):
+        self._factory = factory
+        self._on_finish = on_finish
+        self._frames: List[Dict[str, Any]] = []
+        self._cond = threading.Condition()
+        self.finished = False
+        # 所有订阅者都已离开、生成被中止，不能再加入
+        self.abandoned = False
+        self.subscribers = 0
+
+    def start(self):
+        # 在发起者的上下文中运行，生成阶段仍记录到发起请求的追踪里
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(self._run,), name="single-flight", daemon=True).start()
+
+    def _run(self):
+        stream = None
+        try:
+            stream = self._factory()
+            for frame in stream:
+                with self._cond:
+                    if self.subscribers == 0:
+                        self.abandoned = True
+                        break
+                    # 片段由上游逐帧新建，各订阅者共享（只读）
+                    self._frames.append(frame)
+                    self._cond.notify_all()
+        except Exception as e:
+            with self._cond:
+                self._frames.append({"error": str(e), "success": False})
+        finally:
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+            self._on_finish()
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+
+    def join(self) -> bool:
+        """增加一个订阅者，生成已中止时返回False"""
+        with self._cond:
+            if self.abandoned:
+                return False
+            self.subscribers += 1
+            return True
+
+    def _leave(self):
+        with self._cond:
+            self.subscribers -= 1
+
+    def subscribe(self) -> "_Subscription":
+        """读取片段的迭代器（需先 join）；关闭或被回收时离开，从未读取也会离开"""
+        return _Subscription(self)
+
+    def _frames_from_start(self) -> Iterator[Dict[str, Any]]:
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self._frames) and not self.finished:
+                    self._cond.wait()
+                if index >= len(self._frames):
+                    return
+                batch = self._frames[index:]
+                index = len(self._frames)
+            for frame in batch:
+                yield frame
+
+
+class _Subscription:
+    """
+    一个订阅者的片段迭代器
+
+    订阅者在 join 时计数，离开时减一。生成器只有开始迭代后 finally 才会执行，
+    客户端在读取第一帧前断开时计数永远不会归零，生成也就不会停止；
+    这里在迭代结束、close() 或对象被回收时离开（只离开一次）。
+    """
+
+    def __init__(self, flight: _StreamFlight):
+        self._flight = flight
+        self._frames = flight._frames_from_start()
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Dict[str, Any]:
+        try:
+            return next(self._frames)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._frames.close()
+        self._flight._leave()
+
+    def __del__(self):
+        self.close()
+
+
+class SingleFlight:
+    """按键合并进行中的相同请求"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _StreamFlight] = {}
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        执行调用；相同键的调用正在进行时等待它的结果
+
+        Returns:
+            (结果, 是否复用了其他请求的结果)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def stream(self, key: str, factory: Callable[[], Iterator[Dict[str, Any]]]) -> Tuple[Iterator[Dict[str, Any]], bool]:
+        """
+        订阅流式生成；相同键的生成正在进行时加入它
+
+        Returns:
+            (片段迭代器, 是否加入了其他请求的生成)
+        """
+        with self._lock:
+            flight = self._streams.get(key)
+            joined = flight is not None and flight.join()
+            if joined:
+                self.coalesced += 1
+            else:
+                flight = _StreamFlight(factory, on_finish=lambda: self._finish_stream(key, flight))
+                flight.join()
+                self._streams[key] = flight
+        if not joined:
+            flight.start()
+        return flight.subscribe(), joined
+
+    def _finish_stream(self, key: str, flight: _StreamFlight):
+        with self._lock:
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls) + len(self._streams),
+                "coalesced": self.coalesced
+            }
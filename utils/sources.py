@@ -0,0 +1,454 @@
+"""
+模型来源模块 - Hugging Face Hub、本地目录/NFS 以及局域网内其他实例
+
+MODEL_SOURCES 按顺序列出来源，前面的来源不可用或没有该模型时依次回退：
+
+    hf                        Hugging Face Hub
+    /mnt/models 或 dir:/path  本地目录（镜像目录或另一个实例的 models 目录）
+    http://10.0.0.5:8000      另一个 python-llm 实例（或 `llm serve-store` 启动的存储服务）
+
+对等实例按内容（SHA-256）提供文件：GET /blobs/sha256-<hex>。多个对等实例都有该文件时，
+按探测到的往返延迟选择最近的一个，传输中途失败时可从其他实例断点续传（内容相同）。
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.blobs import link_file
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 1024 * 1024
+# 对等实例模型信息的缓存时间（秒）
+_INFO_TTL = 30.0
+
+
+def normalize_digest(digest: str) -> str:
+    """把 sha256:<hex> / sha256-<hex> / <hex> 统一为 sha256:<hex>"""
+    digest = digest.strip().lower()
+    for prefix in ("sha256:", "sha256-"):
+        if digest.startswith(prefix):
+            digest = digest[len(prefix):]
+            break
+    if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+        raise ValueError(f"无效的 digest: {digest}")
+    return f"sha256:{digest}"
+
+
+class ModelSource:
+    """
+    模型来源
+
+    list_files 返回 None 表示该来源没有这个仓库（或不可用），由下一个来源处理。
+    """
+
+    name = "source"
+
+    def list_files(self, repo_id: str) -> Optional[List[str]]:
+        """仓库中可获取的GGUF文件"""
+        return None
+
+    def sha256(self, repo_id: str, filename: str) -> Optional[str]:
+        """文件的 digest（sha256:<hex>），未知时返回None"""
+        return None
+
+    def fetch(self, repo_id: str, filename: str, digest: Optional[str], dest: str) -> Optional[str]:
+        """
+        获取文件并写到 dest，失败时抛出异常
+
+        Returns:
+            传输过程中已校验的 digest；未校验时返回None，由调用方计算
+        """
+        raise NotImplementedError
+
+    def __repr__(self):
+        return self.name
+
+
+class HubSource(ModelSource):
+    """Hugging Face Hub"""
+
+    name = "hf"
+
+    def list_files(self, repo_id: str) -> Optional[List[str]]:
+        try:
+            # 延迟导入，list/delete 等元数据命令无需加载 huggingface_hub
+            from huggingface_hub import list_repo_files
+            files = list_repo_files(repo_id)
+        except Exception as e:
+            logger.error(f"查找GGUF文件失败: {str(e)}")
+            return None
+        return [f for f in files if f.endswith('.gguf')]
+
+    def sha256(self, repo_id: str, filename: str) -> Optional[str]:
+        """查询远端文件的 SHA-256（LFS元数据），查询失败返回None"""
+        try:
+            from huggingface_hub import HfApi
+            infos = HfApi().get_paths_info(repo_id, [filename], expand=True)
+        except Exception as e:
+            logger.debug(f"查询文件哈希失败 {repo_id}/{filename}: {str(e)}")
+            return None
+        for info in infos:
+            lfs = getattr(info, "lfs", None)
+            sha256 = getattr(lfs, "sha256", None) or (lfs.get("sha256") if isinstance(lfs, dict) else None)
+            if sha256:
+                return f"sha256:{sha256}"
+        return None
+
+    def fetch(self, repo_id: str, filename: str, digest: Optional[str], dest: str) -> Optional[str]:
+        from huggingface_hub import hf_hub_download
+        path = hf_hub_download(repo_id=repo_id, filename=filename, local_dir=str(Path(dest).parent))
+        if os.path.abspath(path) != os.path.abspath(dest):
+            os.replace(path, dest)
+        return None
+
+
+class DirectorySource(ModelSource):
+    """
+    本地目录（可以是NFS挂载）
+
+    支持两种布局：另一个实例的 models 目录（含 models_info.json 和 blobs/），
+    或按仓库存放的镜像目录（<root>/<org>/<repo>/*.gguf 或 <root>/<org>_<repo>/*.gguf）。
+    文件优先硬链接（同一文件系统），其次 reflink，最后复制。
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root).expanduser()
+        self.name = f"dir:{self.root}"
+
+    def _catalog(self) -> Dict[str, Any]:
+        catalog_file = self.root / "models_info.json"
+        if not catalog_file.exists():
+            return {}
+        try:
+            with open(catalog_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取 {catalog_file} 失败: {str(e)}")
+            return {}
+
+    def _repo_dir(self, repo_id: str) -> Optional[Path]:
+        for candidate in (self.root / repo_id, self.root / repo_id.replace("/", "_")):
+            if candidate.is_dir():
+                return candidate
+        return None
+
+    def _catalog_file(self, repo_id: str, filename: str) -> Optional[Path]:
+        """另一个实例的模型信息中该文件的位置（其记录的路径相对于它自己的工作目录）"""
+        info = self._catalog().get(repo_id)
+        if not info or info.get("gguf_file") != filename:
+            return None
+        if info.get("digest"):
+            blob = self.root / "blobs" / info["digest"].replace(":", "-")
+            if blob.exists():
+                return blob
+        path = self.root / Path(info["path"]).parent.name / filename
+        return path if path.exists() else None
+
+    def list_files(self, repo_id: str) -> Optional[List[str]]:
+        if not self.root.is_dir():
+            return None
+        info = self._catalog().get(repo_id)
+        if info and info.get("gguf_file") and self._catalog_file(repo_id, info["gguf_file"]):
+            return [info["gguf_file"]]
+        repo_dir = self._repo_dir(repo_id)
+        if repo_dir is None:
+            return None
+        files = sorted(p.relative_to(repo_dir).as_posix() for p in repo_dir.rglob("*.gguf"))
+        return files or None
+
+    def sha256(self, repo_id: str, filename: str) -> Optional[str]:
+        info = self._catalog().get(repo_id)
+        if info and info.get("gguf_file") == filename:
+            return info.get("digest")
+        return None
+
+    def fetch(self, repo_id: str, filename: str, digest: Optional[str], dest: str) -> Optional[str]:
+        src = None
+        if digest:
+            blob = self.root / "blobs" / digest.replace(":", "-")
+            if blob.exists():
+                src = blob
+        if src is None:
+            src = self._catalog_file(repo_id, filename)
+        if src is None:
+            repo_dir = self._repo_dir(repo_id)
+            if repo_dir is not None and (repo_dir / filename).exists():
+                src = repo_dir / filename
+        if src is None:
+            raise FileNotFoundError(f"{self.name} 中没有 {repo_id}/{filename}")
+        method = link_file(str(src), dest)
+        logger.info(f"从 {self.name} 获取 {filename} ({method})")
+        return None
+
+
+class PeerSource(ModelSource):
+    """
+    另一个 python-llm 实例
+
+    模型信息来自 GET /models/{name}，文件按内容从 GET /blobs/{digest} 获取。
+    """
+
+    def __init__(self, base_url: str, timeout: float = 10.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.name = self.base_url
+        # 一次拉取中会多次查询同一模型，短时间缓存查询结果
+        self._infos: Dict[str, Tuple[float, Optional[Dict[str, Any]]]] = {}
+
+    def _url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    def _model_info(self, repo_id: str) -> Optional[Dict[str, Any]]:
+        cached = self._infos.get(repo_id)
+        if cached is not None and time.monotonic() - cached[0] < _INFO_TTL:
+            return cached[1]
+        info = None
+        try:
+            url = self._url(f"/models/{urllib.parse.quote(repo_id, safe='/')}")
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                info = json.loads(response.read()).get("data")
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                logger.warning(f"查询 {self.name} 的模型信息失败: HTTP {e.code}")
+        except (OSError, ValueError) as e:
+            logger.warning(f"{self.name} 不可用: {str(e)}")
+        # 只有内容寻址存储中的文件才能按 digest 获取
+        if info and not (info.get("digest") and info.get("gguf_file")):
+            info = None
+        self._infos[repo_id] = (time.monotonic(), info)
+        return info
+
+    def list_files(self, repo_id: str) -> Optional[List[str]]:
+        info = self._model_info(repo_id)
+        return [info["gguf_file"]] if info else None
+
+    def sha256(self, repo_id: str, filename: str) -> Optional[str]:
+        info = self._model_info(repo_id)
+        if info and info["gguf_file"] == filename:
+            return info["digest"]
+        return None
+
+    def probe(self, digest: str) -> Optional[float]:
+        """
+        检查对方是否有该内容
+
+        Returns:
+            往返延迟（秒），没有或不可达时返回None
+        """
+        request = urllib.request.Request(self._url(f"/blobs/{digest.replace(':', '-')}"), method="HEAD")
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=min(self.timeout, 2.0)):
+                return time.perf_counter() - start
+        except (OSError, ValueError):
+            return None
+
+    def fetch(self, repo_id: str, filename: str, digest: Optional[str], dest: str) -> Optional[str]:
+        if not digest:
+            raise ValueError(f"{self.name} 只能按 digest 获取文件")
+        part = f"{dest}.part"
+        hasher = hashlib.sha256()
+        offset = 0
+        # 之前中断的传输（可能来自其他对等实例，内容相同）接着下载
+        if os.path.exists(part):
+            with open(part, "rb") as f:
+                for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                    hasher.update(chunk)
+                    offset += len(chunk)
+
+        request = urllib.request.Request(self._url(f"/blobs/{digest.replace(':', '-')}"))
+        if offset:
+            request.add_header("Range", f"bytes={offset}-")
+        start = time.perf_counter()
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if offset and response.status != 206:
+                # 对方不支持断点续传，从头开始
+                hasher = hashlib.sha256()
+                offset = 0
+            received = 0
+            with open(part, "ab" if offset else "wb") as f:
+                for chunk in iter(lambda: response.read(_CHUNK_SIZE), b""):
+                    f.write(chunk)
+                    hasher.update(chunk)
+                    received += len(chunk)
+
+        actual = f"sha256:{hasher.hexdigest()}"
+        if actual != digest:
+            os.remove(part)
+            if offset:
+                # 续传的前半部分已损坏，从头重新下载一次
+                logger.warning(f"续传的文件校验失败，从 {self.name} 重新下载 {filename}")
+                return self.fetch(repo_id, filename, digest, dest)
+            raise ValueError(f"文件校验失败: 期望 {digest}，实际 {actual}")
+        os.replace(part, dest)
+        elapsed = max(time.perf_counter() - start, 1e-6)
+        logger.info(f"从 {self.name} 获取 {filename}: {received / 1024 / 1024:.1f} MB，{received / 1024 / 1024 / elapsed:.1f} MB/s")
+        return actual
+
+
+def parse_sources(spec: str) -> List[ModelSource]:
+    """
+    解析来源列表（逗号分隔，顺序即回退顺序）
+
+    Args:
+        spec: 如 "http://10.0.0.5:8000,/mnt/models,hf"
+    """
+    sources: List[ModelSource] = []
+    for item in (s.strip() for s in spec.split(",")):
+        if not item:
+            continue
+        if item in ("hf", "hub", "huggingface"):
+            sources.append(HubSource())
+        elif item.startswith(("http://", "https://")):
+            sources.append(PeerSource(item))
+        elif item.startswith("dir:"):
+            sources.append(DirectorySource(item[4:]))
+        else:
+            sources.append(DirectorySource(item))
+    return sources or [HubSource()]
+
+
+def fetch_order(sources: List[ModelSource], digest: Optional[str]) -> List[ModelSource]:
+    """
+    获取文件时尝试来源的顺序
+
+    保持配置的顺序，其中的对等实例并发探测，只保留有该内容的实例并按延迟从近到远排列。
+    """
+    peers = [s for s in sources if isinstance(s, PeerSource)]
+    if not peers or not digest:
+        return [s for s in sources if not isinstance(s, PeerSource) or digest]
+
+    latency: Dict[int, Optional[float]] = {}
+
+    def probe(peer):
+        latency[id(peer)] = peer.probe(digest)
+
+    threads = [threading.Thread(target=probe, args=(peer,), daemon=True) for peer in peers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    nearest = sorted(
+        (p for p in peers if latency.get(id(p)) is not None),
+        key=lambda p: latency[id(p)]
+    )
+    if nearest:
+        logger.info("可用的对等实例: " + ", ".join(f"{p.name} ({latency[id(p)] * 1000:.1f} ms)" for p in nearest))
+
+    order: List[ModelSource] = []
+    for source in sources:
+        if isinstance(source, PeerSource):
+            if source is peers[0]:
+                order.extend(nearest)
+        else:
+            order.append(source)
+    return order
+
+
+class _StoreHandler(BaseHTTPRequestHandler):
+    """只读的存储服务：GET /models/{name}、GET|HEAD /blobs/{digest}"""
+
+    server_version = "python-llm-store"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.info("%s - %s" % (self.address_string(), format % args))
+
+    def _json(self, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _blob(self, head: bool):
+        try:
+            digest = normalize_digest(urllib.parse.unquote(self.path[len("/blobs/"):]))
+        except ValueError as e:
+            return self._json(400, {"detail": str(e)})
+        blob = self.server.store_root / "blobs" / digest.replace(":", "-")
+        if not blob.exists():
+            return self._json(404, {"detail": "内容不存在"})
+
+        size = blob.stat().st_size
+        start, end, status = 0, size - 1, 200
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            first, _, last = range_header[6:].partition("-")
+            try:
+                if first:
+                    start = int(first)
+                    end = min(int(last), size - 1) if last else size - 1
+                else:
+                    # bytes=-N 表示最后N个字节
+                    start = max(size - int(last), 0)
+            except ValueError:
+                start, end = size, -1
+            # 格式错误（含多段范围）或超出文件大小的范围无法满足
+            if start < 0 or start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(max(end - start + 1, 0)))
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if head:
+            return
+        with open(blob, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def do_HEAD(self):
+        if self.path.startswith("/blobs/"):
+            return self._blob(head=True)
+        self._json(404, {"detail": "Not Found"})
+
+    def do_GET(self):
+        if self.path.startswith("/blobs/"):
+            return self._blob(head=False)
+        if self.path.startswith("/models/"):
+            name = urllib.parse.unquote(self.path[len("/models/"):])
+            catalog_file = self.server.store_root / "models_info.json"
+            catalog = json.loads(catalog_file.read_text(encoding="utf-8")) if catalog_file.exists() else {}
+            info = catalog.get(name)
+            if info is None:
+                return self._json(404, {"detail": "模型不存在"})
+            return self._json(200, {"success": True, "data": info})
+        self._json(404, {"detail": "Not Found"})
+
+
+def serve_store(models_dir: str, host: str = "0.0.0.0", port: int = 8001) -> ThreadingHTTPServer:
+    """
+    创建只读的模型存储服务（不加载推理后端），可作为镜像或本地测试用的对等实例
+
+    Returns:
+        服务器对象，调用 serve_forever() 开始服务
+    """
+    server = ThreadingHTTPServer((host, port), _StoreHandler)
+    server.daemon_threads = True
+    server.store_root = Path(models_dir)
+    return server
@@ -0,0 +1,117 @@
+"""
+停止词匹配模块 - 基于 Aho-Corasick 自动机的增量匹配
+
+流式输出时逐段喂入生成的文本：可能是某个停止词前缀的尾部先扣住不输出，
+确认不构成停止词后再放行，因此停止词的任何部分都不会泄漏给客户端。
+每个字符的匹配开销与停止词数量和长度无关。
+"""
+from functools import lru_cache
+from typing import Dict, List, Sequence, Tuple
+
+
+class StopAutomaton:
+    """由一组停止词构建的只读自动机，可被多个请求共享"""
+
+    def __init__(self, stops: Sequence[str]):
+        self.stops = tuple(s for s in dict.fromkeys(stops) if s)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._depth: List[int] = [0]
+        # 以该状态结尾的最长停止词长度（沿失败链合并），0表示没有
+        self._match: List[int] = [0]
+        self._fail: List[int] = [0]
+
+        for stop in self.stops:
+            state = 0
+            for ch in stop:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._depth.append(self._depth[state] + 1)
+                    self._match.append(0)
+                    self._fail.append(0)
+                state = nxt
+            self._match[state] = max(self._match[state], len(stop))
+
+        # 按层构建失败指针
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, nxt in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._match[nxt] = max(self._match[nxt], self._match[self._fail[nxt]])
+                queue.append(nxt)
+
+    def step(self, state: int, ch: str) -> int:
+        """状态转移"""
+        goto = self._goto
+        while state and ch not in goto[state]:
+            state = self._fail[state]
+        return goto[state].get(ch, 0)
+
+    def scanner(self) -> "StopScanner":
+        """为一次生成创建扫描器"""
+        return StopScanner(self)
+
+
+class StopScanner:
+    """一次生成的匹配状态"""
+
+    __slots__ = ("_automaton", "_state", "_pending", "stopped", "matched")
+
+    def __init__(self, automaton: StopAutomaton):
+        self._automaton = automaton
+        self._state = 0
+        # 已生成但尚未放行的文本（可能是停止词的前缀）
+        self._pending = ""
+        self.stopped = False
+        self.matched = None
+
+    def feed(self, text: str) -> Tuple[str, bool]:
+        """
+        喂入新生成的文本
+
+        Returns:
+            (可以安全输出的文本, 是否命中停止词)；命中后输出的是停止词之前的全部文本
+        """
+        if self.stopped:
+            return "", True
+        automaton = self._automaton
+        pending = self._pending + text
+        state = self._state
+        base = len(self._pending)
+        for i, ch in enumerate(text):
+            state = automaton.step(state, ch)
+            length = automaton._match[state]
+            if length:
+                # 停止词以当前字符结尾，输出停止词之前的部分
+                end = base + i + 1
+                self.stopped = True
+                self.matched = pending[end - length:end]
+                self._pending = ""
+                self._state = 0
+                return pending[:end - length], True
+
+        self._state = state
+        # 尾部 depth 个字符仍可能组成停止词，先扣住
+        hold = automaton._depth[state]
+        if hold:
+            self._pending = pending[-hold:]
+            return pending[:-hold], False
+        self._pending = ""
+        return pending, False
+
+    def flush(self) -> str:
+        """生成结束（未命中停止词）时放行扣住的文本"""
+        pending, self._pending = self._pending, ""
+        return "" if self.stopped else pending
+
+
+@lru_cache(maxsize=256)
+def get_automaton(stops: Tuple[str, ...]) -> StopAutomaton:
+    """获取（缓存的）停止词自动机"""
+    return StopAutomaton(stops)
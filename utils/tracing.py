@@ -0,0 +1,178 @@
+"""
+请求追踪模块 - 每个请求一个追踪ID，按阶段记录耗时
+"""
+import time
+import uuid
+import json
+import threading
+import contextvars
+import logging
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """一次请求的追踪记录"""
+
+    __slots__ = ("trace_id", "name", "attrs", "started_at", "_t0", "spans", "status", "error", "duration_ms")
+
+    def __init__(self, name: str, trace_id: Optional[str] = None, **attrs):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.status = "ok"
+        self.error: Optional[str] = None
+        self.duration_ms: Optional[float] = None
+
+    def offset_ms(self, t: Optional[float] = None) -> float:
+        """相对追踪开始的毫秒偏移"""
+        return ((t if t is not None else time.perf_counter()) - self._t0) * 1000
+
+    def add_span(self, name: str, start_ms: float, duration_ms: float, **attrs):
+        """记录一个阶段"""
+        span = {"name": name, "start_ms": round(start_ms, 3), "duration_ms": round(duration_ms, 3)}
+        if attrs:
+            span.update(attrs)
+        self.spans.append(span)
+
+    def set_error(self, error: str):
+        self.status = "error"
+        self.error = error
+
+    def finish(self):
+        if self.duration_ms is None:
+            self.duration_ms = round(self.offset_ms(), 3)
+
+    def stage_totals(self) -> Dict[str, float]:
+        """按阶段名汇总耗时"""
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span["name"]] = round(totals.get(span["name"], 0.0) + span["duration_ms"], 3)
+        return totals
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "error": self.error,
+            "attrs": self.attrs,
+            "stages": self.stage_totals(),
+            "spans": self.spans
+        }
+
+
+class TraceStore:
+    """已完成追踪的环形缓冲区，可选写入JSONL文件"""
+
+    def __init__(self, max_size: int = 1000, log_file: Optional[str] = None):
+        self._traces: deque = deque(maxlen=max_size)
+        self._lock = threading.Lock()
+        self.log_file = log_file
+
+    def add(self, trace: Trace):
+        record = trace.to_dict()
+        with self._lock:
+            self._traces.append(record)
+            if self.log_file:
+                try:
+                    with open(self.log_file, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                except OSError as e:
+                    logger.warning(f"写入追踪日志失败: {str(e)}")
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            for record in self._traces:
+                if record["trace_id"] == trace_id:
+                    return record
+        return None
+
+    def query(
+        self,
+        since_seconds: Optional[float] = 3600,
+        slowest: Optional[int] = None,
+        name: Optional[str] = None,
+        status: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        查询追踪记录
+
+        Args:
+            since_seconds: 只返回最近多少秒内开始的请求，None表示全部
+            slowest: 按耗时取最慢的N条，None表示按时间倒序返回全部
+            name: 按请求名称过滤（如 "POST /generate"）
+            status: 按状态过滤（ok/error）
+        """
+        cutoff = time.time() - since_seconds if since_seconds else 0
+        with self._lock:
+            records = [
+                r for r in self._traces
+                if r["started_at"] >= cutoff
+                and (name is None or r["name"] == name)
+                and (status is None or r["status"] == status)
+            ]
+        if slowest:
+            records.sort(key=lambda r: r["duration_ms"] or 0, reverse=True)
+            return records[:slowest]
+        records.reverse()
+        return records
+
+    def clear(self):
+        with self._lock:
+            self._traces.clear()
+
+
+trace_store = TraceStore(config.TRACE_BUFFER_SIZE, config.TRACE_LOG_FILE or None)
+
+
+def start_trace(name: str, trace_id: Optional[str] = None, **attrs) -> Trace:
+    """开始一个追踪并设为当前上下文的追踪"""
+    trace = Trace(name, trace_id, **attrs)
+    _current_trace.set(trace)
+    return trace
+
+
+def finish_trace(trace: Trace):
+    """结束追踪并写入缓冲区"""
+    trace.finish()
+    trace_store.add(trace)
+
+
+def current_trace() -> Optional[Trace]:
+    """当前上下文的追踪，没有时返回None"""
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """记录一个阶段的耗时，没有当前追踪时不做任何事"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        trace.add_span(name, trace.offset_ms(start), (end - start) * 1000, **attrs)
+
+
+def record_error(error: str):
+    """把错误记录到当前追踪"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.set_error(error)
@@ -0,0 +1,164 @@
+"""
+使用统计模块 - 记录各模型的请求时间，按时段和最近的请求速率预测即将到来的请求
+
+统计保存在模型目录下的 usage.json（与 models_info.json 分开），每个模型一项：
+- hourly: 按本地时间的小时（0~23）累计的请求数，按 USAGE_HALF_LIFE_DAYS 指数衰减，
+  反映每天的使用规律
+- recent: 最近若干次请求的时间戳，反映当前的请求速率
+- first_seen / decayed_at / requests: 首次请求时间、上次衰减的时间、总请求数
+
+多个工作进程共用同一个文件：请求只追加到本进程待写入的列表，UsageStore.flush 在文件锁下
+重新读取文件、并入待写入的请求后写回，各进程的统计互相累加而不会覆盖。
+"""
+import os
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import config
+from utils.filelock import file_lock
+
+logger = logging.getLogger(__name__)
+
+# 保留的最近请求时间戳数量
+RECENT_LIMIT = 64
+# 计算最近请求速率的时间窗口（秒）
+RECENT_WINDOW = 3600
+_DAY = 86400
+
+
+def _decay(seconds: float) -> float:
+    """经过 seconds 秒后计数保留的比例"""
+    return 0.5 ** (max(seconds, 0) / (config.USAGE_HALF_LIFE_DAYS * _DAY))
+
+
+def record_request(usage: Dict[str, Any], now: Optional[float] = None):
+    """在 usage 中记录一次请求（空字典时初始化，调用方负责持久化）"""
+    now = now or time.time()
+    if not usage:
+        usage.update({
+            "hourly": [0.0] * 24,
+            "recent": [],
+            "first_seen": now,
+            "decayed_at": now,
+            "requests": 0
+        })
+    # 衰减按小时批量进行，避免每次请求都重写整个数组
+    elapsed = now - usage["decayed_at"]
+    if elapsed >= 3600:
+        factor = _decay(elapsed)
+        usage["hourly"] = [round(count * factor, 4) for count in usage["hourly"]]
+        usage["decayed_at"] = now
+    usage["hourly"][time.localtime(now).tm_hour] += 1
+    usage["recent"].append(round(now, 1))
+    del usage["recent"][:-RECENT_LIMIT]
+    usage["requests"] += 1
+
+
+def expected_requests(usage: Optional[Dict[str, Any]], now: float, lookahead: float) -> Dict[str, float]:
+    """
+    预测未来 lookahead 秒内的请求数
+
+    - time_of_day: 历史上这些时段平均每天的请求数（衰减加权平均）
+    - recent: 按最近一小时的请求速率外推
+
+    两者任一较高都说明模型即将被使用，expected 取较大值。
+    """
+    if not usage:
+        return {"time_of_day": 0.0, "recent": 0.0, "expected": 0.0}
+
+    # 衰减加权的计数除以各天权重之和，得到平均每天的请求数
+    days = max(1.0, (now - usage["first_seen"]) / _DAY)
+    daily = _decay(_DAY)
+    weight = (1 - daily ** days) / (1 - daily) if daily < 1 else days
+    stale = _decay(now - usage["decayed_at"])
+
+    # 预测窗口可能跨越多个小时，按各小时内的时长累加
+    time_of_day = 0.0
+    start, end = now, now + lookahead
+    while start < end:
+        local = time.localtime(start)
+        boundary = start + max(3600 - local.tm_min * 60 - local.tm_sec - start % 1, 1)
+        segment = min(boundary, end) - start
+        time_of_day += usage["hourly"][local.tm_hour] * stale / weight * segment / 3600
+        start += segment
+
+    recent_count = sum(1 for ts in usage["recent"] if ts >= now - RECENT_WINDOW)
+    recent = recent_count / RECENT_WINDOW * lookahead
+    return {
+        "time_of_day": round(time_of_day, 3),
+        "recent": round(recent, 3),
+        "expected": round(max(time_of_day, recent), 3)
+    }
+
+
+class UsageStore:
+    """
+    各模型的请求统计
+
+    Args:
+        path: 统计文件路径
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._lock_file = self.path.with_suffix(".lock")
+        # 尚未写入文件的请求时间，由请求线程追加
+        self._pending: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+        # 最近一次读取或写入的统计，只整体替换、不原地修改，可以在锁外读取
+        self.usage: Dict[str, Dict[str, Any]] = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取请求统计 {self.path} 失败: {str(e)}")
+            return {}
+
+    def record(self, model_name: str, now: Optional[float] = None):
+        """记录一次请求（只追加到内存，随下次 flush 写入）"""
+        now = now or time.time()
+        with self._lock:
+            self._pending.setdefault(model_name, []).append(now)
+
+    def get(self, model_name: str) -> Optional[Dict[str, Any]]:
+        return self.usage.get(model_name)
+
+    def flush(self) -> bool:
+        """
+        在文件锁下读取最新的统计，并入本进程待写入的请求后写回
+
+        Returns:
+            是否写入了文件
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        try:
+            with file_lock(self._lock_file):
+                usage = self._load()
+                if pending:
+                    for model_name, times in pending.items():
+                        entry = usage.setdefault(model_name, {})
+                        for now in times:
+                            record_request(entry, now)
+                    tmp_file = self.path.with_suffix(f".json.{os.getpid()}.tmp")
+                    with open(tmp_file, 'w', encoding='utf-8') as f:
+                        json.dump(usage, f, ensure_ascii=False)
+                    os.replace(tmp_file, self.path)
+        except OSError as e:
+            # 写入失败时放回待写入的请求，下次重试
+            with self._lock:
+                for model_name, times in pending.items():
+                    self._pending[model_name] = times + self._pending.get(model_name, [])
+            logger.warning(f"保存请求统计 {self.path} 失败: {str(e)}")
+            return False
+        # 没有待写入的请求时也重新读取，得到其他工作进程写入的统计
+        self.usage = usage
+        return bool(pending)